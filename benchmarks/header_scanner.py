@@ -0,0 +1,65 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+"""Benchmark finding header comments on pathological inputs.
+
+The comment scanners are compared with the regular expressions they replaced on
+inputs of growing size, such as minified bundles full of unterminated ``/*`` and very
+long block comments. The regular expressions are skipped once they get too slow.
+
+Run with ``python benchmarks/header_scanner.py``.
+"""
+
+import re
+import timeit
+from collections.abc import Callable
+from functools import partial
+
+from unbeheader import SLASH_LINE_SCANNER
+
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+REPEAT = 3
+# The time after which the regular expression is not run on larger inputs anymore
+REGEX_TIMEOUT = 0.1
+
+SLASH_LINE_REGEX = re.compile(r'/\*(.|[\r\n])*?\*/|((^//|[\r\n]//).*)*')
+
+INPUTS: dict[str, Callable[[int], str]] = {
+    'unterminated block comments': lambda size: 'var s="/*";' * (size // 11),
+    'long block comment': lambda size: '/*' + ' *\n' * (size // 3) + '*/',
+    'many line comments': lambda size: '// Do what thou wilt\n' * (size // 21),
+    'minified code': lambda size: '// header\n' + 'a=b/c*d;' * (size // 8),
+}
+
+
+def _find_with_regex(content: str) -> list[tuple[int, int]]:
+    return [match.span() for match in SLASH_LINE_REGEX.finditer(content) if match.group()]
+
+
+def _find_with_scanner(content: str) -> list[tuple[int, int]]:
+    return list(SLASH_LINE_SCANNER.finditer(content))
+
+
+def _time(func: Callable[[], object]) -> float:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(REPEAT, number)) / number
+
+
+def main() -> None:
+    print(f'{"input":<30} {"size":>12} {"regex":>12} {"scanner":>12}')
+    for name, generate in INPUTS.items():
+        regex_timing: float | None = 0
+        for size in SIZES:
+            content = generate(size)
+            if regex_timing is not None and regex_timing < REGEX_TIMEOUT:
+                regex_timing = _time(partial(_find_with_regex, content))
+            else:
+                regex_timing = None
+            scanner_timing = _time(partial(_find_with_scanner, content))
+            regex_column = f'{regex_timing * 1000:>10.3f}ms' if regex_timing is not None else f'{"-":>12}'
+            print(f'{name:<30} {size:>12,} {regex_column} {scanner_timing * 1000:>10.3f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+"""Benchmark the memory allocated to update the header of large files.
+
+The peak memory allocated while updating the content of a file is traced and reported
+as the number of copies of the file it amounts to. Only the start of a file up to its last
+header is copied, so this is expected to be close to none unless a header follows some code.
+
+Run with ``python benchmarks/header_splicing.py``.
+"""
+
+import time
+import tracemalloc
+from collections.abc import Callable
+
+from unbeheader import SUPPORTED_FILE_TYPES
+from unbeheader.config import DEFAULT_SUBSTRING
+from unbeheader.config import HeaderConfig
+from unbeheader.headers import _update_content
+
+YEAR = 1947
+SIZES = (1_000_000, 10_000_000, 50_000_000)
+
+TEMPLATE = '''\
+{comment_start} This file is part of Thelema.
+{comment_middle} Copyright (C) {dates} {owner}
+{comment_end}
+'''
+HEADER = b'# This file is part of Thelema.\n# Copyright (C) 1904 - 1947 Ordo Templi Orientis\n'
+OLD_HEADER = b'# This file is part of Thelema.\n# Copyright (C) 1904 Ordo Templi Orientis\n'
+LINE = b"print('Beware of the knowledge you will gain.')  # Do what thou wilt shall be the whole of the Law.\n"
+
+CASES: dict[str, Callable[[bytes], bytes]] = {
+    'outdated header': lambda body: OLD_HEADER + b'\n' + body,
+    'missing header': lambda body: body,
+    'shebang': lambda body: b'#!/usr/bin/env python\n' + OLD_HEADER + b'\n\n\n' + body,
+    'two headers': lambda body: OLD_HEADER + b'\n' + body + b'\n' + OLD_HEADER + b'\n' + body,
+    'unchanged': lambda body: HEADER + b'\n' + body + HEADER + b'\n' + body,
+}
+
+
+def main() -> None:
+    data = {'owner': 'Ordo Templi Orientis', 'start_year': 1904, 'end_year': YEAR, 'template': TEMPLATE,
+            'substring': DEFAULT_SUBSTRING}
+    config = HeaderConfig(data)
+    file_type = SUPPORTED_FILE_TYPES['py']
+    # Render the header beforehand, as it is shared by all the files
+    config.encode_header(file_type.comments)
+    print(f'{"case":<16} {"size":>12} {"time":>10} {"copies":>8}')
+    for size in SIZES:
+        body = LINE * (size // len(LINE))
+        for name, make_content in CASES.items():
+            content = make_content(body)
+            tracemalloc.start()
+            start_time = time.perf_counter()
+            updated = _update_content(content, config, file_type.scanner, file_type.comments)
+            elapsed = time.perf_counter() - start_time
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            assert updated is not None
+            del updated
+            print(f'{name:<16} {len(content):>12,} {elapsed * 1000:>8.1f}ms {peak / len(content):>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+"""Benchmark the cost of checking a header depending on the size of the file.
+
+The header of files of growing size is checked with and without a bounded header
+window. With a window, the time per file is expected to stay flat.
+
+Run with ``python benchmarks/header_window.py``.
+"""
+
+import tempfile
+import timeit
+from pathlib import Path
+
+from unbeheader.config import CONFIG_FILE_NAME
+from unbeheader.config import ConfigResolver
+from unbeheader.headers import process_header
+
+YEAR = 1947
+SIZES = (10_000, 100_000, 1_000_000, 10_000_000)
+REPEAT = 5
+
+CONFIG = '''
+owner: Ordo Templi Orientis
+start_year: 1904
+template: |-
+  {comment_start} This file is part of Thelema.
+  {comment_middle} Copyright (C) {dates} {owner}
+  {comment_end}
+'''
+HEADER = '# This file is part of Thelema.\n# Copyright (C) 1904 - 1947 Ordo Templi Orientis\n\n'
+LINE = "print('Beware of the knowledge you will gain.')  # Do what thou wilt shall be the whole of the Law.\n"
+
+
+def _time_check(file_path: Path, resolver: ConfigResolver) -> float:
+    timer = timeit.Timer(lambda: process_header(file_path, YEAR, check=True, resolver=resolver))
+    number, _ = timer.autorange()
+    return min(timer.repeat(REPEAT, number)) / number
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root_path = Path(tmp_dir)
+        full_path = root_path / 'full'
+        window_path = root_path / 'window'
+        for dir_path, config in ((full_path, CONFIG), (window_path, f'{CONFIG}max_header_lines: 20\n')):
+            dir_path.mkdir()
+            (dir_path / CONFIG_FILE_NAME).write_text(config)
+        print(f'{"size":>12} {"full scan":>12} {"window":>12}')
+        for size in SIZES:
+            content = HEADER + LINE * (size // len(LINE))
+            timings = []
+            for dir_path in (full_path, window_path):
+                file_path = dir_path / f'manuscript_{size}.py'
+                file_path.write_text(content)
+                timings.append(_time_check(file_path, ConfigResolver()))
+            print(f'{size:>12,} {timings[0] * 1000:>10.3f}ms {timings[1] * 1000:>10.3f}ms')
+
+
+if __name__ == '__main__':
+    main()
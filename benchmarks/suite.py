@@ -0,0 +1,227 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+"""Benchmark the ``unbehead`` command on a synthetic repository.
+
+A tree of files is generated from the given options, and the command is run on it in
+directory, repository and single-file mode, both checking and fixing the headers. Every
+benchmark runs the command in a new process, as users do, and reports its best wall
+time, the throughput in files per second and its peak memory.
+
+The results can be written as JSON with ``--output`` and compared against a previous
+run with ``--baseline``, failing when any benchmark got slower or used more memory than
+allowed by ``--threshold``.
+
+Run with ``python benchmarks/suite.py``, or ``python benchmarks/suite.py --help`` for
+all the options.
+"""
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+from typing import NamedTuple
+
+import click
+from synthetic import GeneratedTree
+from synthetic import TreeSpec
+from synthetic import generate_tree
+
+from unbeheader import SUPPORTED_FILE_TYPES
+
+YEAR = 1947
+MODES = ('directory', 'repo', 'file')
+DEFAULT_SPEC = TreeSpec()
+
+
+class Benchmark(NamedTuple):
+    # The name the benchmark is compared by
+    name: str
+    # The arguments passed to the command
+    args: list[str]
+    # Whether the command modifies the tree, which must be copied for every run
+    fix: bool
+    # The number of files processed by the command
+    file_count: int
+
+
+class BenchmarkResult(NamedTuple):
+    # The name of the benchmark
+    name: str
+    # The number of files processed
+    files: int
+    # The best wall time in seconds
+    wall_time: float
+    # The number of files processed per second in the best run
+    throughput: float
+    # The peak memory of the command in bytes, including its worker processes
+    peak_memory: int
+
+
+@click.command()
+@click.option('--files', type=click.IntRange(1), default=DEFAULT_SPEC.files, show_default=True,
+              help='The number of files in the tree')
+@click.option('--depth', type=click.IntRange(0), default=DEFAULT_SPEC.depth, show_default=True,
+              help='The depth of the directories holding the files')
+@click.option('--extensions', default=','.join(DEFAULT_SPEC.extensions), show_default=True,
+              help='The comma-separated extensions of the files')
+@click.option('--overrides', type=click.FloatRange(0, 1), default=DEFAULT_SPEC.overrides, show_default=True,
+              help='The fraction of directories with a .header.yaml file')
+@click.option('--excluded', type=click.FloatRange(0, 1), default=DEFAULT_SPEC.excluded, show_default=True,
+              help='The fraction of directories with a .no-header file')
+@click.option('--shebangs', type=click.FloatRange(0, 1), default=DEFAULT_SPEC.shebangs, show_default=True,
+              help='The fraction of hash-commented files with a shebang line')
+@click.option('--stale', type=click.FloatRange(0, 1), default=DEFAULT_SPEC.stale, show_default=True,
+              help='The fraction of files with an outdated or missing header')
+@click.option('--lines', type=click.IntRange(0), default=DEFAULT_SPEC.lines, show_default=True,
+              help='The number of lines after the header of every file')
+@click.option('--large-files', type=click.IntRange(0), default=DEFAULT_SPEC.large_files, show_default=True,
+              help='The number of large files')
+@click.option('--large-size', type=click.IntRange(0), default=DEFAULT_SPEC.large_size, show_default=True,
+              help='The size of the large files in bytes')
+@click.option('--seed', type=int, default=DEFAULT_SPEC.seed, show_default=True, help='The seed of the generated tree')
+@click.option('--mode', 'modes', type=click.Choice(MODES), multiple=True, default=MODES, show_default=True,
+              help='The modes to benchmark, which can be repeated')
+@click.option('--jobs', '-j', type=click.IntRange(1), default=1, show_default=True,
+              help='The number of jobs the command runs with')
+@click.option('--repeat', type=click.IntRange(1), default=3, show_default=True,
+              help='The number of runs of every benchmark, of which the best one is reported')
+@click.option('--output', '-o', type=click.Path(dir_okay=False, path_type=Path),
+              help='Write the results as JSON to a file, or to the standard output if -')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False, path_type=Path),
+              help='Compare the results with the JSON results of a previous run')
+@click.option('--threshold', type=click.FloatRange(0), default=0.1, show_default=True,
+              help='The fraction by which wall time or peak memory can exceed the baseline')
+def main(files: int, depth: int, extensions: str, overrides: float, excluded: float, shebangs: float, stale: float,
+         lines: int, large_files: int, large_size: int, seed: int, modes: tuple[str, ...], jobs: int, repeat: int,
+         output: Path | None, baseline: Path | None, threshold: float) -> None:
+    ext_list = tuple(ext.strip().lstrip('.') for ext in extensions.split(',') if ext.strip())
+    if unsupported := [ext for ext in ext_list if ext not in SUPPORTED_FILE_TYPES]:
+        raise click.BadParameter(f'unsupported extension {unsupported[0]}', param_hint='--extensions')
+    spec = TreeSpec(files, depth, ext_list, overrides, excluded, shebangs, stale, lines, large_files, large_size, seed)
+    # The table goes to stderr when the JSON results are written to stdout
+    log_stream = sys.stderr if output == Path('-') else sys.stdout
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tree_path = Path(tmp_dir, 'tree')
+        tree_path.mkdir()
+        start_time = time.perf_counter()
+        tree = generate_tree(tree_path, spec, YEAR)
+        if 'repo' in modes:
+            _init_repo(tree_path)
+        click.echo(f'Generated {tree.file_count:,} files ({tree.stale_count:,} stale, {tree.excluded_count:,} '
+                   f'excluded) in {time.perf_counter() - start_time:.1f}s', file=log_stream)
+        click.echo(f'{"benchmark":<16} {"files":>10} {"wall time":>12} {"files/s":>12} {"peak memory":>12}',
+                   file=log_stream)
+        results = []
+        for benchmark in _get_benchmarks(tree, modes, jobs):
+            result = _run_benchmark(benchmark, tree_path, Path(tmp_dir, 'run'), repeat)
+            results.append(result)
+            click.echo(f'{result.name:<16} {result.files:>10,} {result.wall_time * 1000:>10.1f}ms '
+                       f'{result.throughput:>12,.0f} {result.peak_memory / 2**20:>10.1f}MB', file=log_stream)
+    document = {
+        'spec': spec._asdict(),
+        'jobs': jobs,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [result._asdict() for result in results],
+    }
+    if output == Path('-'):
+        click.echo(json.dumps(document, indent=2))
+    elif output:
+        output.write_text(json.dumps(document, indent=2) + '\n')
+    if baseline and not _compare(document, json.loads(baseline.read_text()), threshold, log_stream):
+        sys.exit(1)
+
+
+def _get_benchmarks(tree: GeneratedTree, modes: tuple[str, ...], jobs: int) -> Iterator[Benchmark]:
+    single_path = tree.large_paths[0] if tree.large_paths else next(tree.root_path.rglob('manuscript_0.*'))
+    for mode in MODES:
+        if mode not in modes:
+            continue
+        if mode == 'directory':
+            args, file_count = ['--path', '.', '--jobs', str(jobs)], tree.file_count
+        elif mode == 'repo':
+            args, file_count = ['--jobs', str(jobs)], tree.file_count
+        else:
+            args, file_count = ['--path', single_path.relative_to(tree.root_path).as_posix()], 1
+        yield Benchmark(f'{mode}-check', ['--check', *args], False, file_count)
+        yield Benchmark(f'{mode}-fix', args, True, file_count)
+
+
+def _run_benchmark(benchmark: Benchmark, tree_path: Path, run_path: Path, repeat: int) -> BenchmarkResult:
+    wall_times = []
+    peak_memory = 0
+    for __ in range(repeat):
+        if benchmark.fix:
+            shutil.copytree(tree_path, run_path, symlinks=True)
+        wall_time, memory = _run_command(benchmark.args, run_path if benchmark.fix else tree_path)
+        wall_times.append(wall_time)
+        peak_memory = max(peak_memory, memory)
+        if benchmark.fix:
+            shutil.rmtree(run_path)
+    wall_time = min(wall_times)
+    return BenchmarkResult(benchmark.name, benchmark.file_count, wall_time, benchmark.file_count / wall_time,
+                           peak_memory)
+
+
+def _run_command(args: list[str], cwd: Path) -> tuple[float, int]:
+    """Run the command and get its wall time and peak memory in bytes."""
+    env = os.environ | {'CI': '1'}
+    start_time = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-m', 'unbeheader.cli', '--year', str(YEAR), *args], cwd=cwd, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    # Reaping the process ourselves is the only way to get the resource usage of that single process
+    _, status, rusage = os.wait4(proc.pid, 0)
+    wall_time = time.perf_counter() - start_time
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    stderr = proc.stderr.read().decode() if proc.stderr else ''
+    # Checking stale headers exits with 1 silently, while errors are reported to stderr
+    if proc.returncode not in (0, 1) or stderr:
+        raise click.ClickException(f'Running {" ".join(args)} failed:\n{stderr}')
+    # The peak resident set size is reported in bytes on macOS and in kilobytes elsewhere
+    peak_memory = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+    return wall_time, peak_memory
+
+
+def _init_repo(tree_path: Path) -> None:
+    subprocess.run(['git', 'init', '-q'], cwd=tree_path, check=True)
+    subprocess.run(['git', 'add', '-A'], cwd=tree_path, check=True)
+
+
+def _compare(document: dict[str, Any], baseline: dict[str, Any], threshold: float, log_stream: Any) -> bool:
+    """Compare the results with a baseline, reporting the changes.
+
+    Returns whether no benchmark regressed beyond the threshold.
+    """
+    # The spec is compared as loaded from JSON, where tuples become lists
+    if json.loads(json.dumps(document['spec'])) != baseline['spec'] or document['jobs'] != baseline['jobs']:
+        click.secho('The baseline was run on a different tree or with a different number of jobs', fg='yellow',
+                    file=log_stream)
+    baseline_results = {result['name']: result for result in baseline['results']}
+    click.echo(f'{"benchmark":<16} {"wall time":>12} {"peak memory":>12}', file=log_stream)
+    success = True
+    for result in document['results']:
+        if (baseline_result := baseline_results.get(result['name'])) is None:
+            continue
+        changes = []
+        regressed = False
+        for key in ('wall_time', 'peak_memory'):
+            change = result[key] / baseline_result[key] - 1
+            regressed = regressed or change > threshold
+            changes.append(f'{change:>+12.1%}')
+        click.secho(f'{result["name"]:<16} {" ".join(changes)}', fg='red' if regressed else None, file=log_stream)
+        success = success and not regressed
+    if not success:
+        click.secho(f'❌ Some benchmarks regressed by more than {threshold:.0%}', fg='red', file=log_stream)
+    return success
+
+
+if __name__ == '__main__':
+    main()
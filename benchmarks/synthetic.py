@@ -0,0 +1,148 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+"""Generate synthetic repositories to benchmark Unbeheader on.
+
+The trees are generated deterministically from a :class:`TreeSpec`, so that the same
+spec always produces the same files and the results of different runs are comparable.
+"""
+
+import math
+import random
+from pathlib import Path
+from typing import NamedTuple
+
+from unbeheader import SUPPORTED_FILE_TYPES
+from unbeheader.config import CONFIG_FILE_NAME
+from unbeheader.config import DEFAULT_SUBSTRING
+from unbeheader.config import HeaderConfig
+from unbeheader.util import EXCLUDE_FILE_NAME
+
+# The number of files placed in every leaf directory
+FILES_PER_DIR = 50
+
+TEMPLATE = '''\
+{comment_start} This file is part of Thelema.
+{comment_middle} Copyright (C) {dates} {owner}
+{comment_end}
+'''
+SHEBANG = b'#!/usr/bin/env thelema\n'
+LINE = b'do_what_thou_wilt = "shall be the whole of the Law";  // Love is the law, love under will.\n'
+
+
+class TreeSpec(NamedTuple):
+    # The number of supported files in the tree
+    files: int = 10_000
+    # The depth of the directories holding the files
+    depth: int = 3
+    # The extensions of the files, which are picked evenly
+    extensions: tuple[str, ...] = tuple(SUPPORTED_FILE_TYPES)
+    # The fraction of directories with their own .header.yaml file overriding the owner
+    overrides: float = 0.02
+    # The fraction of directories with a .no-header file excluding them
+    excluded: float = 0.02
+    # The fraction of hash-commented files starting with a shebang line
+    shebangs: float = 0.1
+    # The fraction of files whose header is outdated or missing
+    stale: float = 0.1
+    # The number of lines after the header of every file
+    lines: int = 30
+    # The number of large files, and their size in bytes
+    large_files: int = 2
+    large_size: int = 10_000_000
+    # The seed of the random choices
+    seed: int = 1904
+
+
+class GeneratedTree(NamedTuple):
+    # The root of the tree
+    root_path: Path
+    # The supported files in the tree, including the excluded ones
+    file_count: int
+    # The files excluded by a .no-header file
+    excluded_count: int
+    # The files whose header is outdated or missing, and not excluded
+    stale_count: int
+    # The large files in the tree
+    large_paths: list[Path]
+
+
+def generate_tree(root_path: Path, spec: TreeSpec, year: int) -> GeneratedTree:
+    """Generate a tree of files in a directory.
+
+    The headers of the files are up to date for the given year, except for the fraction of
+    stale files, half of which have an outdated header and the other half no header.
+
+    :param root_path: The directory to generate the files in, which must exist.
+    :param spec: The shape of the tree.
+    :param year: The year the headers are up to date for.
+    """
+    rng = random.Random(spec.seed)
+    dir_paths = _generate_dirs(root_path, spec)
+    (root_path / CONFIG_FILE_NAME).write_text('owner: Ordo Templi Orientis\nstart_year: 1904\ntemplate: |-\n'
+                                              + ''.join(f'  {line}\n' for line in TEMPLATE.splitlines()))
+    # The owner of every directory and whether it is excluded, inherited by its subdirectories
+    owners = {root_path: 'Ordo Templi Orientis'}
+    excluded = {root_path: False}
+    all_dir_paths = {path for leaf_path in dir_paths for path in _get_parents(leaf_path, root_path)}
+    for dir_path in sorted(all_dir_paths):
+        dir_path.mkdir(exist_ok=True)
+        owners[dir_path] = owners[dir_path.parent]
+        excluded[dir_path] = excluded[dir_path.parent]
+        if rng.random() < spec.overrides:
+            owners[dir_path] = f'Astrum Argenteum {dir_path.relative_to(root_path).as_posix()}'
+            (dir_path / CONFIG_FILE_NAME).write_text(f'owner: {owners[dir_path]}\n')
+        if rng.random() < spec.excluded:
+            excluded[dir_path] = True
+            (dir_path / EXCLUDE_FILE_NAME).touch()
+    configs: dict[tuple[str, int], HeaderConfig] = {}
+    body = LINE * spec.lines
+    large_body = LINE * (spec.large_size // len(LINE))
+    excluded_count = stale_count = 0
+    large_paths = []
+    for i in range(spec.files):
+        dir_path = dir_paths[i % len(dir_paths)]
+        ext = spec.extensions[i % len(spec.extensions)]
+        file_path = dir_path / f'manuscript_{i}.{ext}'
+        comments = SUPPORTED_FILE_TYPES[ext].comments
+        is_stale = rng.random() < spec.stale
+        is_missing = is_stale and rng.random() < 0.5
+        header_year = year - 1 if is_stale else year
+        key = (owners[dir_path], header_year)
+        if (config := configs.get(key)) is None:
+            data = {'owner': key[0], 'start_year': 1904, 'end_year': header_year, 'template': TEMPLATE,
+                    'substring': DEFAULT_SUBSTRING}
+            config = configs[key] = HeaderConfig(data)
+        header = b'' if is_missing else config.encode_header(comments) + b'\n'
+        shebang = SHEBANG if comments.comment_start == '#' and rng.random() < spec.shebangs else b''
+        if i < spec.large_files:
+            large_paths.append(file_path)
+        file_path.write_bytes(shebang + header + (large_body if i < spec.large_files else body))
+        if excluded[dir_path]:
+            excluded_count += 1
+        elif is_stale:
+            stale_count += 1
+    return GeneratedTree(root_path, spec.files, excluded_count, stale_count, large_paths)
+
+
+def _generate_dirs(root_path: Path, spec: TreeSpec) -> list[Path]:
+    """Get the leaf directories of a balanced tree holding all the files."""
+    dir_count = max(1, math.ceil(spec.files / FILES_PER_DIR))
+    if spec.depth < 1:
+        return [root_path]
+    fanout = max(2, math.ceil(dir_count ** (1 / spec.depth)))
+    dir_paths = []
+    for i in range(dir_count):
+        digits = []
+        rest = i
+        for __ in range(spec.depth):
+            rest, digit = divmod(rest, fanout)
+            digits.append(f'dir_{digit}')
+        dir_paths.append(root_path.joinpath(*reversed(digits)))
+    return dir_paths
+
+
+def _get_parents(dir_path: Path, root_path: Path) -> list[Path]:
+    """Get a directory and all its parents up to the root, which is not included."""
+    relative_path = dir_path.relative_to(root_path)
+    return [root_path / path for path in (relative_path, *relative_path.parents)][:-1]
@@ -0,0 +1,65 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+"""Benchmark checking a tree of files whose headers are already up to date.
+
+The tree is checked with and without skipping the scan of files which start with the
+expected header, which is the case of almost every file in steady state.
+
+Run with ``python benchmarks/up_to_date.py``.
+"""
+
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+from unbeheader.config import CONFIG_FILE_NAME
+from unbeheader.engine import process_files
+
+YEAR = 1947
+FILE_COUNT = 2000
+REPEAT = 5
+LINE_COUNTS = (10, 100, 1000)
+
+CONFIG = '''
+owner: Ordo Templi Orientis
+start_year: 1904
+template: |-
+  {comment_start} This file is part of Thelema.
+  {comment_middle} Copyright (C) {dates} {owner}
+  {comment_end}
+'''
+HEADER = '# This file is part of Thelema.\n# Copyright (C) 1904 - 1947 Ordo Templi Orientis\n\n'
+LINE = "print('Beware of the knowledge you will gain.')  # Do what thou wilt shall be the whole of the Law.\n"
+
+
+def _time_check(file_paths: list[Path]) -> float:
+    timings = []
+    for __ in range(REPEAT):
+        start_time = time.perf_counter()
+        results = list(process_files(file_paths, YEAR, check=True))
+        timings.append(time.perf_counter() - start_time)
+        assert not any(result.changed for result in results)
+    return min(timings)
+
+
+def main() -> None:
+    print(f'{"lines per file":>14} {"full scan":>12} {"fast path":>12}')
+    for line_count in LINE_COUNTS:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root_path = Path(tmp_dir)
+            (root_path / CONFIG_FILE_NAME).write_text(CONFIG)
+            file_paths = []
+            for i in range(FILE_COUNT):
+                file_path = root_path / f'manuscript_{i}.py'
+                file_path.write_text(HEADER + LINE * line_count)
+                file_paths.append(file_path)
+            with mock.patch('unbeheader.headers._match_header', return_value=None):
+                full_timing = _time_check(file_paths)
+            fast_timing = _time_check(file_paths)
+        print(f'{line_count:>14,} {full_timing * 1000:>10.1f}ms {fast_timing * 1000:>10.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,43 +1,47 @@
 # This file is part of Unbeheader.
 # Copyright (C) CERN & UNCONVENTIONAL
 
-import re
-
+from .scanner import HeaderScanner
 from .typing import CommentSkeleton
 from .typing import SupportedFileType
 
+# The scanners of the comment families used by the supported file types
+HASH_LINE_SCANNER = HeaderScanner(line_comment='#')
+SLASH_LINE_SCANNER = HeaderScanner(line_comment='//', block_comment=('/*', '*/'))
+BLOCK_SCANNER = HeaderScanner(block_comment=('/*', '*/'))
+
 SUPPORTED_FILE_TYPES: dict[str, SupportedFileType] = {
     'py': SupportedFileType(
-        re.compile(r'((^#|[\r\n]#).*)*'),
+        HASH_LINE_SCANNER,
         CommentSkeleton('#', '#')),
     'pyi': SupportedFileType(
-        re.compile(r'((^#|[\r\n]#).*)*'),
+        HASH_LINE_SCANNER,
         CommentSkeleton('#', '#')),
     'wsgi': SupportedFileType(
-        re.compile(r'((^#|[\r\n]#).*)*'),
+        HASH_LINE_SCANNER,
         CommentSkeleton('#', '#')),
     'js': SupportedFileType(
-        re.compile(r'/\*(.|[\r\n])*?\*/|((^//|[\r\n]//).*)*'),
+        SLASH_LINE_SCANNER,
         CommentSkeleton('//', '//')),
     'mjs': SupportedFileType(
-        re.compile(r'/\*(.|[\r\n])*?\*/|((^//|[\r\n]//).*)*'),
+        SLASH_LINE_SCANNER,
         CommentSkeleton('//', '//')),
     'ts': SupportedFileType(
-        re.compile(r'/\*(.|[\r\n])*?\*/|((^//|[\r\n]//).*)*'),
+        SLASH_LINE_SCANNER,
         CommentSkeleton('//', '//')),
     'jsx': SupportedFileType(
-        re.compile(r'/\*(.|[\r\n])*?\*/|((^//|[\r\n]//).*)*'),
+        SLASH_LINE_SCANNER,
         CommentSkeleton('//', '//')),
     'tsx': SupportedFileType(
-        re.compile(r'/\*(.|[\r\n])*?\*/|((^//|[\r\n]//).*)*'),
+        SLASH_LINE_SCANNER,
         CommentSkeleton('//', '//')),
     'css': SupportedFileType(
-        re.compile(r'/\*(.|[\r\n])*?\*/'),
+        BLOCK_SCANNER,
         CommentSkeleton('/*', ' *', ' */')),
     'scss': SupportedFileType(
-        re.compile(r'/\*(.|[\r\n])*?\*/|((^//|[\r\n]//).*)*'),
+        SLASH_LINE_SCANNER,
         CommentSkeleton('//', '//')),
     'sh': SupportedFileType(
-        re.compile(r'((^#|[\r\n]#).*)*'),
+        HASH_LINE_SCANNER,
         CommentSkeleton('#', '#')),
 }
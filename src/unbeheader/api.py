@@ -0,0 +1,133 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+from collections.abc import Generator
+from collections.abc import Iterable
+from collections.abc import Iterator
+from datetime import date
+from pathlib import Path
+
+from . import stats
+from .cache import ResultCache
+from .config import ConfigResolver
+from .engine import process_files
+from .filetypes import FileTypeRegistry
+from .typing import HeaderResult
+from .util import ExclusionIndex
+from .util import expand_paths
+
+
+class HeaderSession:
+    """Session processing batches of files with shared caches.
+
+    The configuration of every directory, including the file types declared in it, and
+    whether it is excluded by a .no-header file are only looked up once for all the batches
+    processed in a session. Errors never exit the interpreter: errors specific to a file,
+    such as a missing or invalid configuration, are returned in its result.
+
+    :param root_path: The root path to look for .no-header files up to, which defaults to
+                      the current directory.
+    :param cache: The cache of the files which were up to date in previous runs.
+    """
+
+    def __init__(self, root_path: Path | None = None, cache: ResultCache | None = None) -> None:
+        """Create a session with empty caches."""
+        self.resolver = ConfigResolver()
+        self.exclusions = ExclusionIndex(root_path or Path.cwd())
+        self.cache = cache
+
+    def get_file_types(self, dir_path: Path) -> FileTypeRegistry:
+        """Get the file types of the files in a directory.
+
+        These are the built-in ones along with the ones declared in the configuration of the
+        directory, which are compiled once for all the directories the configuration applies to.
+
+        :raise ConfigError: If the configuration of the directory is invalid.
+        """
+        return self.resolver.get_file_types(dir_path)
+
+    def invalidate(self, dir_path: Path) -> None:
+        """Forget the configuration and exclusions of a directory and everything under it.
+
+        Call this whenever a configuration or .no-header file in the directory changes.
+        """
+        self.resolver.invalidate(dir_path)
+        self.exclusions.invalidate(dir_path)
+
+    def process(self, paths: Iterable[Path | str], year: int | None = None, check: bool = False, jobs: int = 1,
+                engine: str = 'process') -> Generator[HeaderResult, None, None]:
+        """Process the headers of files and directories, yielding a result for every file.
+
+        Directories are walked for the files having one of the file types of their directory.
+        Otherwise, this is the same as :meth:`process_files`, which takes the same arguments.
+        """
+        file_paths = expand_paths((Path(path).absolute() for path in paths), self.get_file_types)
+        return self.process_files(file_paths, year, check, jobs, engine)
+
+    def process_files(self, file_paths: Iterable[Path], year: int | None = None, check: bool = False, jobs: int = 1,
+                      engine: str = 'process') -> Generator[HeaderResult, None, None]:
+        """Process the headers of files, yielding a result for every file.
+
+        Files which are not supported, or whose directory or any parent up to the root path
+        is excluded by a .no-header file, are reported as skipped. Relative paths are taken
+        from the current directory, and the results hold absolute paths. Closing the generator
+        cancels the files that have not been started yet.
+
+        :param file_paths: The paths of the files to process.
+        :param year: The year to update the headers to, which defaults to the current year.
+        :param check: Whether to only check the headers without updating the files.
+        :param jobs: The number of worker processes to use, or the number of files processed
+                     at once with the ``async`` engine.
+        :param engine: The engine to process the files with, ``process`` or ``async``.
+        """
+        excluded: list[Path] = []
+
+        def _iter_included() -> Iterator[Path]:
+            for file_path in stats.timed_iter('discovery', file_paths):
+                # The configuration is looked up from the directory of the file up to the file system root
+                file_path = file_path.absolute()
+                with stats.phase('exclusion'):
+                    is_excluded = self.exclusions.is_excluded(file_path.parent)
+                if is_excluded:
+                    excluded.append(file_path)
+                else:
+                    yield file_path
+
+        year = year or date.today().year
+        yield from process_files(_iter_included(), year, check, jobs, self.cache, engine, self.resolver)
+        for file_path in excluded:
+            yield HeaderResult(file_path, changed=False, found=False, skipped=True)
+
+    def check(self, paths: Iterable[Path | str], year: int | None = None, jobs: int = 1,
+              engine: str = 'process') -> list[HeaderResult]:
+        """Check the headers of files without updating them.
+
+        Takes the same arguments as :meth:`process`.
+        """
+        return list(self.process(paths, year, check=True, jobs=jobs, engine=engine))
+
+    def fix(self, paths: Iterable[Path | str], year: int | None = None, jobs: int = 1,
+            engine: str = 'process') -> list[HeaderResult]:
+        """Add or update the headers of files.
+
+        Takes the same arguments as :meth:`process`.
+        """
+        return list(self.process(paths, year, check=False, jobs=jobs, engine=engine))
+
+
+def check_headers(paths: Iterable[Path | str], year: int | None = None, *, root_path: Path | None = None,
+                  jobs: int = 1, engine: str = 'process') -> list[HeaderResult]:
+    """Check the headers of files without updating them.
+
+    See :class:`HeaderSession` for the arguments, and to share caches across calls.
+    """
+    return HeaderSession(root_path).check(paths, year, jobs, engine)
+
+
+def fix_headers(paths: Iterable[Path | str], year: int | None = None, *, root_path: Path | None = None,
+                jobs: int = 1, engine: str = 'process') -> list[HeaderResult]:
+    """Add or update the headers of files.
+
+    See :class:`HeaderSession` for the arguments, and to share caches across calls.
+    """
+    return HeaderSession(root_path).fix(paths, year, jobs, engine)
@@ -0,0 +1,123 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from . import stats
+
+# The name of the file storing the results of previous runs
+CACHE_FILE_NAME = '.unbeheader-cache'
+
+# The version of the format of the cache file, to be bumped whenever it changes
+CACHE_FORMAT = 1
+
+# Guards the counters of the caches, which are shared by the threads of the async engine
+_counter_lock = threading.Lock()
+
+# The time files must not have been modified for to be cached, since changes made within the
+# granularity of the filesystem timestamps would go unnoticed
+RACY_INTERVAL_NS = 2_000_000_000
+
+
+class ResultCache:
+    """Cache of the files whose headers were up to date in previous runs.
+
+    Every entry stores the size, modification time and inode of a file along with the
+    digest of the configuration it was checked against, which covers the target year.
+    Files are only skipped when all of them are unchanged. The cache is discarded as a
+    whole when written by a different version of Unbeheader.
+
+    :param entries: The entries loaded from the cache file.
+    """
+
+    def __init__(self, entries: dict[str, list[Any]] | None = None) -> None:
+        """Create a cache with the given entries."""
+        self._entries = entries or {}
+        # Entries added since the cache was created or drained
+        self._updates: dict[str, list[Any]] = {}
+        self._start_ns = time.time_ns()
+        # Number of files skipped and checked thanks to the cache
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, cache_path: Path) -> ResultCache:
+        """Load the cache from a file, ignoring it if it is missing, invalid or outdated."""
+        try:
+            data = json.loads(cache_path.read_text())
+        except (OSError, ValueError):
+            return cls()
+        if not isinstance(data, dict) or data.get('version') != _get_version():
+            return cls()
+        return cls(data.get('entries'))
+
+    def save(self, cache_path: Path) -> None:
+        """Write the cache to a file, replacing it atomically."""
+        tmp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps({'version': _get_version(), 'entries': self._entries}))
+        os.replace(tmp_path, cache_path)
+
+    def lookup(self, file_path: Path, digest: str) -> bool | None:
+        """Check whether a file was up to date in a previous run.
+
+        Returns whether a header was found in the file if it is unchanged since it was up
+        to date, or ``None`` if it needs to be checked.
+        """
+        entry = self._entries.get(str(file_path))
+        if entry is not None and entry[:4] == [*_get_stat_key(file_path), digest]:
+            with _counter_lock:
+                self.hits += 1
+            stats.count('cache_hits')
+            return entry[4]
+        with _counter_lock:
+            self.misses += 1
+        stats.count('cache_misses')
+        return None
+
+    def store(self, file_path: Path, digest: str, found: bool) -> None:
+        """Record that the header of a file is up to date."""
+        key = _get_stat_key(file_path)
+        if key[1] > self._start_ns - RACY_INTERVAL_NS:
+            return
+        self._entries[str(file_path)] = self._updates[str(file_path)] = [*key, digest, found]
+
+    def drain(self) -> ResultCache:
+        """Take the entries and counters recorded since the cache was created or last drained."""
+        drained = ResultCache(self._updates)
+        self._updates = {}
+        with _counter_lock:
+            drained.hits, drained.misses = self.hits, self.misses
+            self.hits = self.misses = 0
+        return drained
+
+    def merge(self, other: ResultCache) -> None:
+        """Add the entries and counters of another cache, such as one drained in a worker process."""
+        self._entries.update(other._entries)
+        with _counter_lock:
+            self.hits += other.hits
+            self.misses += other.misses
+
+
+def _get_stat_key(file_path: Path) -> tuple[int, int, int]:
+    stats.count('stat_calls')
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def _get_version() -> str:
+    # Only imported when needed, as it takes a while to import
+    from importlib.metadata import PackageNotFoundError
+    from importlib.metadata import version
+
+    try:
+        package_version = version('unbeheader')
+    except PackageNotFoundError:
+        package_version = 'unknown'
+    return f'{package_version}/{CACHE_FORMAT}'
@@ -1,23 +1,49 @@
 # This file is part of Unbeheader.
 # Copyright (C) CERN & UNCONVENTIONAL
 
-import subprocess
+import json
+import os
 import sys
+from collections.abc import Generator
+from collections.abc import Iterable
+from collections.abc import Iterator
 from datetime import date
+from io import BufferedIOBase
+from itertools import chain
 from pathlib import Path
+from typing import TextIO
 
 import click
 from click import UsageError
 
 from . import SUPPORTED_FILE_TYPES
-from .headers import update_header
-from .util import cformat
-from .util import is_excluded
+from . import stats
+from .api import HeaderSession
+from .cache import CACHE_FILE_NAME
+from .cache import ResultCache
+from .engine import ASYNC_JOBS
+from .engine import ENGINES
+from .exceptions import UnbeheaderError
+from .filetypes import FileTypesLookup
+from .report import FORMATS
+from .report import Reporter
+from .report import create_reporter
+from .typing import HeaderResult
+from .util import GOVERNING_FILE_NAMES
+from .util import expand_paths
+from .util import walk_files
+
+# The maximum number of bytes read at once from the output of git
+GIT_READ_SIZE = 64 * 1024
+
+# The maximum number of bytes read at once from the list of files given with --files-from
+FILES_FROM_READ_SIZE = 64 * 1024
 
 USAGE = '''
-Updates all the headers in the supported files ({supported_file_types}).
-By default, all the files tracked by git in the current repository are updated
-to the current year.
+Updates all the headers in the supported files ({supported_file_types}),
+and in the files of the types declared in the configuration. By default, all
+the files tracked by git in the current repository are updated to the current
+year.
 
 You can specify a year to update to as well as a file or directory.
 This will update all the supported files in the scope including those not tracked
@@ -27,6 +53,7 @@ specified is not supported) nothing will be updated.
 
 
 @click.command(help=USAGE)
+@click.argument('file_paths', nargs=-1, type=click.Path(exists=True, path_type=Path))
 @click.option('--check', is_flag=True, help='Indicate that the script is running in check mode and should use a '
                                             'non-zero exit code unless all headers were already up to date. This also '
                                             'prevents files from actually being updated.')
@@ -34,71 +61,323 @@ specified is not supported) nothing will be updated.
               help='Indicate the target year')
 @click.option('--path', '-p', 'path_str', type=click.Path(exists=True),
               help='Restrict updates to a specific file or directory')
-def main(check: bool, year: int, path_str: str) -> None:
+@click.option('--jobs', '-j', type=click.IntRange(min=1), metavar='N',
+              help=f'Process files in N parallel processes, or N files at once with the async engine '
+                   f'[default: number of CPUs, or {ASYNC_JOBS} with the async engine]')
+@click.option('--engine', type=click.Choice(ENGINES), default='process', show_default=True,
+              help='Process files in worker processes, or concurrently in threads for slow file systems')
+@click.option('--since', metavar='REF', help='Restrict updates to the files changed in git since a specific ref')
+@click.option('--staged', is_flag=True, help='Restrict updates to the files staged in git')
+@click.option('--cache', 'use_cache', is_flag=True,
+              help=f'Skip the files which were up to date in previous runs, as recorded in {CACHE_FILE_NAME}')
+@click.option('--watch', is_flag=True,
+              help='Keep running and process the files in the directory whenever they change')
+@click.option('--files-from', type=click.File('rb'), metavar='FILE',
+              help='Process the files listed in FILE, or in the standard input if -, one per line')
+@click.option('--null', '-0', is_flag=True,
+              help='Separate the files listed with --files-from by NUL characters instead of newlines')
+@click.option('--fail-fast', is_flag=True,
+              help='Stop at the first file whose header needs to be added or updated in check mode, only reporting '
+                   'that file')
+@click.option('--quiet', '-q', is_flag=True, help='Only report the summary of the results as text')
+@click.option('--format', 'output_format', type=click.Choice(FORMATS), default='text', show_default=True,
+              help='Report the results as text, as a JSON document or as JSON lines')
+@click.option('--stats', 'show_stats', is_flag=True,
+              help='Report the time spent in every phase of the run and counters of files, bytes, stat calls and '
+                   'cache lookups to the standard error')
+@click.option('--stats-json', type=click.File('w'), metavar='FILE', help='Write the stats of the run as JSON to FILE')
+@click.option('--stats-trace', type=click.File('w'), metavar='FILE',
+              help='Write every phase of the run as a Chrome trace to FILE, to be viewed in Perfetto')
+def main(file_paths: tuple[Path, ...], check: bool, year: int, path_str: str, jobs: int | None, engine: str,
+         since: str | None, staged: bool, use_cache: bool, watch: bool, files_from: BufferedIOBase | None,
+         null: bool, fail_fast: bool, quiet: bool, output_format: str, show_stats: bool, stats_json: TextIO | None,
+         stats_trace: TextIO | None) -> None:
     path = Path(path_str).resolve() if path_str else None
-    if path and path.is_dir():
-        error = _run_on_directory(path, year, check)
-    elif path and path.is_file():
-        error = _run_on_file(path, year, check)
-    else:
-        error = _run_on_repo(year, check)
-    if not error:
-        click.secho('✅ All headers are up to date', fg='green')
-    elif check:
-        click.secho('❌ Some headers need to be added or updated', fg='red')
+    jobs = jobs or (ASYNC_JOBS if engine == 'async' else os.cpu_count() or 1)
+    if path and (since or staged):
+        raise UsageError('The --since and --staged options cannot be used together with --path.')
+    if (file_paths or files_from) and (path or since or staged or watch):
+        raise UsageError('File arguments and --files-from cannot be used together with --path, --since, --staged '
+                         'or --watch.')
+    if null and not files_from:
+        raise UsageError('The --null option can only be used with --files-from.')
+    if watch and (since or staged):
+        raise UsageError('The --since and --staged options cannot be used together with --watch.')
+    if watch and path and not path.is_dir():
+        raise UsageError('The --watch option can only be used with a directory.')
+    if fail_fast and (not check or watch):
+        raise UsageError('The --fail-fast option can only be used with --check and without --watch.')
+    cache_path = Path.cwd() / CACHE_FILE_NAME
+    cache = ResultCache.load(cache_path) if use_cache else None
+    reporter = create_reporter(output_format, check, quiet)
+    run_stats = stats.enable(trace=bool(stats_trace)) if show_stats or stats_json or stats_trace else None
+    try:
+        if watch:
+            _run_watch(path or Path.cwd(), year, check, jobs, cache, engine, reporter)
+            error = False
+        elif file_paths or files_from:
+            error = _run_on_files(file_paths, files_from, year, check, jobs, cache, engine, reporter, fail_fast,
+                                  b'\0' if null else b'\n')
+        elif since or staged:
+            error = _run_on_changes(year, check, jobs, since, staged, cache, engine, reporter, fail_fast)
+        elif path and path.is_dir():
+            error = _run_on_directory(path, year, check, jobs, cache, engine, reporter, fail_fast)
+        elif path and path.is_file():
+            error = _run_on_file(path, year, check, cache, reporter)
+        else:
+            error = _run_on_repo(year, check, jobs, cache, engine, reporter, fail_fast)
+    except UnbeheaderError as e:
+        click.secho(str(e), fg='red', err=True)
+        sys.exit(1)
+    finally:
+        stats.disable()
+    if cache:
+        cache.save(cache_path)
+    if not watch:
+        reporter.finish()
+    if run_stats:
+        _write_stats(run_stats, show_stats, stats_json, stats_trace)
+    if error and check:
         sys.exit(1)
-    else:
-        click.secho('🔄 Some headers have been updated', fg='yellow')
 
 
-def _run_on_directory(path: Path, year: int, check: bool) -> bool:
-    error = False
+def _write_stats(run_stats: stats.Stats, show_stats: bool, stats_json: TextIO | None,
+                 stats_trace: TextIO | None) -> None:
+    if show_stats:
+        click.echo(run_stats.format(), err=True)
+    if stats_json:
+        json.dump(run_stats.to_dict(), stats_json, indent=2)
+        stats_json.write('\n')
+    if stats_trace:
+        json.dump(run_stats.to_trace(), stats_trace)
+
+
+def _run_on_directory(path: Path, year: int, check: bool, jobs: int = 1, cache: ResultCache | None = None,
+                      engine: str = 'process', reporter: Reporter | None = None, fail_fast: bool = False) -> bool:
+    reporter = reporter or Reporter(check)
     if not check:
-        print(cformat('Updating headers to the year %{yellow!}{year}%{reset} for all the files in '
-                      '%{yellow!}{path}%{reset}...').format(year=year, path=path))
-    root_path = path
-    for path in root_path.glob('**/*'):
-        if path.is_dir():
-            continue
-        if not is_excluded(path, root_path):
-            if update_header(path, year, check):
-                error = True
-    return error
+        reporter.start('Updating headers to the year %{yellow!}{year}%{reset} for all the files in '
+                       '%{yellow!}{path}%{reset}...', year=year, path=path)
+    session = HeaderSession(_get_root_path(path), cache)
+    file_paths = walk_files(path, session.get_file_types)
+    return _process_files(file_paths, year, check, jobs, cache, engine, reporter, fail_fast, session)
 
-def _run_on_file(path: Path, year: int, check: bool) -> bool:
-    error = False
+
+def _run_on_file(path: Path, year: int, check: bool, cache: ResultCache | None = None,
+                 reporter: Reporter | None = None) -> bool:
+    reporter = reporter or Reporter(check)
+    if not check:
+        reporter.start('Updating headers to the year %{yellow!}{year}%{reset} for the file '
+                       '%{yellow!}{file}%{reset}...', year=year, file=path)
+    return _process_files([path], year, check, cache=cache, reporter=reporter)
+
+
+def _run_on_files(file_paths: Iterable[Path], files_from: BufferedIOBase | None, year: int, check: bool, jobs: int = 1,
+                  cache: ResultCache | None = None, engine: str = 'process', reporter: Reporter | None = None,
+                  fail_fast: bool = False, sep: bytes = b'\n') -> bool:
+    reporter = reporter or Reporter(check)
     if not check:
-        print(cformat('Updating headers to the year %{yellow!}{year}%{reset} for the file '
-                      '%{yellow!}{file}%{reset}...').format(year=year, file=path))
-    if update_header(path, year, check):
-        error = True
-    return error
+        reporter.start('Updating headers to the year %{yellow!}{year}%{reset} for the listed files...', year=year)
+    session = HeaderSession(Path.cwd(), cache)
+    listed_paths = _iter_listed_files(file_paths, files_from, sep, session.get_file_types)
+    return _process_files(listed_paths, year, check, jobs, cache, engine, reporter, fail_fast, session)
 
 
-def _run_on_repo(year: int, check: bool) -> bool:
-    error = False
+def _run_on_repo(year: int, check: bool, jobs: int = 1, cache: ResultCache | None = None,
+                 engine: str = 'process', reporter: Reporter | None = None, fail_fast: bool = False) -> bool:
+    reporter = reporter or Reporter(check)
     if not check:
-        print(cformat('Updating headers to the year %{yellow!}{year}%{reset} for all '
-                      'git-tracked files...').format(year=year))
+        reporter.start('Updating headers to the year %{yellow!}{year}%{reset} for all git-tracked files...', year=year)
+    return _process_files(_iter_git_files(Path.cwd()), year, check, jobs, cache, engine, reporter, fail_fast)
+
+
+def _run_on_changes(year: int, check: bool, jobs: int = 1, since: str | None = None, staged: bool = False,
+                    cache: ResultCache | None = None, engine: str = 'process',
+                    reporter: Reporter | None = None, fail_fast: bool = False) -> bool:
+    reporter = reporter or Reporter(check)
+    if not check:
+        msg = 'Updating headers to the year %{yellow!}{year}%{reset} for all '
+        msg += 'staged files' if staged else 'changed files'
+        msg += ' since %{yellow!}{since}%{reset}...' if since else '...'
+        reporter.start(msg, year=year, since=since)
+    file_paths = _iter_changed_files(Path.cwd(), since, staged)
+    return _process_files(file_paths, year, check, jobs, cache, engine, reporter, fail_fast)
+
+
+def _run_watch(path: Path, year: int, check: bool, jobs: int = 1, cache: ResultCache | None = None,
+               engine: str = 'process', reporter: Reporter | None = None) -> None:
+    """Process all the files in a directory, and then the files changed in it until interrupted.
+
+    Errors are printed instead of stopping, so that they can be fixed while watching.
+    """
+    from .watch import create_watcher
+    from .watch import watch_files
+
+    reporter = reporter or Reporter(check)
+    session = HeaderSession(_get_root_path(path), cache)
+    watcher = create_watcher(path, session.get_file_types)
+    reporter.start('Watching %{yellow!}{path}%{reset} for changes, press Ctrl+C to stop...', path=path)
     try:
-        cmd = ('git', 'ls-files')
-        untracked_flags = ('--others', '--exclude-standard')
-        deleted_flags = ('--deleted',)
-        # Get all files tracked by git
-        git_file_paths = set(subprocess.check_output(cmd, text=True).splitlines())
-        # Include untracked files
-        git_file_paths |= set(subprocess.check_output(cmd + untracked_flags, text=True).splitlines())
-        # Exclude deleted files
-        git_file_paths -= set(subprocess.check_output(cmd + deleted_flags, text=True).splitlines())
-        for file_path_str in git_file_paths:
-            file_path = Path(file_path_str).absolute()
-            if not is_excluded(file_path.parent, Path.cwd()):
-                if update_header(file_path, year, check):
-                    error = True
+        reporter.report(session.process([path], year, check, jobs, engine), keep_going=True)
+        for results in watch_files(session, path, year, check, watcher, jobs, engine):
+            reporter.report(results, keep_going=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+def _get_root_path(path: Path) -> Path:
+    """Get the root path to look for .no-header files up to when running on a directory.
+
+    This is the current directory if the directory is in it, so that the exclusions of the
+    parents in between apply as well, and the directory itself otherwise.
+    """
+    cwd = Path.cwd()
+    return cwd if path.is_relative_to(cwd) else path
+
+
+def _iter_listed_files(file_paths: Iterable[Path], files_from: BufferedIOBase | None, sep: bytes,
+                       get_file_types: FileTypesLookup) -> Iterator[Path]:
+    """Yield the files given as arguments and then the files listed in a stream.
+
+    Directories are walked for supported files, and files found several times are only
+    yielded once.
+    """
+    cwd = Path.cwd()
+    listed_paths = (cwd / path for path in chain(file_paths, _read_file_list(files_from, sep) if files_from else ()))
+    seen = set()
+    for file_path in expand_paths(listed_paths, get_file_types):
+        if file_path not in seen:
+            seen.add(file_path)
+            yield file_path
+
+
+def _read_file_list(stream: BufferedIOBase, sep: bytes = b'\n') -> Iterator[Path]:
+    """Yield the paths listed in a stream while it is still being written.
+
+    When the paths are separated by newlines, carriage returns ending the lines are
+    stripped. Empty paths are skipped.
+
+    :param stream: The stream to read the paths from.
+    :param sep: The separator of the paths, either a newline or a NUL character.
+    """
+    pending = b''
+    while chunk := stream.read1(FILES_FROM_READ_SIZE):
+        pending += chunk
+        *names, pending = pending.split(sep)
+        yield from _decode_file_list(names, sep)
+    yield from _decode_file_list([pending], sep)
+
+
+def _decode_file_list(names: list[bytes], sep: bytes) -> Iterator[Path]:
+    for name in names:
+        if sep != b'\0':
+            name = name.removesuffix(b'\r')
+        if name:
+            yield Path(os.fsdecode(name))
+
+
+def _iter_changed_files(cwd: Path, since: str | None, staged: bool) -> Iterator[Path]:
+    """Yield the files in the current directory changed in git since a ref, or staged if requested.
+
+    Without a ref, changes are relative to the index or, if staged, to ``HEAD``. Unless only
+    staged changes are requested, the untracked files which are not ignored are yielded as
+    well. When a configuration or .no-header file changed, including in a parent of the
+    current directory, all the files it may apply to are yielded.
+    """
+    import subprocess
+
+    cmds = [['git', 'diff', '-z', '--name-only', '--no-relative', '--no-renames', '--diff-filter=ACDMR']]
+    if staged:
+        cmds[0].append('--cached')
+    cmds[0] += ['--end-of-options', since, '--'] if since else ['--']
+    if not staged:
+        # New files are not part of the diff until they are staged
+        cmds.append(['git', 'ls-files', '-z', '--others', '--exclude-standard', '--full-name', '--', ':/'])
+    try:
+        top_path = Path(os.fsdecode(subprocess.check_output(['git', 'rev-parse', '--show-toplevel']).rstrip(b'\n')))
+        output = b''.join(subprocess.check_output(cmd) for cmd in cmds)
     except subprocess.CalledProcessError as e:
-        msg = click.style('You must be within a git repository to run this script.', fg='red', bold=True)
+        msg = click.style('Could not get the changed files from git.', fg='red', bold=True)
         raise UsageError(msg) from e
-    return error
+    seen = set()
+    changed_dir_paths = []
+    for name in output.split(b'\0')[:-1]:
+        file_path = top_path / os.fsdecode(name)
+        if file_path in seen:
+            continue
+        seen.add(file_path)
+        if file_path.name in GOVERNING_FILE_NAMES:
+            # A change in a parent of the current directory applies to all the files in it
+            if cwd.is_relative_to(file_path.parent):
+                changed_dir_paths.append(cwd)
+            elif file_path.parent.is_relative_to(cwd):
+                changed_dir_paths.append(file_path.parent)
+        elif file_path.is_relative_to(cwd):
+            yield file_path
+    for dir_path in changed_dir_paths:
+        for file_path in _iter_git_files(cwd, dir_path):
+            if file_path not in seen:
+                seen.add(file_path)
+                yield file_path
+
+
+def _iter_git_files(cwd: Path, *pathspecs: Path) -> Iterator[Path]:
+    """Yield the files tracked by git and the untracked files which are not ignored.
+
+    The paths are streamed from a single git invocation while it is still running.
+    Deleted files are listed as well, but never pass the checks done before processing.
+    """
+    import subprocess
+
+    cmd = ['git', 'ls-files', '-z', '--cached', '--others', '--exclude-standard', '--deduplicate', '--']
+    cmd += map(str, pathspecs)
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        assert proc.stdout is not None
+        pending = b''
+        try:
+            while chunk := os.read(proc.stdout.fileno(), GIT_READ_SIZE):
+                *names, pending = (pending + chunk).split(b'\0')
+                for name in names:
+                    yield cwd / os.fsdecode(name)
+        except GeneratorExit:
+            # Stop git right away when the files are not needed anymore
+            proc.kill()
+            raise
+    if proc.returncode:
+        msg = click.style('You must be within a git repository to run this script.', fg='red', bold=True)
+        raise UsageError(msg)
+
+
+def _process_files(file_paths: Iterable[Path], year: int, check: bool, jobs: int = 1,
+                   cache: ResultCache | None = None, engine: str = 'process', reporter: Reporter | None = None,
+                   fail_fast: bool = False, session: HeaderSession | None = None) -> bool:
+    """Process the headers of files and report the results.
+
+    Files excluded by a .no-header file up to the root path of the session, which defaults
+    to the current directory, are skipped. Returns whether any of the headers was or needs
+    to be added or updated. When failing fast, processing stops at the first such file,
+    which is the only one reported. The session the files were found with is reused, so
+    that every configuration is only loaded once.
+    """
+    session = session or HeaderSession(Path.cwd(), cache)
+    results = session.process_files(file_paths, year, check, jobs, engine)
+    return (reporter or Reporter(check)).report(_stop_at_first_change(results) if fail_fast else results)
+
+
+def _stop_at_first_change(results: Generator[HeaderResult, None, None]) -> Iterator[HeaderResult]:
+    """Yield the results up to the first file which was or needs to be changed.
+
+    Everything still pending is cancelled at that point, including the discovery of files.
+    """
+    try:
+        for result in results:
+            yield result
+            if result.changed:
+                return
+    finally:
+        results.close()
 
 
 if __name__ == '__main__':
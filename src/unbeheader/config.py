@@ -1,13 +1,22 @@
 # This file is part of Unbeheader.
 # Copyright (C) CERN & UNCONVENTIONAL
 
-import sys
-from collections.abc import Iterator
+import codecs
+import json
+import threading
+from functools import cached_property
 from pathlib import Path
+from typing import Any
+from typing import NamedTuple
 
-import click
-import yaml
-
+from . import stats
+from .exceptions import ConfigError
+from .exceptions import ConfigNotFoundError
+from .filetypes import DEFAULT_FILE_TYPES
+from .filetypes import FileTypeRegistry
+from .filetypes import compile_file_types
+from .scanner import HeaderScanner
+from .typing import CommentSkeleton
 from .typing import ConfigDict
 
 # The substring which must be part of a comment block in order for the comment to be updated by the header
@@ -17,57 +26,274 @@ DEFAULT_SUBSTRING = 'This file is part of'
 CONFIG_FILE_NAME = '.header.yaml'
 CONFIG_FILE_NAME_YML = '.header.yml'
 
+# The encoding headers are written in unless another one is configured
+DEFAULT_ENCODING = 'utf-8'
 
-def get_config(path: Path, end_year: int) -> ConfigDict:
-    """Get configuration from headers files."""
-    config = _load_config(path)
-    _validate_config(config)
-    config['substring'] = config.get('substring', DEFAULT_SUBSTRING)
-    config['end_year'] = end_year
-    return config
+# Guards the counters of the resolvers, which are shared by the threads of the async engine
+_counter_lock = threading.Lock()
+
+# The configuration keys which are not available as template placeholders
+NON_TEMPLATE_KEYS = frozenset({'root', 'substring', 'template', 'max_header_lines', 'max_header_bytes', 'file_types',
+                               'encoding'})
+
+
+class HeaderConfig:
+    """Validated configuration of a directory.
+
+    The template is checked for invalid placeholders and characters the encoding cannot
+    represent when the configuration is created, and the header is rendered and scanned
+    only once for every comment skeleton it is requested for.
+
+    :param data: The validated configuration values, including the target year.
+    :param template_path: The configuration file the template comes from.
+    """
+
+    def __init__(self, data: ConfigDict, template_path: Path | None = None) -> None:
+        """Create the configuration and validate its template."""
+        self.data = data
+        self.substring: str = data['substring']
+        self.max_header_lines: int | None = data.get('max_header_lines')
+        self.max_header_bytes: int | None = data.get('max_header_bytes')
+        # The encoding headers are written in, which files are expected to be compatible with
+        self.encoding: str = data.get('encoding', DEFAULT_ENCODING)
+        self._headers: dict[CommentSkeleton, str] = {}
+        self._encoded_headers: dict[tuple[CommentSkeleton, bytes], bytes] = {}
+        self._header_ends: dict[tuple[CommentSkeleton, HeaderScanner, bytes], int | None] = {}
+        header = _generate_header(CommentSkeleton('', '')._asdict() | data, template_path)
+        try:
+            self.encoded_substring = self.substring.encode(self.encoding)
+            header.encode(self.encoding)
+        except UnicodeEncodeError as e:
+            raise ConfigError(f'Header cannot be encoded in {self.encoding}', template_path) from e
+
+    @cached_property
+    def digest(self) -> str:
+        """A digest of the configuration values, changing whenever any of them does."""
+        import hashlib
+
+        return hashlib.sha1(json.dumps(self.data, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get_header(self, comments: CommentSkeleton) -> str:
+        """Get the header rendered for a comment skeleton."""
+        if (header := self._headers.get(comments)) is None:
+            with stats.phase('render'):
+                header = self._headers[comments] = _generate_header(comments._asdict() | self.data)
+        return header
+
+    def encode_header(self, comments: CommentSkeleton, newline: bytes = b'\n') -> bytes:
+        """Get the header rendered for a comment skeleton, encoded with the given line endings."""
+        key = (comments, newline)
+        if (header := self._encoded_headers.get(key)) is None:
+            encoded = self.get_header(comments).encode(self.encoding)
+            header = self._encoded_headers[key] = encoded.replace(b'\n', newline)
+        return header
+
+    def get_header_end(self, comments: CommentSkeleton, scanner: HeaderScanner, newline: bytes = b'\n') -> int | None:
+        """Get the end of the comment found by a scanner in the encoded header.
+
+        Returns ``None`` unless the header consists of a single comment holding the substring,
+        optionally followed by whitespace, which is required to recognize it in files.
+        """
+        key = (comments, scanner, newline)
+        if key not in self._header_ends:
+            header = self.encode_header(comments, newline)
+            spans = list(scanner.finditer(header))
+            end = spans[0][1] if len(spans) == 1 and spans[0][0] == 0 else None
+            if end is not None and (header.find(self.encoded_substring, 0, end) == -1 or header[end:].strip()):
+                end = None
+            self._header_ends[key] = end
+        return self._header_ends[key]
+
+
+class _DirConfig(NamedTuple):
+    # The merged configuration of a directory
+    config: ConfigDict
+    # The configuration file each configuration key comes from
+    sources: dict[str, Path]
+    # Whether any configuration file applies to the directory
+    found: bool
+
+
+class ConfigResolver:
+    """Resolve the configuration of files, caching it per directory.
 
+    A resolver is meant to be shared by all the files processed in a single run. The
+    configuration of a directory is merged from the configuration file found in it (if any)
+    and the already resolved configuration of its parent, so every configuration file is
+    read and parsed at most once, and the files in a directory are served from memory.
+    Directories whose configuration comes from the same configuration files share the same
+    validated configuration, or the same error if it is invalid.
+    """
 
-def _load_config(path: Path) -> ConfigDict:
-    config: ConfigDict = {}
-    found = False
-    for dir_path in _walk_to_root(path):
-        check_path_yaml = dir_path / CONFIG_FILE_NAME
-        check_path_yml = dir_path / CONFIG_FILE_NAME_YML
-        if check_path_yaml.exists() and check_path_yml.exists():
-            click.secho(f'Both {CONFIG_FILE_NAME} and {CONFIG_FILE_NAME_YML} files found in {dir_path}',
-                        fg='red', err=True)
-            sys.exit(1)
-        check_path = check_path_yaml or check_path_yml
-        if check_path.is_file():
-            found = True
-            config.update((k, v) for k, v in yaml.safe_load(check_path.read_text()).items() if k not in config)
-            if config.pop('root', False):
-                break
-    if not found:
-        click.secho(f'No valid {CONFIG_FILE_NAME} file found in {path}', fg='red', err=True)
-        sys.exit(1)
+    def __init__(self) -> None:
+        """Create a resolver with empty caches."""
+        # Merged configuration of each visited directory
+        self._loaded: dict[Path, _DirConfig] = {}
+        # Validated configuration for each directory and target year
+        self._resolved: dict[tuple[Path, int], HeaderConfig] = {}
+        # Validated configuration, or the error it raised, for each set of configuration files and target year
+        self._configs: dict[tuple[frozenset[tuple[str, Path]], int], HeaderConfig | ConfigError] = {}
+        # Compiled file types for each configuration file declaring them
+        self._file_types: dict[Path, FileTypeRegistry] = {}
+        # Number of configurations served from and added to the cache
+        self.hits = 0
+        self.misses = 0
+
+    def get_config(self, file_path: Path, end_year: int) -> HeaderConfig:
+        """Get the validated configuration of a file."""
+        key = (file_path.parent, end_year)
+        if (config := self._resolved.get(key)) is not None:
+            with _counter_lock:
+                self.hits += 1
+            stats.count('config_hits')
+            return config
+        with _counter_lock:
+            self.misses += 1
+        stats.count('config_misses')
+        with stats.phase('config'):
+            loaded = self._load_dir(file_path.parent)
+            data = self._check_found(loaded, file_path.parent)
+            sources_key = (frozenset(loaded.sources.items()), end_year)
+            if (shared := self._configs.get(sources_key)) is None:
+                try:
+                    _validate_config(data)
+                    data['substring'] = data.get('substring', DEFAULT_SUBSTRING)
+                    data['end_year'] = end_year
+                    shared = HeaderConfig(data, loaded.sources['template'])
+                except ConfigError as e:
+                    shared = e
+                self._configs[sources_key] = shared
+            if isinstance(shared, ConfigError):
+                raise shared.with_traceback(None)
+            self._resolved[key] = shared
+        return shared
+
+    def get_file_types(self, dir_path: Path) -> FileTypeRegistry:
+        """Get the file types of a directory, which are the built-in ones unless others are declared.
+
+        The file types declared in a configuration file are compiled once for all the
+        directories it applies to, and no configuration file needs to apply to the directory.
+        """
+        loaded = self._load_dir(dir_path)
+        if (config_path := loaded.sources.get('file_types')) is None:
+            return DEFAULT_FILE_TYPES
+        if (file_types := self._file_types.get(config_path)) is None:
+            file_types = self._file_types[config_path] = compile_file_types(loaded.config['file_types'], config_path)
+        return file_types
+
+    def invalidate(self, dir_path: Path) -> None:
+        """Forget the configuration of a directory and everything under it.
+
+        This is needed whenever a configuration file in the directory was created, changed
+        or deleted, as the configuration of its subdirectories is merged from it.
+        """
+        self._loaded = {path: loaded for path, loaded in self._loaded.items() if not path.is_relative_to(dir_path)}
+        self._resolved = {key: config for key, config in self._resolved.items()
+                          if not key[0].is_relative_to(dir_path)}
+        self._configs = {key: config for key, config in self._configs.items()
+                         if not any(path.is_relative_to(dir_path) for __, path in key[0])}
+        self._file_types = {path: file_types for path, file_types in self._file_types.items()
+                            if not path.is_relative_to(dir_path)}
+
+    def _check_found(self, loaded: _DirConfig, dir_path: Path) -> ConfigDict:
+        if not loaded.found:
+            raise ConfigNotFoundError(f'No valid {CONFIG_FILE_NAME} file found in {dir_path}', dir_path)
+        return dict(loaded.config)
+
+    def _load_dir(self, dir_path: Path) -> _DirConfig:
+        if (loaded := self._loaded.get(dir_path)) is not None:
+            return loaded
+        config_path, config = _read_config_file(dir_path)
+        root = config.pop('root', False)
+        sources = dict.fromkeys(config, config_path) if config_path else {}
+        found = config_path is not None
+        if not root and dir_path.parent != dir_path:
+            parent = self._load_dir(dir_path.parent)
+            config = parent.config | config
+            sources = parent.sources | sources
+            found = found or parent.found
+        self._loaded[dir_path] = loaded = _DirConfig(config, sources, found)
+        return loaded
+
+
+def _read_config_file(dir_path: Path) -> tuple[Path | None, ConfigDict]:
+    """Read the configuration file placed in a directory, if there is one.
+
+    Returns the path of the configuration file and its contents.
+    """
+    check_path_yaml = dir_path / CONFIG_FILE_NAME
+    check_path_yml = dir_path / CONFIG_FILE_NAME_YML
+    found_yaml = check_path_yaml.is_file()
+    found_yml = check_path_yml.is_file()
+    stats.count('stat_calls', 2)
+    if found_yaml and found_yml:
+        raise ConfigError(f'Both {CONFIG_FILE_NAME} and {CONFIG_FILE_NAME_YML} files found in {dir_path}', dir_path)
+    if not found_yaml and not found_yml:
+        return None, {}
+    check_path = check_path_yaml if found_yaml else check_path_yml
+    return check_path, _load_yaml(check_path)
+
+
+def _load_yaml(config_path: Path) -> ConfigDict:
+    # Only imported when a configuration file is read, as it takes a while to import
+    import yaml
+
+    # The loader of libyaml is much faster, but it is not always available
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    try:
+        config = yaml.load(config_path.read_text(), Loader=loader)
+    except (yaml.YAMLError, UnicodeDecodeError) as e:
+        mark = getattr(e, 'problem_mark', None)
+        location = f' at line {mark.line + 1}' if mark else ''
+        raise ConfigError(f'Invalid YAML found in {config_path}{location}', config_path) from e
+    if not isinstance(config, dict):
+        raise ConfigError(f'Invalid configuration found in {config_path}: it must be a mapping', config_path)
     return config
 
 
 def _validate_config(config: ConfigDict) -> None:
-    valid_keys = {'owner', 'start_year', 'substring', 'template'}
+    valid_keys = {'owner', 'start_year', 'substring', 'template', 'max_header_lines', 'max_header_bytes', 'file_types',
+                  'encoding'}
     mandatory_keys = {'owner', 'template'}
     config_keys = set(config)
     invalid_keys = config_keys - valid_keys
     missing_keys = mandatory_keys - config_keys
     if invalid_keys:
-        click.secho(f'Invalid key found in {CONFIG_FILE_NAME} files: {list(invalid_keys)[0]}', fg='red', err=True)
-        sys.exit(1)
+        raise ConfigError(f'Invalid key found in {CONFIG_FILE_NAME} files: {list(invalid_keys)[0]}')
     if missing_keys:
-        click.secho(f'No valid {CONFIG_FILE_NAME} files found: {list(missing_keys)[0]} is missing', fg='red', err=True)
-        sys.exit(1)
-
-
-def _walk_to_root(path: Path) -> Iterator[Path]:
-    """Yield directories starting from the given directory up to the root."""
-    if not path.exists():
-        raise OSError('Starting path not found')
-    if path.is_file():
-        path = path.parent
-    yield path
-    yield from path.parents
+        raise ConfigError(f'No valid {CONFIG_FILE_NAME} files found: {list(missing_keys)[0]} is missing')
+    for key in ('max_header_lines', 'max_header_bytes'):
+        value = config.get(key)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+            raise ConfigError(f'Invalid value found in {CONFIG_FILE_NAME} files: {key} must be a positive integer')
+    if 'encoding' in config and not _is_ascii_compatible(config['encoding']):
+        raise ConfigError(f'Invalid value found in {CONFIG_FILE_NAME} files: encoding must be an ASCII-compatible '
+                          'encoding')
+
+
+def _is_ascii_compatible(encoding: Any) -> bool:
+    if not isinstance(encoding, str):
+        return False
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        return False
+    # Comments are scanned for at the byte level, which requires ASCII characters to be encoded as they are
+    return '\n#/*-'.encode(encoding, 'replace') == b'\n#/*-'
+
+
+def _generate_header(data: ConfigDict, template_path: Path | None = None) -> str:
+    if 'start_year' not in data:
+        data['start_year'] = data['end_year']
+    if data['start_year'] == data['end_year']:
+        data['dates'] = data['start_year']
+    else:
+        data['dates'] = '{} - {}'.format(data['start_year'], data['end_year'])
+    template_data = {k: v for k, v in data.items() if k not in NON_TEMPLATE_KEYS}
+    try:
+        comment = '\n'.join(line.rstrip() for line in data['template'].format(**template_data).strip().splitlines())
+    except KeyError as e:
+        location = f' in {template_path}' if template_path else ''
+        raise ConfigError(f'Invalid placeholder {{{e.args[0]}}} found in template{location}', template_path) from e
+    return f'{comment}\n'
+
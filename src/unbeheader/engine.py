@@ -0,0 +1,176 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+from collections import deque
+from collections.abc import AsyncGenerator
+from collections.abc import Iterable
+from collections.abc import Iterator
+from itertools import islice
+from pathlib import Path
+
+from . import stats
+from .cache import ResultCache
+from .config import ConfigResolver
+from .headers import process_header
+from .typing import HeaderResult
+
+# The number of files sent to a worker process at once
+CHUNK_SIZE = 64
+
+# The engines available to process files
+ENGINES = ('process', 'async')
+
+# The default number of files processed at once by the async engine
+ASYNC_JOBS = 32
+
+# The resolver and cache of the current worker process, shared by all the batches it processes
+_worker_resolver: ConfigResolver | None = None
+_worker_cache: ResultCache | None = None
+
+
+def process_files(file_paths: Iterable[Path], year: int, check: bool, jobs: int = 1,
+                  cache: ResultCache | None = None, engine: str = 'process',
+                  resolver: ConfigResolver | None = None) -> Iterator[HeaderResult]:
+    """Process the headers of files, yielding the results as they become available.
+
+    With the ``process`` engine and more than one job, the files are processed in batches
+    by a pool of worker processes and the results are yielded in completion order. Runs
+    that do not fill a single batch are processed in the current process without starting
+    a pool. With the ``async`` engine, see :func:`process_files_async`. Closing the iterator
+    cancels the files that have not been started yet.
+
+    :param file_paths: The paths of the files to process.
+    :param year: The year to update the headers to.
+    :param check: Whether to only check the headers without updating the files.
+    :param jobs: The number of worker processes to use, or the number of files processed
+                 at once with the ``async`` engine.
+    :param cache: The cache of the files which were up to date in previous runs. Entries
+                  recorded by worker processes are merged into it, as are their stats when
+                  stats are enabled.
+    :param engine: The engine to process the files with, one of :data:`ENGINES`.
+    :param resolver: The resolver to get the configuration from, unless processed by worker
+                     processes, which use their own.
+    """
+    if engine == 'async':
+        yield from _run_async(process_files_async(file_paths, year, check, jobs, cache, resolver))
+        return
+    file_paths = iter(file_paths)
+    if jobs > 1:
+        batch = list(islice(file_paths, CHUNK_SIZE))
+        if len(batch) == CHUNK_SIZE:
+            yield from _process_in_pool(batch, file_paths, year, check, jobs, cache)
+            return
+        file_paths = iter(batch)
+    resolver = resolver or ConfigResolver()
+    for file_path in file_paths:
+        yield process_header(file_path, year, check, resolver, cache)
+
+
+async def process_files_async(file_paths: Iterable[Path], year: int, check: bool, jobs: int = ASYNC_JOBS,
+                              cache: ResultCache | None = None,
+                              resolver: ConfigResolver | None = None) -> AsyncGenerator[HeaderResult, None]:
+    """Process the headers of files concurrently, yielding the results in the order of the files.
+
+    The blocking file system calls of every file are run in a bounded pool of threads, so
+    that many files and configuration files are read at once. The files are discovered in a
+    thread of their own, which looks for the next file while the previous ones are processed,
+    so that walking directories and checking exclusions never block the event loop. This is
+    meant for file systems with a high latency, such as network mounts, where processing
+    files is not CPU-bound.
+
+    :param file_paths: The paths of the files to process.
+    :param year: The year to update the headers to.
+    :param check: Whether to only check the headers without updating the files.
+    :param jobs: The maximum number of files processed at once.
+    :param cache: The cache of the files which were up to date in previous runs.
+    :param resolver: The resolver to get the configuration from.
+    """
+    # Only imported when needed, as they take a while to import
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    loop = asyncio.get_running_loop()
+    resolver = resolver or ConfigResolver()
+    executor = ThreadPoolExecutor(jobs)
+    discovery = ThreadPoolExecutor(1)
+    pending: deque[asyncio.Future[HeaderResult]] = deque()
+    file_paths = iter(file_paths)
+    try:
+        next_path = loop.run_in_executor(discovery, next, file_paths, None)
+        while (file_path := await next_path) is not None:
+            next_path = loop.run_in_executor(discovery, next, file_paths, None)
+            pending.append(loop.run_in_executor(executor, process_header, file_path, year, check, resolver, cache))
+            if len(pending) >= jobs:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        discovery.shutdown(cancel_futures=True)
+        executor.shutdown(cancel_futures=True)
+
+
+def _run_async(results: AsyncGenerator[HeaderResult, None]) -> Iterator[HeaderResult]:
+    """Iterate over asynchronous results, running an event loop while waiting for each of them."""
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(anext(results))
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
+
+
+def _process_in_pool(batch: list[Path], file_paths: Iterator[Path], year: int, check: bool, jobs: int,
+                     cache: ResultCache | None) -> Iterator[HeaderResult]:
+    # Only imported when needed, as they take a while to import
+    from concurrent.futures import FIRST_COMPLETED
+    from concurrent.futures import Future
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures import wait
+
+    main_stats = stats.get_stats()
+    stats_trace = main_stats.events is not None if main_stats else None
+    executor = ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(cache, stats_trace))
+    pending: set[Future[tuple[list[HeaderResult], ResultCache | None, stats.Stats | None]]] = set()
+    try:
+        while batch or pending:
+            # Keep every worker busy while bounding the number of paths held in memory
+            while batch and len(pending) < jobs * 2:
+                pending.add(executor.submit(_process_batch, batch, year, check))
+                batch = list(islice(file_paths, CHUNK_SIZE))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results, worker_cache, worker_stats = future.result()
+                if cache and worker_cache:
+                    cache.merge(worker_cache)
+                if main_stats and worker_stats:
+                    main_stats.merge(worker_stats)
+                yield from results
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def _init_worker(cache: ResultCache | None, stats_trace: bool | None = None) -> None:
+    global _worker_resolver, _worker_cache
+    _worker_resolver = ConfigResolver()
+    _worker_cache = cache
+    if cache:
+        # Only send back what this process records, the rest is already known to the main process
+        cache.drain()
+    # Record stats if enabled in the main process, and only then
+    if stats_trace is not None:
+        stats.enable(stats_trace)
+    else:
+        stats.disable()
+
+
+def _process_batch(file_paths: list[Path], year: int,
+                   check: bool) -> tuple[list[HeaderResult], ResultCache | None, stats.Stats | None]:
+    results = [process_header(file_path, year, check, _worker_resolver, _worker_cache) for file_path in file_paths]
+    worker_stats = stats.get_stats()
+    return results, _worker_cache.drain() if _worker_cache else None, worker_stats.drain() if worker_stats else None
@@ -0,0 +1,29 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+from pathlib import Path
+
+
+class UnbeheaderError(Exception):
+    """Base class of the errors raised by Unbeheader."""
+
+
+class ConfigError(UnbeheaderError):
+    """The configuration of a file is invalid.
+
+    :param message: The description of the error.
+    :param path: The configuration file or directory the error was found in, if known.
+    """
+
+    def __init__(self, message: str, path: Path | None = None) -> None:
+        """Create the error for a configuration file or directory."""
+        super().__init__(message)
+        self.path = path
+
+    def __reduce__(self) -> tuple[type, tuple[str, Path | None]]:
+        """Keep the path when the error is sent back from a worker process."""
+        return type(self), (self.args[0], self.path)
+
+
+class ConfigNotFoundError(ConfigError):
+    """No configuration file applies to a file."""
@@ -0,0 +1,146 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+from collections.abc import Callable
+from collections.abc import Iterator
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any
+from typing import TypeAlias
+
+from . import SUPPORTED_FILE_TYPES
+from .exceptions import ConfigError
+from .scanner import HeaderScanner
+from .typing import CommentSkeleton
+from .typing import SupportedFileType
+
+# The keys of a file type declared in a configuration file
+FILE_TYPE_KEYS = frozenset({'extensions', 'comment_start', 'comment_middle', 'comment_end'})
+
+# The scanners of the built-in file types, reused by the declared file types commenting the same way
+_scanners: dict[CommentSkeleton, HeaderScanner] = {
+    file_type.comments: file_type.scanner for file_type in SUPPORTED_FILE_TYPES.values()
+}
+
+
+class FileTypeRegistry(Mapping[str, SupportedFileType]):
+    """Lookup of the file types by extension, shared by all the directories it applies to.
+
+    The registry maps extensions without leading dot to their file type, and finds the
+    extension of a file name with at most one dictionary lookup per part of the longest
+    extension, so that multi-part extensions such as ``d.ts`` take precedence over ``ts``.
+
+    :param file_types: The file types by extension.
+    """
+
+    def __init__(self, file_types: Mapping[str, SupportedFileType]) -> None:
+        """Create a registry of the given file types."""
+        self._file_types = dict(file_types)
+        # The number of parts of the longest extension, which bounds the suffixes looked up
+        self._max_parts = max((ext.count('.') + 1 for ext in self._file_types), default=1)
+
+    def __getitem__(self, ext: str) -> SupportedFileType:
+        """Get the file type of an extension."""
+        return self._file_types[ext]
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the extensions."""
+        return iter(self._file_types)
+
+    def __len__(self) -> int:
+        """Get the number of extensions."""
+        return len(self._file_types)
+
+    def match(self, name: str) -> str | None:
+        """Get the longest extension of a file name which has a file type, if any.
+
+        The leading dot of hidden files never starts an extension.
+        """
+        if self._max_parts == 1:
+            head, _, ext = name.rpartition('.')
+            return ext if head and ext in self._file_types else None
+        longest = None
+        pos = len(name)
+        for __ in range(self._max_parts):
+            pos = name.rfind('.', 0, pos)
+            if pos < 1:
+                break
+            if name[pos + 1:] in self._file_types:
+                longest = name[pos + 1:]
+        return longest
+
+    def get_file_type(self, name: str) -> SupportedFileType | None:
+        """Get the file type of a file name, if it has one."""
+        ext = self.match(name)
+        return self._file_types[ext] if ext is not None else None
+
+
+# The registry of the built-in file types, used unless other file types are declared
+DEFAULT_FILE_TYPES = FileTypeRegistry(SUPPORTED_FILE_TYPES)
+
+# A lookup of the file types of the files in a directory
+FileTypesLookup: TypeAlias = Callable[[Path], FileTypeRegistry]
+
+
+def compile_file_types(declared: Any, config_path: Path | None = None) -> FileTypeRegistry:
+    """Compile the file types declared in a configuration file into a registry.
+
+    The declared file types are added to the built-in ones, replacing them for the same
+    extensions. Their scanners are derived from their comment skeleton: block comments if
+    it has a comment end, and line comments otherwise. Scanners are shared by all the file
+    types commenting the same way, including the built-in ones.
+
+    :param declared: The list of file types, as loaded from the ``file_types`` key.
+    :param config_path: The configuration file the file types are declared in.
+    :raise ConfigError: If the file types are invalid.
+    """
+    if not isinstance(declared, list):
+        raise _invalid('file_types must be a list', config_path)
+    file_types = dict(SUPPORTED_FILE_TYPES)
+    for entry in declared:
+        if not isinstance(entry, dict):
+            raise _invalid('every file type must be a mapping', config_path)
+        if invalid_keys := entry.keys() - FILE_TYPE_KEYS:
+            raise _invalid(f'invalid file type key {sorted(invalid_keys)[0]}', config_path)
+        extensions = entry.get('extensions')
+        if isinstance(extensions, str):
+            extensions = [extensions]
+        if not extensions or not isinstance(extensions, list):
+            raise _invalid('every file type must have extensions', config_path)
+        comments = _get_comments(entry, config_path)
+        file_type = SupportedFileType(_get_scanner(comments), comments)
+        for ext in extensions:
+            if not isinstance(ext, str) or not all(ext.removeprefix('.').split('.')) or '/' in ext:
+                raise _invalid(f'invalid extension {ext}', config_path)
+            file_types[ext.removeprefix('.')] = file_type
+    return FileTypeRegistry(file_types)
+
+
+def _get_comments(entry: dict[str, Any], config_path: Path | None) -> CommentSkeleton:
+    values = {key: entry.get(key, '') for key in ('comment_start', 'comment_middle', 'comment_end')}
+    for key, value in values.items():
+        if not isinstance(value, str):
+            raise _invalid(f'{key} must be a string', config_path)
+    comments = CommentSkeleton(**values)
+    if not comments.comment_start.strip():
+        raise _invalid('every file type must have a comment_start', config_path)
+    # The lines of a header made of line comments must all be found as a single run of them
+    if not comments.comment_end.strip() and not comments.comment_middle.strip().startswith(
+            comments.comment_start.strip()):
+        raise _invalid('comment_middle must start with comment_start for line comments', config_path)
+    return comments
+
+
+def _get_scanner(comments: CommentSkeleton) -> HeaderScanner:
+    if (scanner := _scanners.get(comments)) is None:
+        if comments.comment_end.strip():
+            scanner = HeaderScanner(block_comment=(comments.comment_start.strip(), comments.comment_end.strip()))
+        else:
+            scanner = HeaderScanner(line_comment=comments.comment_start.strip())
+        _scanners[comments] = scanner
+    return scanner
+
+
+def _invalid(message: str, config_path: Path | None) -> ConfigError:
+    location = f' in {config_path}' if config_path else ''
+    return ConfigError(f'Invalid file types found{location}: {message}', config_path)
@@ -1,102 +1,371 @@
 # This file is part of Unbeheader.
 # Copyright (C) CERN & UNCONVENTIONAL
 
+import errno
+import mmap
 import os
-import sys
-from dataclasses import asdict
+import re
+import stat
+from io import BufferedReader
 from pathlib import Path
-from re import Pattern
+from typing import NamedTuple
 
-import click
-
-from . import SUPPORTED_FILE_TYPES
-from .config import get_config
+from . import stats
+from .cache import ResultCache
+from .config import ConfigResolver
+from .config import HeaderConfig
+from .exceptions import UnbeheaderError
+from .scanner import HeaderScanner
 from .typing import CommentSkeleton
-from .typing import ConfigDict
-from .util import cformat
+from .typing import HeaderResult
+from .typing import Span
+
+# The size from which files are memory-mapped instead of read when only checking them
+MMAP_MIN_SIZE = 64 * 1024
+
+# The size of the chunks copied from the original file when replacing it
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# The maximum number of changed bytes patched in place instead of replacing the file
+PATCH_MAX_SIZE = 4096
+
+# The size of the chunks compared when looking for the changed bytes
+COMPARE_CHUNK_SIZE = 256
+
+# The whitespace bytes stripped around headers, the same as the ones stripped by bytes.strip()
+WHITESPACE = b' \t\n\r\x0b\x0c'
+WHITESPACE_RE = re.compile(rb'[ \t\n\r\x0b\x0c]*')
+
 
+class _UpdatedContent(NamedTuple):
+    # The updated content up to the offset from which the original content follows unchanged
+    head: bytes
+    # The offset in the original content from which it follows the head unchanged
+    body_start: int
+    # Whether a header was found in the original content
+    found: bool
+    # The span of the header found in the original content
+    old_span: Span | None = None
+    # The span of the header in the updated content
+    new_span: Span | None = None
 
-def update_header(file_path: Path, year: int, check: bool = False) -> bool:
-    """Update the header of a file."""
-    config = get_config(file_path, year)
-    ext = file_path.suffix[1:]
-    if ext not in SUPPORTED_FILE_TYPES or not file_path.is_file():
-        return False
+
+def process_header(file_path: Path, year: int, check: bool = False, resolver: ConfigResolver | None = None,
+                   cache: ResultCache | None = None) -> HeaderResult:
+    """Update the header of a file without reporting the result.
+
+    The type of the file is looked up in the file types of its directory. Instead of being
+    raised, errors are returned in the result, along with the spans of the header unless
+    the file was known to be up to date from the cache.
+
+    :param file_path: The path of the file to update.
+    :param year: The year to update the header to.
+    :param check: Whether to only check the header without updating the file.
+    :param resolver: The resolver to get the configuration from, shared by all the files in a run.
+    :param cache: The cache of the files which were up to date in previous runs.
+    """
+    stats.count('files')
     if file_path.name.startswith('.'):
-        return False
-    return _do_update_header(
-        file_path, config, SUPPORTED_FILE_TYPES[ext].regex, SUPPORTED_FILE_TYPES[ext].comments, check
-    )
+        return HeaderResult(file_path, changed=False, found=False, skipped=True)
+    resolver = resolver or ConfigResolver()
+    try:
+        file_type = resolver.get_file_types(file_path.parent).get_file_type(file_path.name)
+    except (UnbeheaderError, OSError) as e:
+        return HeaderResult(file_path, changed=False, found=False, error=e)
+    stats.count('stat_calls')
+    if file_type is None or not file_path.is_file():
+        return HeaderResult(file_path, changed=False, found=False, skipped=True)
+    try:
+        config = resolver.get_config(file_path, year)
+        if cache and (found := cache.lookup(file_path, config.digest)) is not None:
+            return HeaderResult(file_path, changed=False, found=found)
+        result = _do_update_header(file_path, config, file_type.scanner, file_type.comments, check)
+    except (UnbeheaderError, OSError) as e:
+        return HeaderResult(file_path, changed=False, found=False, error=e)
+    if cache and not (check and result.changed):
+        cache.store(file_path, config.digest, result.found)
+    return result
 
 
-def _do_update_header(file_path: Path, config: ConfigDict, regex: Pattern[str], comments: CommentSkeleton,
-                      check: bool) -> bool:
-    found = False
-    content = orig_content = file_path.read_text()
+def _do_update_header(file_path: Path, config: HeaderConfig, scanner: HeaderScanner, comments: CommentSkeleton,
+                      check: bool) -> HeaderResult:
+    updated = None
+    with file_path.open('rb') as f:
+        file_stat = os.fstat(f.fileno())
+        stats.count('stat_calls')
+        size = file_stat.st_size
+        # Only scan the leading window of the file if configured to
+        if config.max_header_lines or config.max_header_bytes:
+            with stats.phase('read'):
+                orig_content, truncated = _read_header_window(f, size, config.max_header_lines,
+                                                              config.max_header_bytes)
+            stats.count('bytes_read', len(orig_content))
+            with stats.phase('match'):
+                updated = _update_content(orig_content, config, scanner, comments, truncated=truncated)
+            # A header may still follow the window, which must not be duplicated when updating the file
+            if updated is not None and truncated and not updated.found and not check:
+                updated = None
+        # Check large files through a read-only mapping, so that they are not copied in memory when up to date
+        if updated is None and check and size >= MMAP_MIN_SIZE:
+            stats.count('bytes_mapped', size)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, stats.phase('match'):
+                if span := _match_header(mapped, config, scanner, comments, _detect_newline(mapped)):
+                    return HeaderResult(file_path, changed=False, found=True, old_span=span, new_span=span)
+        # Scan the whole file if there is no window or if it does not hold the whole header
+        if updated is None:
+            f.seek(0)
+            with stats.phase('read'):
+                orig_content = f.read()
+            stats.count('bytes_read', len(orig_content))
+            with stats.phase('match'):
+                updated = _update_content(orig_content, config, scanner, comments)
+        assert updated is not None
+        head, body_start, found, old_span, new_span = updated
+        result = HeaderResult(file_path, changed=True, found=found, old_span=old_span, new_span=new_span)
+        same_length = len(head) == body_start
+        # Report that nothing changed
+        if same_length and orig_content.startswith(head):
+            return result._replace(changed=False)
+        if check:
+            return result
+        # Patch the changed bytes in place if the length of the content did not change
+        if same_length:
+            start, end = _find_changed_range(orig_content, head)
+            if end - start <= PATCH_MAX_SIZE:
+                with stats.phase('write'):
+                    _patch_file(file_path, head[start:end], start)
+                stats.count('bytes_written', end - start)
+                return result
+        # Write the updated file, copying the rest of the original file as it is
+        f.seek(body_start)
+        with stats.phase('write'):
+            _replace_file(file_path, head, f, file_stat.st_mode)
+        stats.count('bytes_written', len(head) + size - body_start)
+    return result
+
+
+def _find_changed_range(orig_content: bytes, content: bytes) -> tuple[int, int]:
+    """Get the start and end offsets of the bytes which differ between a content and the start of the original one.
+
+    The content replaces as many bytes of the original content as it holds, and must differ from them.
+    """
+    start = 0
+    # Compare whole chunks first, only comparing single bytes in the first one which differs
+    while orig_content[start:start + COMPARE_CHUNK_SIZE] == content[start:start + COMPARE_CHUNK_SIZE]:
+        start += COMPARE_CHUNK_SIZE
+    while orig_content[start] == content[start]:
+        start += 1
+    end = len(content)
+    while end - COMPARE_CHUNK_SIZE > start and \
+            orig_content[end - COMPARE_CHUNK_SIZE:end] == content[end - COMPARE_CHUNK_SIZE:end]:
+        end -= COMPARE_CHUNK_SIZE
+    while orig_content[end - 1] == content[end - 1]:
+        end -= 1
+    return start, end
+
+
+def _patch_file(file_path: Path, data: bytes, offset: int) -> None:
+    """Overwrite bytes of a file in place, leaving the rest of it untouched."""
+    fd = os.open(file_path, os.O_WRONLY)
+    try:
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    finally:
+        os.close(fd)
+
+
+def _replace_file(file_path: Path, head: bytes, rest: BufferedReader, mode: int) -> None:
+    """Replace a file with new content, followed by the rest of a file copied in chunks.
+
+    Only the updated start of the file is held in memory, the rest of it is streamed from
+    the original file.
+
+    The new file is written to a temporary file in the same directory, flushed to disk and
+    moved over the original one, so that the original file is left intact if writing it is
+    interrupted, even by a power loss. Symlinks are followed and the permissions of the
+    original file are kept. Read-only files are not replaced, the same as when patching them.
+    """
+    file_path = Path(os.path.realpath(file_path))
+    if not os.access(file_path, os.W_OK):
+        raise PermissionError(errno.EACCES, os.strerror(errno.EACCES), str(file_path))
+    # Only imported when needed, as they take a while to import
+    import shutil
+    import tempfile
+
+    fd, tmp_name = tempfile.mkstemp(prefix=f'.{file_path.name}.', suffix='.tmp', dir=file_path.parent)
+    try:
+        with open(fd, 'wb') as f:
+            f.write(head)
+            shutil.copyfileobj(rest, f, COPY_CHUNK_SIZE)
+            os.fchmod(f.fileno(), stat.S_IMODE(mode))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, file_path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def _update_content(content: bytes, config: HeaderConfig, scanner: HeaderScanner, comments: CommentSkeleton,
+                    truncated: bool = False) -> _UpdatedContent | None:
+    """Update the header in the content of a file.
+
+    The content is never decoded, and the header uses the same line endings as the
+    first line of the content. Every comment holding the substring is replaced with the
+    header, and so are the blank lines following it. Only the start of the updated content
+    up to the end of the last header is assembled, from offsets into the original content
+    with a single join, and the rest of the original content is left to be copied as it is.
+    Nothing is assembled when nothing changed.
+
+    Returns the start of the updated content and the offset from which the original content
+    follows it, whether a header was found in it and the spans of the header. If the content
+    is truncated, ``None`` is returned when it does not fully hold the header and the content
+    following it, meaning that the whole file needs to be scanned instead. A truncated content
+    without a header is updated as if it had none, even though one may follow it.
+    """
+    newline = _detect_newline(content)
+    # Skip the scan if the content already starts with the header
+    if span := _match_header(content, config, scanner, comments, newline):
+        return _UpdatedContent(b'', 0, True, span, span)
+    size = len(content)
     # Do nothing for empty files
-    if not content.strip():
-        return False
-    # Save the shebang line if there is one
-    shebang_line = None
-    if content.startswith('#!/'):
-        shebang_line, content = content.split('\n', 1)
-    # Find and update the header
-    for match in regex.finditer(content):
-        if config['substring'] in match.group():
-            found = True
-            match_end = content[match.end():].lstrip()
-            match_end = f'\n{match_end}' if match_end else match_end
-            if not content[:match.start()].strip() and not match_end.strip():
-                # file is otherwise empty, we do not want a header in there
-                content = ''
-            else:
-                content = content[:match.start()] + _generate_header(asdict(comments) | config) + match_end
-    # Strip leading empty characters
-    content = content.lstrip()
+    if not truncated and _skip_whitespace(content, 0) == size:
+        return _UpdatedContent(b'', 0, False)
+    header = config.encode_header(comments, newline)
+    view = memoryview(content)
+    segments: list[bytes | memoryview] = []
+    # Keep the shebang line if there is one
+    body_start = 0
+    if content.startswith(b'#!/'):
+        body_start = content.find(b'\n') + 1 or size
+        segments.append(view[:body_start])
+        if body_start == size and not content.endswith(b'\n'):
+            segments.append(b'\n')
+    found = False
+    old_span = header_pos = None
+    # The offset from which the original content is copied next, skipping leading empty characters
+    pos = _skip_whitespace(content, body_start)
+    # The line break separating a header from the content following it, when there is any
+    separator = b''
+    for start, end in scanner.finditer(content, body_start):
+        if content.find(config.encoded_substring, start, end) == -1:
+            continue
+        # Runs of line comments are found from the line break before them, which is kept
+        if content.startswith((b'\n', b'\r'), start):
+            start += 1
+        rest_start = _skip_whitespace(content, end)
+        if truncated and rest_start == size:
+            # The header may continue after the window
+            return None
+        if old_span is None:
+            old_span = (start, _rstrip_end(content, start, end))
+            if pos == start and rest_start == size:
+                # The file is otherwise empty, we do not want a header in there
+                found = True
+                pos = size
+                break
+        found = True
+        segments += (separator, view[pos:start])
+        header_pos = sum(map(len, segments))
+        segments.append(header)
+        pos = rest_start
+        separator = newline if rest_start < size else b''
     # Add the header if it was not found
     if not found:
-        content = _generate_header(asdict(comments) | config) + '\n' + content
-    # Readd the shebang line if it was there
-    if shebang_line:
-        content = shebang_line + '\n' + content
-    # Report that nothing changed
-    if content == orig_content:
-        return False
-    # Print header update results
-    _print_results(file_path, found=found, check=check)
-    # Write the updated file to disk
-    if not check:
-        file_path.write_text(content)
-    return True
-
-
-def _generate_header(data: ConfigDict) -> str:
-    if 'start_year' not in data:
-        data['start_year'] = data['end_year']
-    if data['start_year'] == data['end_year']:
-        data['dates'] = data['start_year']
-    else:
-        data['dates'] = '{} - {}'.format(data['start_year'], data['end_year'])
-    template_data = {k: v for k, v in data.items() if k not in {'root', 'substring', 'template'}}
-    try:
-        comment = '\n'.join(line.rstrip() for line in data['template'].format(**template_data).strip().splitlines())
-    except KeyError as e:
-        click.secho(f'Invalid placeholder {{{e.args[0]}}} found in template', fg='red', err=True)
-        sys.exit(1)
-    return f'{comment}\n'
-
-
-def _print_results(file_path: Path, found: bool, check: bool) -> None:
-    ci = os.environ.get('CI') in {'1', 'true'}
-    if found:
-        check_msg = 'Incorrect header in {}' if ci else 'Incorrect header in %{white!}{}'
-        fix_msg = 'Updating header in {}' if ci else 'Updating header in %{white!}{}'
-        msg = check_msg if check else fix_msg
-    else:
-        check_msg = 'Missing header in {}' if ci else 'Missing header in %{white!}{}'
-        fix_msg = 'Adding header in {}' if ci else 'Adding header in %{white!}{}'
-        msg = check_msg if check else fix_msg
-    if ci:
-        print(msg.format(os.path.relpath(file_path)))
+        header_pos = sum(map(len, segments))
+        segments += (header, newline)
+    segments.append(separator)
+    new_span = (header_pos, header_pos + len(header.rstrip())) if header_pos is not None else None
+    return _UpdatedContent(*_join_head(content, segments, pos), found, old_span, new_span)
+
+
+def _join_head(content: bytes, segments: list[bytes | memoryview], body_start: int) -> tuple[bytes, int]:
+    """Join the segments of an updated content preceding the offset from which the original content follows.
+
+    Nothing is joined if they add up to the original content up to that offset, in which
+    case an empty head from the start of the content is returned.
+    """
+    pos = 0
+    for segment in segments:
+        if not content.startswith(segment, pos):
+            return b''.join(segments), body_start
+        pos += len(segment)
+    return (b'', 0) if pos == body_start else (b''.join(segments), body_start)
+
+
+def _skip_whitespace(content: bytes, pos: int) -> int:
+    """Get the offset of the first non-whitespace byte from a position, or the size of the content."""
+    match = WHITESPACE_RE.match(content, pos)
+    assert match is not None
+    return match.end()
+
+
+def _rstrip_end(content: bytes, start: int, end: int) -> int:
+    """Get the end of a span of the content without its trailing whitespace."""
+    while end > start and content[end - 1] in WHITESPACE:
+        end -= 1
+    return end
+
+
+def _match_header(content: bytes | mmap.mmap, config: HeaderConfig, scanner: HeaderScanner,
+                  comments: CommentSkeleton, newline: bytes) -> Span | None:
+    """Get the span of the expected header if the content starts with it and is left unchanged by updating it.
+
+    This is the case when the header is followed by a blank line and the rest of the
+    content, and no other comment holds the substring.
+    """
+    header_end = config.get_header_end(comments, scanner, newline)
+    if header_end is None:
+        return None
+    header = config.encode_header(comments, newline)
+    start = content.find(b'\n') + 1 if content[:3] == b'#!/' else 0
+    body_start = start + len(header) + len(newline)
+    if not start and content[:3] == b'#!/':
+        return None
+    if content[start:body_start] != header + newline:
+        return None
+    if body_start == len(content) or content[body_start:body_start + 1].isspace():
+        return None
+    # A run of line comments ending the header would go on with the first line of the rest
+    line_comment = scanner.line_comment
+    if header_end == len(header) and line_comment:
+        encoded_line_comment = line_comment.encode()
+        if content[body_start:body_start + len(encoded_line_comment)] == encoded_line_comment:
+            return None
+    if content.find(config.encoded_substring, start + header_end) != -1:
+        return None
+    return start, start + len(header.rstrip())
+
+
+def _detect_newline(content: bytes | mmap.mmap) -> bytes:
+    """Get the line ending used by the first line of the content."""
+    pos = content.find(b'\n')
+    return b'\r\n' if pos > 0 and content[pos - 1:pos] == b'\r' else b'\n'
+
+
+def _read_header_window(f: BufferedReader, size: int, max_lines: int | None,
+                        max_bytes: int | None) -> tuple[bytes, bool]:
+    """Read the leading window of a file which may contain the header.
+
+    The window is cut at a line boundary unless it spans the whole file.
+
+    Returns the window and whether it is truncated.
+    """
+    if not max_lines:
+        window = f.read(max_bytes)
     else:
-        print(cformat(msg).format(os.path.relpath(file_path)))
+        lines = []
+        remaining = max_bytes or -1
+        for _ in range(max_lines):
+            if not (line := f.readline(remaining)):
+                break
+            lines.append(line)
+            if max_bytes and not (remaining := remaining - len(line)):
+                break
+        window = b''.join(lines)
+    if len(window) == size:
+        return window, False
+    return window[:window.rfind(b'\n') + 1], True
+
@@ -0,0 +1,184 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+import json
+import os
+import sys
+from collections import Counter
+from collections.abc import Iterable
+from functools import cache
+from typing import Any
+from typing import TextIO
+
+import click
+
+from .typing import HeaderResult
+from .typing import HeaderStatus
+from .util import cformat
+
+# The formats the results can be reported in
+FORMATS = ('text', 'json', 'jsonl')
+
+# The messages reported for changed files, depending on whether their header was found and on whether only checking
+RESULT_MESSAGES = {
+    (True, True): 'Incorrect header in',
+    (True, False): 'Updating header in',
+    (False, True): 'Missing header in',
+    (False, False): 'Adding header in',
+}
+
+
+class Reporter:
+    """Report the results of processing files as text.
+
+    Every batch of results is sorted by path and written at once, and a summary is written
+    when finishing. In quiet mode, only the summary is written.
+
+    :param check: Whether the files were only checked.
+    :param quiet: Whether to only report the summary.
+    :param stream: The stream to write to, which defaults to the standard output.
+    """
+
+    def __init__(self, check: bool, quiet: bool = False, stream: TextIO | None = None) -> None:
+        """Create a reporter which did not report anything yet."""
+        self.check = check
+        self.quiet = quiet
+        self.stream = stream or sys.stdout
+        self.counts: Counter[HeaderStatus] = Counter()
+        self._cwd = os.getcwd()
+
+    def start(self, msg: str, **kwargs: object) -> None:
+        """Report what is about to be processed.
+
+        :param msg: The message, with the colors of :func:`cformat` and placeholders.
+        :param kwargs: The values of the placeholders.
+        """
+        if not self.quiet:
+            self.stream.write(f'{cformat(msg).format(**kwargs)}\n')
+            self.stream.flush()
+
+    def report(self, results: Iterable[HeaderResult], keep_going: bool = False) -> bool:
+        """Report a batch of results.
+
+        The first error found is raised unless keeping going, in which case all of them are
+        reported. The results preceding an error are reported before raising it, as their
+        files may already have been updated. Returns whether any of the headers was or needs
+        to be added or updated.
+
+        :param results: The results of processing files.
+        :param keep_going: Whether to report errors instead of raising them.
+        """
+        changed_results: list[HeaderResult] = []
+        for result in results:
+            if result.error and not keep_going:
+                self._write_changed(changed_results)
+                raise result.error
+            self.counts[result.status] += 1
+            if result.error:
+                click.secho(f'{self._get_path(result)}: {result.error}', fg='red', err=True)
+            if result.changed:
+                changed_results.append(result)
+        self._write_changed(changed_results)
+        return bool(changed_results)
+
+    def finish(self) -> None:
+        """Report the summary of all the results."""
+        if not self.counts[HeaderStatus.UPDATED] and not self.counts[HeaderStatus.ADDED]:
+            click.secho('✅ All headers are up to date', fg='green', file=self.stream)
+        elif self.check:
+            click.secho('❌ Some headers need to be added or updated', fg='red', file=self.stream)
+        else:
+            click.secho('🔄 Some headers have been updated', fg='yellow', file=self.stream)
+
+    def _get_path(self, result: HeaderResult) -> str:
+        return os.path.relpath(result.file_path, self._cwd)
+
+    def _write_changed(self, results: list[HeaderResult]) -> None:
+        if not self.quiet and results:
+            ci = os.environ.get('CI') in {'1', 'true'}
+            self.stream.write(''.join(_get_result_format(result.found, self.check, ci).format(self._get_path(result))
+                                      for result in sorted(results)))
+            self.stream.flush()
+
+
+class JsonReporter(Reporter):
+    """Report the results of processing files as a JSON document.
+
+    The document is written when finishing. It holds the results of all the files which
+    were not skipped, sorted by path, and the number of files with every status.
+    """
+
+    def __init__(self, check: bool, quiet: bool = False, stream: TextIO | None = None) -> None:
+        """Create a reporter which did not report anything yet."""
+        super().__init__(check, quiet, stream)
+        self._results: list[HeaderResult] = []
+
+    def start(self, msg: str, **kwargs: object) -> None:
+        """Ignore what is about to be processed, which is not part of the document."""
+
+    def report(self, results: Iterable[HeaderResult], keep_going: bool = False) -> bool:
+        """Report a batch of results. See :meth:`Reporter.report`."""
+        batch: list[HeaderResult] = []
+        for result in results:
+            if result.error and not keep_going:
+                self._add_results(batch)
+                raise result.error
+            self.counts[result.status] += 1
+            if not result.skipped:
+                batch.append(result)
+        self._add_results(batch)
+        return any(result.changed for result in batch)
+
+    def finish(self) -> None:
+        """Write the document."""
+        document = {
+            'check': self.check,
+            'results': [self._serialize(result) for result in sorted(self._results)],
+            'summary': {status.value: self.counts[status] for status in HeaderStatus},
+        }
+        self.stream.write(json.dumps(document) + '\n')
+        self.stream.flush()
+
+    def _add_results(self, results: list[HeaderResult]) -> None:
+        self._results += results
+
+    def _serialize(self, result: HeaderResult) -> dict[str, Any]:
+        return {
+            'path': self._get_path(result),
+            'status': result.status.value,
+            'found': result.found,
+            'old_span': result.old_span,
+            'new_span': result.new_span,
+            'error': str(result.error) if result.error else None,
+        }
+
+
+class JsonLinesReporter(JsonReporter):
+    """Report the results of processing files as JSON lines.
+
+    A line is written for every file which was not skipped as soon as its batch of results
+    is reported, in the order the files were processed in, which may not be sorted.
+    """
+
+    def finish(self) -> None:
+        """Do nothing, as all the results were already written."""
+
+    def _add_results(self, results: list[HeaderResult]) -> None:
+        self.stream.write(''.join(json.dumps(self._serialize(result)) + '\n' for result in results))
+        self.stream.flush()
+
+
+@cache
+def _get_result_format(found: bool, check: bool, ci: bool) -> str:
+    """Get the format string of the line reported for a changed file, taking its path.
+
+    The colors of every kind of line are only rendered once, and never on CI.
+    """
+    msg = RESULT_MESSAGES[found, check]
+    return f'{msg} {{}}\n' if ci else f'{cformat(f"{msg} %{{white!}}{{}}")}\n'
+
+
+def create_reporter(output_format: str, check: bool, quiet: bool = False) -> Reporter:
+    """Create a reporter for one of the :data:`FORMATS`."""
+    reporter_class = {'text': Reporter, 'json': JsonReporter, 'jsonl': JsonLinesReporter}[output_format]
+    return reporter_class(check, quiet)
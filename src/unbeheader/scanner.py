@@ -0,0 +1,110 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+from collections.abc import Iterator
+from mmap import mmap
+from typing import Any
+from typing import NamedTuple
+
+
+class HeaderScanner:
+    """Scanner of the comments of a file which may hold its header.
+
+    A scanner finds runs of consecutive line comments and block comments in linear time,
+    yielding the same spans as the regular expressions previously used to find headers:
+
+    - A run of line comments starts at the beginning of the content or at a line break
+      followed by the comment prefix, and goes on for as long as the next line starts
+      with the prefix as well. It does not include the line break ending it.
+    - A block comment goes from its start delimiter up to the closest end delimiter.
+      Block comments that are never closed are ignored.
+
+    When both kinds of comments start at the same position, the block comment wins.
+
+    :param line_comment: The prefix of line comments, if supported.
+    :param block_comment: The start and end delimiters of block comments, if supported.
+    """
+
+    def __init__(self, line_comment: str | None = None, block_comment: tuple[str, str] | None = None) -> None:
+        """Create a scanner for the given kinds of comments."""
+        self.line_comment = line_comment
+        self.block_comment = block_comment
+        block_start, block_end = block_comment or ('', '')
+        self._delimiters = _Delimiters(line_comment or '', block_start, block_end, '\n', '\r')
+        self._byte_delimiters = _Delimiters(*(delimiter.encode() for delimiter in self._delimiters))
+
+    def finditer(self, content: str | bytes | mmap, pos: int = 0) -> Iterator[tuple[int, int]]:
+        """Yield the start and end offsets of the comments found in the content.
+
+        The content can be text, bytes or a memory-mapped file. Bytes are expected to be
+        in an ASCII-compatible encoding.
+
+        :param content: The content to scan.
+        :param pos: The offset to scan from, which is treated as the beginning of the content
+                    without copying the rest of it.
+        """
+        line_comment, block_start, block_end, lf, cr = (
+            self._delimiters if isinstance(content, str) else self._byte_delimiters
+        )
+        # The positions of the next candidates, only searched for again once they fall behind
+        # so that every part of the content is searched at most once for each of them
+        no_match = len(content)
+        next_lf = next_cr = -1 if line_comment else no_match
+        next_block = -1 if block_start else no_match
+        start = pos
+        if line_comment and content[pos:pos + len(line_comment)] == line_comment:
+            next_lf = pos
+        while pos < len(content):
+            if next_lf < pos:
+                next_lf = _find(content, lf + line_comment, pos, no_match)
+            if next_cr < pos:
+                next_cr = _find(content, cr + line_comment, pos, no_match)
+            if next_block < pos:
+                next_block = _find(content, block_start, pos, no_match)
+            next_line = min(next_lf, next_cr)
+            if next_block <= next_line and next_block != no_match:
+                end = content.find(block_end, next_block + len(block_start))
+                if end == -1:
+                    # No block comment from here on is ever closed
+                    next_block = no_match
+                    continue
+                pos = end + len(block_end)
+                yield next_block, pos
+            elif next_line != no_match:
+                pos = _find_line_comments_end(content, next_line, line_comment, lf, start)
+                yield next_line, pos
+            else:
+                break
+
+
+class _Delimiters(NamedTuple):
+    # The prefix of line comments
+    line_comment: Any
+    # The start delimiter of block comments
+    block_start: Any
+    # The end delimiter of block comments
+    block_end: Any
+    # The line feed and carriage return characters
+    lf: Any
+    cr: Any
+
+
+def _find(content: str | bytes | mmap, sub: Any, pos: int, default: int) -> int:
+    index = content.find(sub, pos)
+    return default if index == -1 else index
+
+
+def _find_line_comments_end(content: str | bytes | mmap, pos: int, line_comment: Any, lf: Any, start: int = 0) -> int:
+    prefix_size = len(line_comment)
+    # The run either starts with the prefix at the beginning of the content or with a line break
+    if pos == start and content[pos:pos + prefix_size] == line_comment:
+        body_pos = pos + prefix_size
+    else:
+        body_pos = pos + 1 + prefix_size
+    while True:
+        end = content.find(lf, body_pos)
+        if end == -1:
+            return len(content)
+        if content[end + 1:end + 1 + prefix_size] != line_comment:
+            return end
+        body_pos = end + 1 + prefix_size
@@ -0,0 +1,194 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterable
+from collections.abc import Iterator
+from types import TracebackType
+from typing import Any
+from typing import TypeVar
+
+# The phases of a run, in the order they are reported in
+PHASES = ('discovery', 'exclusion', 'config', 'read', 'match', 'render', 'write')
+
+# The lookups whose hit rate is reported, counted as <name>_hits and <name>_misses
+LOOKUPS = ('config', 'exclusion', 'cache')
+
+T = TypeVar('T')
+
+# The stats of the current process, only recorded while enabled
+_stats: Stats | None = None
+
+# Guards the timings and counters of the stats, which are recorded by the threads of the async engine
+_lock = threading.Lock()
+
+
+class Stats:
+    """Timings and counters of the phases of a run.
+
+    The wall time of every phase is accumulated along with the number of times it ran.
+    Phases may be nested, in which case the time of the inner phase is also part of the
+    outer one. Stats recorded by worker processes are summed, so the time of a phase may
+    exceed the wall time of the run.
+
+    :param trace: Whether to record every phase as an event of a Chrome trace.
+    """
+
+    def __init__(self, trace: bool = False) -> None:
+        """Create empty stats, starting the wall time of the run."""
+        self.start_ns = time.perf_counter_ns()
+        # Accumulated nanoseconds and number of runs of every phase
+        self.times: Counter[str] = Counter()
+        self.calls: Counter[str] = Counter()
+        # Counters of files, bytes, stat calls and lookups
+        self.counts: Counter[str] = Counter()
+        # The complete events of the Chrome trace, if recorded
+        self.events: list[dict[str, Any]] | None = [] if trace else None
+
+    def drain(self) -> Stats:
+        """Take the stats recorded since the stats were created or last drained."""
+        drained = Stats()
+        drained.times, drained.calls, drained.counts, drained.events = self.times, self.calls, self.counts, self.events
+        self.times, self.calls, self.counts = Counter(), Counter(), Counter()
+        self.events = [] if self.events is not None else None
+        return drained
+
+    def merge(self, other: Stats) -> None:
+        """Add the stats of another run, such as the ones drained in a worker process."""
+        self.times.update(other.times)
+        self.calls.update(other.calls)
+        self.counts.update(other.counts)
+        if self.events is not None and other.events:
+            self.events += other.events
+
+    def to_dict(self) -> dict[str, Any]:
+        """Get the stats as a JSON-serializable dictionary, with times in seconds."""
+        phases = [name for name in PHASES if name in self.calls] + sorted(self.calls.keys() - set(PHASES))
+        return {
+            'wall_time': (time.perf_counter_ns() - self.start_ns) / 1e9,
+            'phases': {name: {'time': self.times[name] / 1e9, 'calls': self.calls[name]} for name in phases},
+            'counts': dict(sorted(self.counts.items())),
+            'hit_rates': {name: self.counts[f'{name}_hits'] / total for name in LOOKUPS
+                          if (total := self.counts[f'{name}_hits'] + self.counts[f'{name}_misses'])},
+        }
+
+    def to_trace(self) -> dict[str, Any]:
+        """Get the recorded events in the Chrome trace event format, as read by ``about:tracing`` or Perfetto."""
+        return {'traceEvents': self.events or [], 'displayTimeUnit': 'ms'}
+
+    def format(self) -> str:
+        """Format the stats as a table."""
+        data = self.to_dict()
+        lines = [f'{"phase":<12} {"time":>10} {"calls":>10}']
+        lines += [f'{name:<12} {phase["time"] * 1000:>8.1f}ms {phase["calls"]:>10,}'
+                  for name, phase in data['phases'].items()]
+        lines.append(f'{"wall time":<12} {data["wall_time"] * 1000:>8.1f}ms')
+        lines += [f'{name:<23} {count:>10,}' for name, count in data['counts'].items()]
+        lines += [f'{f"{name} hit rate":<23} {rate:>10.1%}' for name, rate in data['hit_rates'].items()]
+        return '\n'.join(lines)
+
+
+class _Phase:
+    """Context manager adding the time spent in it to a phase."""
+
+    __slots__ = ('name', 'start_ns', 'stats')
+
+    def __init__(self, stats: Stats, name: str) -> None:
+        """Create a phase recording to the given stats."""
+        self.stats = stats
+        self.name = name
+        self.start_ns = 0
+
+    def __enter__(self) -> None:
+        """Start timing the phase."""
+        self.start_ns = time.perf_counter_ns()
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc_value: BaseException | None,
+                 traceback: TracebackType | None) -> None:
+        """Add the time spent to the phase."""
+        duration_ns = time.perf_counter_ns() - self.start_ns
+        with _lock:
+            self.stats.times[self.name] += duration_ns
+            self.stats.calls[self.name] += 1
+        if self.stats.events is not None:
+            self.stats.events.append({'name': self.name, 'ph': 'X', 'ts': self.start_ns / 1000,
+                                      'dur': duration_ns / 1000, 'pid': os.getpid(), 'tid': threading.get_ident()})
+
+
+class _NullPhase:
+    """Context manager doing nothing, used for all the phases while stats are disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        """Do nothing."""
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc_value: BaseException | None,
+                 traceback: TracebackType | None) -> None:
+        """Do nothing."""
+
+
+# The context manager returned for phases while stats are disabled
+_NULL_PHASE = _NullPhase()
+
+
+def enable(trace: bool = False) -> Stats:
+    """Start recording stats in the current process, returning them.
+
+    :param trace: Whether to record every phase as an event of a Chrome trace.
+    """
+    global _stats
+    _stats = Stats(trace)
+    return _stats
+
+
+def disable() -> None:
+    """Stop recording stats in the current process."""
+    global _stats
+    _stats = None
+
+
+def get_stats() -> Stats | None:
+    """Get the stats recorded in the current process, if enabled."""
+    return _stats
+
+
+def phase(name: str) -> _Phase | _NullPhase:
+    """Time the code run in the context as part of a phase.
+
+    While stats are disabled, this returns a shared context manager doing nothing.
+    """
+    return _Phase(_stats, name) if _stats else _NULL_PHASE
+
+
+def count(name: str, value: int = 1) -> None:
+    """Add to a counter, unless stats are disabled."""
+    if _stats:
+        with _lock:
+            _stats.counts[name] += value
+
+
+def timed_iter(name: str, iterable: Iterable[T]) -> Iterator[T]:
+    """Iterate while timing the time spent getting every item as part of a phase.
+
+    While stats are disabled, this returns an iterator of the iterable as it is.
+    """
+    if not _stats:
+        return iter(iterable)
+    return _timed_iter(_stats, name, iterable)
+
+
+def _timed_iter(stats: Stats, name: str, iterable: Iterable[T]) -> Iterator[T]:
+    it = iter(iterable)
+    while True:
+        with _Phase(stats, name):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
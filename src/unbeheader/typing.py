@@ -1,19 +1,20 @@
 # This file is part of Unbeheader.
 # Copyright (C) CERN & UNCONVENTIONAL
 
-from dataclasses import dataclass
+from enum import Enum
 from pathlib import Path
-from re import Pattern
 from typing import Any
 from typing import NamedTuple
 from typing import TypeAlias
 
+from .scanner import HeaderScanner
+
 ConfigDict: TypeAlias = dict[str, Any]
 PathCache: TypeAlias = dict[Path, bool]
+Span: TypeAlias = tuple[int, int]
 
 
-@dataclass
-class CommentSkeleton:
+class CommentSkeleton(NamedTuple):
     # The string that indicates the start of a comment
     comment_start: str
     # The string that indicates the continuation of a comment
@@ -23,7 +24,48 @@ class CommentSkeleton:
 
 
 class SupportedFileType(NamedTuple):
-    # A regular expression matching header comments
-    regex: Pattern[str]
+    # A scanner finding the comments which may hold the header
+    scanner: HeaderScanner
     # A dictionary defining the skeleton of comments
     comments: CommentSkeleton
+
+
+class HeaderStatus(Enum):
+    # The header is up to date
+    OK = 'ok'
+    # The header was or needs to be updated
+    UPDATED = 'updated'
+    # The header was or needs to be added
+    ADDED = 'added'
+    # The file is not supported or is excluded
+    SKIPPED = 'skipped'
+    # The file could not be processed
+    FAILED = 'failed'
+
+
+class HeaderResult(NamedTuple):
+    # The path of the processed file
+    file_path: Path
+    # Whether the header of the file was or needs to be added or updated
+    changed: bool
+    # Whether a header was found in the file
+    found: bool
+    # The start and end byte offsets of the header found in the original file
+    old_span: Span | None = None
+    # The start and end byte offsets of the header in the updated file
+    new_span: Span | None = None
+    # Whether the file was not processed because it is not supported or is excluded
+    skipped: bool = False
+    # The error which prevented processing the file
+    error: Exception | None = None
+
+    @property
+    def status(self) -> HeaderStatus:
+        """The outcome of processing the file."""
+        if self.error:
+            return HeaderStatus.FAILED
+        if self.skipped:
+            return HeaderStatus.SKIPPED
+        if self.changed:
+            return HeaderStatus.UPDATED if self.found else HeaderStatus.ADDED
+        return HeaderStatus.OK
@@ -3,23 +3,43 @@
 
 from __future__ import annotations
 
+import os
 import re
+from collections.abc import Iterable
+from collections.abc import Iterator
 from pathlib import Path
 from re import Match
+from typing import TYPE_CHECKING
 
-from colorclass import Color
-
+from . import stats
+from .config import CONFIG_FILE_NAME
+from .config import CONFIG_FILE_NAME_YML
+from .exceptions import UnbeheaderError
+from .filetypes import FileTypeRegistry
+from .filetypes import FileTypesLookup
 from .typing import PathCache
 
+if TYPE_CHECKING:
+    from colorclass import Color
+
 # The name of the files that exclude the directory from header updates
 EXCLUDE_FILE_NAME = '.no-header'
 
+# The names of the files whose changes affect the headers of other files in their directory
+GOVERNING_FILE_NAMES = frozenset({CONFIG_FILE_NAME, CONFIG_FILE_NAME_YML, EXCLUDE_FILE_NAME})
+
+# The names of the directories holding version control metadata, which are never walked into
+VCS_DIR_NAMES = frozenset({'.bzr', '.git', '.hg', '.svn'})
+
 
 def cformat(string: str) -> Color:
     """Replace %{color} and %{color,bgcolor} with ANSI colors.
 
     Bold foreground can be achieved by suffixing the color with a '!'.
     """
+    # Only imported when needed, as it takes a while to import
+    from colorclass import Color
+
     def repl(m: Match[str]) -> Color:
         bg = bold = ''
         if m.group('fg_bold'):
@@ -37,23 +57,105 @@ def cformat(string: str) -> Color:
     return Color(string)
 
 
-def is_excluded(path: Path, root_path: Path | None = None, cache: PathCache | None = None) -> bool:
-    """"Whether the path is excluded by a .no-headers file.
+class ExclusionIndex:
+    """Index of the directories excluded by a .no-header file.
+
+    An index is meant to be shared by all the files processed in a single run. Every
+    directory is only checked for a .no-header file once, after which looking up whether
+    a directory is excluded is a dictionary lookup.
+
+    :param root_path: The root path to check up to. Directories outside of it are never excluded.
+    """
+
+    def __init__(self, root_path: Path) -> None:
+        """Create an empty index for the directories under the root path."""
+        self.root_path = root_path
+        self._excluded: PathCache = {}
+
+    def is_excluded(self, dir_path: Path) -> bool:
+        """Whether the directory is excluded by a .no-header file in it or in any parent up to the root."""
+        if (excluded := self._excluded.get(dir_path)) is not None:
+            stats.count('exclusion_hits')
+            return excluded
+        stats.count('exclusion_misses')
+        if dir_path == self.root_path:
+            excluded = self._has_exclude_file(dir_path)
+        elif not dir_path.is_relative_to(self.root_path):
+            excluded = False
+        else:
+            excluded = self.is_excluded(dir_path.parent) or self._has_exclude_file(dir_path)
+        self._excluded[dir_path] = excluded
+        return excluded
+
+    def invalidate(self, dir_path: Path) -> None:
+        """Forget whether a directory and everything under it are excluded."""
+        self._excluded = {path: excluded for path, excluded in self._excluded.items()
+                          if not path.is_relative_to(dir_path)}
+
+    def _has_exclude_file(self, dir_path: Path) -> bool:
+        stats.count('stat_calls')
+        return (dir_path / EXCLUDE_FILE_NAME).exists()
+
+
+def get_dir_file_types(get_file_types: FileTypesLookup, dir_path: Path) -> FileTypeRegistry | None:
+    """Get the file types of the files in a directory, or ``None`` if its configuration is invalid.
+
+    All the files of a directory whose configuration is invalid are meant to be processed,
+    so that the error is reported for every one of them instead of them being skipped.
+    """
+    try:
+        return get_file_types(dir_path)
+    except (UnbeheaderError, OSError):
+        return None
+
+
+def is_supported(name: str, file_types: FileTypeRegistry | None) -> bool:
+    """Whether a file name has one of the file types, or may have one if they are unknown.
+
+    Hidden files are never supported.
+    """
+    return not name.startswith('.') and (file_types is None or file_types.match(name) is not None)
+
+
+def walk_files(root_path: Path, get_file_types: FileTypesLookup) -> Iterator[Path]:
+    """Yield the files under a directory that have one of the file types of their directory.
+
+    Directories containing a .no-header file are pruned along with everything under them,
+    as are version control metadata directories. Entries are filtered by their name before
+    any path is created for them, and hidden files are skipped.
+
+    :param root_path: The directory to walk.
+    :param get_file_types: The lookup of the file types of every directory walked.
+    """
+    dir_paths = [str(root_path)]
+    while dir_paths:
+        dir_path = dir_paths.pop()
+        try:
+            with os.scandir(dir_path) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        stats.count('dirs_walked')
+        if any(entry.name == EXCLUDE_FILE_NAME for entry in entries):
+            continue
+        file_types = get_dir_file_types(get_file_types, Path(dir_path))
+        for entry in entries:
+            name = entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if name not in VCS_DIR_NAMES:
+                    dir_paths.append(entry.path)
+                continue
+            if is_supported(name, file_types) and entry.is_file():
+                yield Path(entry.path)
+
 
-    The .no-headers file is searched for in the path and all parents up to the root.
+def expand_paths(paths: Iterable[Path], get_file_types: FileTypesLookup) -> Iterator[Path]:
+    """Yield the given files, and the files under the given directories that have one of the file types.
 
-    :param path: The path to check.
-    :param root_path: The root path to check up to.
-    :param cache: A cache of paths that have been checked.
+    Directories are walked with :func:`walk_files`, and files are yielded as they are.
     """
-    root_path = root_path if root_path else path
-    cache = cache if cache else {}
-    orig_path = path
-    if path not in cache:
-        cache[orig_path] = False
-        while str(path).startswith(str(root_path)):
-            if (path / EXCLUDE_FILE_NAME).exists():
-                cache[orig_path] = True
-                break
-            path = path.parent
-    return cache[orig_path]
+    for path in paths:
+        if path.is_dir():
+            yield from walk_files(path, get_file_types)
+        else:
+            yield path
@@ -0,0 +1,266 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+import ctypes
+import errno
+import os
+import select
+import struct
+import sys
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Protocol
+
+from .api import HeaderSession
+from .filetypes import DEFAULT_FILE_TYPES
+from .filetypes import FileTypesLookup
+from .typing import HeaderResult
+from .util import GOVERNING_FILE_NAMES
+from .util import VCS_DIR_NAMES
+from .util import get_dir_file_types
+from .util import is_supported
+from .util import walk_files
+
+# The time in seconds without new events after which a burst of events is processed
+DEBOUNCE_DELAY = 0.2
+
+# The time in seconds between two scans of the file tree when file system events are not available
+POLL_INTERVAL = 1.0
+
+# The inotify flags used to watch directories, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+# The header of the events read from inotify: watch descriptor, mask, cookie and name length
+INOTIFY_EVENT = struct.Struct('iIII')
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+class Watcher(Protocol):
+    """Source of the paths changed under a directory."""
+
+    def read(self, timeout: float | None) -> set[Path]:
+        """Wait up to a timeout, or forever if it is ``None``, for paths to change.
+
+        Returns the changed paths, or an empty set if none changed before the timeout.
+        A changed directory means that anything under it may have changed.
+        """
+
+    def close(self) -> None:
+        """Stop watching for changes."""
+
+
+class InotifyWatcher:
+    """Watch a directory tree through the inotify API of Linux.
+
+    Every directory in the tree is watched on its own, including the directories created
+    while watching. Version control directories are never watched.
+
+    :param root_path: The directory to watch.
+    """
+
+    def __init__(self, root_path: Path) -> None:
+        """Start watching the directory tree."""
+        self.root_path = root_path
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise _os_error()
+        self._dir_paths: dict[int, Path] = {}
+        try:
+            self._add_watches(root_path)
+        except BaseException:
+            self.close()
+            raise
+
+    def read(self, timeout: float | None) -> set[Path]:
+        """Wait up to a timeout for paths to change. See :meth:`Watcher.read`."""
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return set()
+        changed_paths = set()
+        data = os.read(self._fd, INOTIFY_READ_SIZE)
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, pos)
+            pos += INOTIFY_EVENT.size
+            name = os.fsdecode(data[pos:pos + name_length].rstrip(b'\0'))
+            pos += name_length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so anything may have changed
+                changed_paths.add(self.root_path)
+            elif mask & IN_IGNORED:
+                self._dir_paths.pop(wd, None)
+            elif (dir_path := self._dir_paths.get(wd)) is not None:
+                path = dir_path / name
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and name not in VCS_DIR_NAMES:
+                    self._add_watches(path)
+                changed_paths.add(path)
+        return changed_paths
+
+    def close(self) -> None:
+        """Stop watching for changes."""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _add_watches(self, root_path: Path) -> None:
+        for dir_path, dir_names, _ in os.walk(root_path):
+            dir_names[:] = [name for name in dir_names if name not in VCS_DIR_NAMES]
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir_path), IN_WATCH_MASK)
+            if wd >= 0:
+                self._dir_paths[wd] = Path(dir_path)
+            elif ctypes.get_errno() not in (errno.ENOENT, errno.ENOTDIR):
+                # Directories removed in the meantime are fine, running out of watches is not
+                raise _os_error()
+
+
+class PollingWatcher:
+    """Watch a directory tree by scanning it periodically.
+
+    Only supported files and the files governing their headers are checked for changes.
+
+    :param root_path: The directory to watch.
+    :param get_file_types: The lookup of the file types of every directory, which are the
+                           built-in ones by default.
+    """
+
+    def __init__(self, root_path: Path, get_file_types: FileTypesLookup | None = None) -> None:
+        """Start watching the directory tree."""
+        self.root_path = root_path
+        self.get_file_types = get_file_types or (lambda dir_path: DEFAULT_FILE_TYPES)
+        self._snapshot = self._scan()
+        self._next_scan = time.monotonic() + POLL_INTERVAL
+
+    def read(self, timeout: float | None) -> set[Path]:
+        """Wait up to a timeout for paths to change. See :meth:`Watcher.read`."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            now = time.monotonic()
+            if deadline is not None and deadline < self._next_scan:
+                time.sleep(max(deadline - now, 0))
+                return set()
+            time.sleep(max(self._next_scan - now, 0))
+            self._next_scan = time.monotonic() + POLL_INTERVAL
+            snapshot = self._scan()
+            changed_paths = {path for path in snapshot.keys() | self._snapshot.keys()
+                             if snapshot.get(path) != self._snapshot.get(path)}
+            self._snapshot = snapshot
+            if changed_paths:
+                return changed_paths
+
+    def close(self) -> None:
+        """Stop watching for changes."""
+
+    def _scan(self) -> dict[Path, tuple[int, int, int]]:
+        snapshot = {}
+        for dir_path, dir_names, file_names in os.walk(self.root_path):
+            dir_names[:] = [name for name in dir_names if name not in VCS_DIR_NAMES]
+            file_types = get_dir_file_types(self.get_file_types, Path(dir_path))
+            for name in file_names:
+                if name in GOVERNING_FILE_NAMES or is_supported(name, file_types):
+                    path = Path(dir_path, name)
+                    try:
+                        snapshot[path] = _get_signature(path)
+                    except OSError:
+                        continue
+        return snapshot
+
+
+def create_watcher(root_path: Path, get_file_types: FileTypesLookup | None = None) -> Watcher:
+    """Watch a directory tree through file system events if possible, or by polling it otherwise.
+
+    :param root_path: The directory to watch.
+    :param get_file_types: The lookup of the file types of every directory, whose files are
+                           the only ones polled.
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root_path)
+        except (OSError, AttributeError):
+            # inotify is not available or the limit of watches was reached
+            pass
+    return PollingWatcher(root_path, get_file_types)
+
+
+def watch_files(session: HeaderSession, root_path: Path, year: int, check: bool, watcher: Watcher | None = None,
+                jobs: int = 1, engine: str = 'process') -> Iterator[list[HeaderResult]]:
+    """Process the headers of the files under a directory whenever they change.
+
+    Bursts of changes are only processed once they settle down, and the results of every
+    burst are yielded as a list. Only the supported files which changed are processed,
+    unless a configuration or .no-header file changed, in which case its cached state is
+    dropped from the session and all the files in its directory are processed again.
+    The changes made by processing files are ignored, as they would be processed again
+    otherwise.
+
+    :param session: The session to process files in, keeping its caches across bursts.
+    :param root_path: The directory to watch.
+    :param year: The year to update the headers to.
+    :param check: Whether to only check the headers without updating the files.
+    :param watcher: The watcher to get changes from, which defaults to the best one available.
+    :param jobs: The number of jobs to process every burst with.
+    :param engine: The engine to process every burst with.
+    """
+    watcher = watcher or create_watcher(root_path)
+    # The signatures of the files as written by processing them
+    written: dict[Path, tuple[int, int, int]] = {}
+    try:
+        while True:
+            changed_paths = watcher.read(None)
+            while changed_paths and (more_paths := watcher.read(DEBOUNCE_DELAY)):
+                changed_paths |= more_paths
+            file_paths: set[Path] = set()
+            for path in sorted(changed_paths):
+                if path.name in GOVERNING_FILE_NAMES:
+                    session.invalidate(path.parent)
+                    file_paths.update(walk_files(path.parent, session.get_file_types))
+                elif path.is_dir():
+                    if path.name not in VCS_DIR_NAMES:
+                        file_paths.update(walk_files(path, session.get_file_types))
+                elif (is_supported(path.name, get_dir_file_types(session.get_file_types, path.parent))
+                      and not _is_written(path, written)):
+                    file_paths.add(path)
+            if not file_paths:
+                continue
+            results = list(session.process_files(sorted(file_paths), year, check, jobs, engine))
+            for result in results:
+                if result.changed and not check:
+                    try:
+                        written[result.file_path] = _get_signature(result.file_path)
+                    except OSError:
+                        continue
+            yield results
+    finally:
+        watcher.close()
+
+
+def _is_written(path: Path, written: dict[Path, tuple[int, int, int]]) -> bool:
+    """Whether a file is still as it was written by processing it."""
+    if (signature := written.get(path)) is None:
+        return False
+    try:
+        if _get_signature(path) == signature:
+            return True
+    except OSError:
+        pass
+    del written[path]
+    return False
+
+
+def _get_signature(path: Path) -> tuple[int, int, int]:
+    st = path.stat()
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _os_error() -> OSError:
+    code = ctypes.get_errno()
+    return OSError(code, os.strerror(code))
@@ -0,0 +1,127 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+from textwrap import dedent
+
+import pytest
+import yaml
+
+from unbeheader.api import HeaderSession
+from unbeheader.api import check_headers
+from unbeheader.api import fix_headers
+from unbeheader.config import CONFIG_FILE_NAME
+from unbeheader.exceptions import ConfigError
+from unbeheader.exceptions import ConfigNotFoundError
+from unbeheader.typing import HeaderStatus
+from unbeheader.util import EXCLUDE_FILE_NAME
+
+HEADER = '# This file is part of Thelema.\n# Copyright (C) 1904 Ordo Templi Orientis\n'
+BODY = "print('Beware of the knowledge you will gain.')\n"
+
+
+@pytest.fixture
+def tree(tmp_path):
+    config = {
+        'owner': 'Ordo Templi Orientis',
+        'start_year': 1904,
+        'template': dedent('''
+            {comment_start} This file is part of Thelema.
+            {comment_middle} Copyright (C) {dates} {owner}
+            {comment_end}
+        ''').lstrip()
+    }
+    (tmp_path / CONFIG_FILE_NAME).write_text(yaml.dump(config))
+    (tmp_path / 'ok.py').write_text(f'{HEADER}\n{BODY}')
+    (tmp_path / 'added.py').write_text(BODY)
+    (tmp_path / 'updated.py').write_text(f'{HEADER.replace("1904", "1486")}\n{BODY}')
+    (tmp_path / 'notes.txt').write_text(BODY)
+    (tmp_path / 'excluded').mkdir()
+    (tmp_path / 'excluded' / EXCLUDE_FILE_NAME).touch()
+    (tmp_path / 'excluded' / 'manuscript.py').write_text(BODY)
+    return tmp_path
+
+
+def _statuses(results, root_path):
+    return {result.file_path.relative_to(root_path).as_posix(): result.status for result in results}
+
+
+def test_check_headers(tree):
+    file_paths = [tree / 'ok.py', tree / 'added.py', tree / 'updated.py', tree / 'notes.txt',
+                  tree / 'excluded' / 'manuscript.py']
+    results = check_headers(file_paths, 1904, root_path=tree)
+    assert _statuses(results, tree) == {
+        'ok.py': HeaderStatus.OK,
+        'added.py': HeaderStatus.ADDED,
+        'updated.py': HeaderStatus.UPDATED,
+        'notes.txt': HeaderStatus.SKIPPED,
+        'excluded/manuscript.py': HeaderStatus.SKIPPED,
+    }
+    assert (tree / 'added.py').read_text() == BODY
+
+
+def test_fix_headers(tree):
+    results = fix_headers([str(tree)], 1904, root_path=tree)
+    assert _statuses(results, tree) == {
+        'ok.py': HeaderStatus.OK,
+        'added.py': HeaderStatus.ADDED,
+        'updated.py': HeaderStatus.UPDATED,
+    }
+    assert (tree / 'added.py').read_text() == f'{HEADER}\n{BODY}'
+    assert (tree / 'updated.py').read_text() == f'{HEADER}\n{BODY}'
+    assert (tree / 'excluded' / 'manuscript.py').read_text() == BODY
+    assert all(result.status == HeaderStatus.OK for result in check_headers([tree], 1904, root_path=tree))
+
+
+@pytest.mark.parametrize('engine', ('process', 'async'))
+def test_check_headers_for_errors(engine, tree):
+    (tree / 'nested').mkdir()
+    (tree / 'nested' / CONFIG_FILE_NAME).write_text("template: '{curse}'\nowner: Crowley\n")
+    (tree / 'nested' / 'manuscript.py').write_text(BODY)
+    results = check_headers([tree / 'ok.py', tree / 'nested' / 'manuscript.py'], 1904, engine=engine)
+    assert [result.status for result in results] == [HeaderStatus.OK, HeaderStatus.FAILED]
+    assert isinstance(results[1].error, ConfigError)
+    assert results[1].error.path == tree / 'nested' / CONFIG_FILE_NAME
+
+
+def test_check_headers_for_relative_paths(tree, monkeypatch):
+    nested_dir_path = tree / 'nested'
+    nested_dir_path.mkdir()
+    (nested_dir_path / 'manuscript.py').write_text(BODY)
+    monkeypatch.chdir(nested_dir_path)
+    # The configuration is found in the parent of the current directory
+    [result] = check_headers(['manuscript.py'], 1904)
+    assert result.status == HeaderStatus.ADDED
+    assert result.file_path == nested_dir_path / 'manuscript.py'
+    assert _statuses(check_headers(['.'], 1904), nested_dir_path) == {'manuscript.py': HeaderStatus.ADDED}
+
+
+def test_check_headers_for_missing_config(tmp_path):
+    file_path = tmp_path / 'manuscript.py'
+    file_path.write_text(BODY)
+    [result] = check_headers([file_path], 1904, jobs=4)
+    assert result.status == HeaderStatus.FAILED
+    assert isinstance(result.error, ConfigNotFoundError)
+    assert result.error.path == tmp_path
+
+
+@pytest.mark.parametrize('content', ('owner: [Ordo Templi Orientis\n', ''))
+def test_check_headers_for_invalid_config(content, tmp_path):
+    (tmp_path / CONFIG_FILE_NAME).write_text(content)
+    file_path = tmp_path / 'manuscript.py'
+    file_path.write_text(BODY)
+    [result] = check_headers([tmp_path], 1904)
+    assert result.file_path == file_path
+    assert result.status == HeaderStatus.FAILED
+    assert isinstance(result.error, ConfigError)
+    assert result.error.path == tmp_path / CONFIG_FILE_NAME
+
+
+def test_session_caches(tree):
+    session = HeaderSession(tree)
+    session.check([tree], 1904)
+    assert session.resolver.misses == 1
+    session.check([tree / 'ok.py'], 1904)
+    assert (session.resolver.hits, session.resolver.misses) == (3, 1)
+    (tree / 'ok.py').write_text(BODY)
+    [result] = session.check([tree / 'ok.py'], 1904)
+    assert result.status == HeaderStatus.ADDED
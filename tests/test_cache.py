@@ -0,0 +1,102 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+import json
+import os
+from unittest import mock
+
+import pytest
+
+from unbeheader.cache import CACHE_FILE_NAME
+from unbeheader.cache import ResultCache
+
+DIGEST = 'b1946ac92492d2347c6235b4d2611184'
+
+
+@pytest.fixture(autouse=True)
+def no_racy_interval(monkeypatch):
+    monkeypatch.setattr('unbeheader.cache.RACY_INTERVAL_NS', 0)
+
+
+@pytest.fixture
+def file_path(tmp_path):
+    file_path = tmp_path / 'manuscript.py'
+    file_path.write_text('# This file is part of Thelema.\n')
+    return file_path
+
+
+def test_result_cache(file_path):
+    cache = ResultCache()
+    assert cache.lookup(file_path, DIGEST) is None
+    cache.store(file_path, DIGEST, True)
+    assert cache.lookup(file_path, DIGEST) is True
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_result_cache_for_changed_file(file_path):
+    cache = ResultCache()
+    cache.store(file_path, DIGEST, True)
+    file_path.write_text('# This file is part of Thelema, Liber AL.\n')
+    assert cache.lookup(file_path, DIGEST) is None
+
+
+def test_result_cache_for_touched_file(file_path):
+    cache = ResultCache()
+    cache.store(file_path, DIGEST, True)
+    stat = file_path.stat()
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert cache.lookup(file_path, DIGEST) is None
+
+
+def test_result_cache_for_changed_digest(file_path):
+    cache = ResultCache()
+    cache.store(file_path, DIGEST, True)
+    assert cache.lookup(file_path, DIGEST[::-1]) is None
+
+
+def test_result_cache_for_racy_file(file_path, monkeypatch):
+    monkeypatch.setattr('unbeheader.cache.RACY_INTERVAL_NS', 60_000_000_000)
+    cache = ResultCache()
+    cache.store(file_path, DIGEST, True)
+    assert cache.lookup(file_path, DIGEST) is None
+
+
+def test_result_cache_for_save_and_load(file_path, tmp_path):
+    cache_path = tmp_path / CACHE_FILE_NAME
+    cache = ResultCache()
+    cache.store(file_path, DIGEST, False)
+    cache.save(cache_path)
+    assert ResultCache.load(cache_path).lookup(file_path, DIGEST) is False
+    assert set(tmp_path.iterdir()) == {file_path, cache_path}
+
+
+@pytest.mark.parametrize('content', ('', '[]', '{"version": "0.0.0/0", "entries": {}}'))
+def test_result_cache_for_invalid_file(content, file_path, tmp_path):
+    cache_path = tmp_path / CACHE_FILE_NAME
+    cache = ResultCache()
+    cache.store(file_path, DIGEST, True)
+    cache.save(cache_path)
+    data = json.loads(cache_path.read_text())
+    cache_path.write_text(content.replace('{}', json.dumps(data['entries'])))
+    assert ResultCache.load(cache_path).lookup(file_path, DIGEST) is None
+
+
+def test_result_cache_for_other_version(file_path, tmp_path):
+    cache_path = tmp_path / CACHE_FILE_NAME
+    cache = ResultCache()
+    cache.store(file_path, DIGEST, True)
+    cache.save(cache_path)
+    with mock.patch('unbeheader.cache.CACHE_FORMAT', 0):
+        assert ResultCache.load(cache_path).lookup(file_path, DIGEST) is None
+
+
+def test_result_cache_for_drain_and_merge(file_path):
+    cache = ResultCache()
+    worker_cache = ResultCache()
+    worker_cache.lookup(file_path, DIGEST)
+    worker_cache.store(file_path, DIGEST, True)
+    cache.merge(worker_cache.drain())
+    assert (worker_cache.hits, worker_cache.misses) == (0, 0)
+    assert worker_cache.drain().lookup(file_path, DIGEST) is None
+    assert cache.lookup(file_path, DIGEST) is True
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -1,7 +1,10 @@
 # This file is part of Unbeheader.
 # Copyright (C) CERN & UNCONVENTIONAL
 
+import io
+import json
 import os
+import subprocess
 from datetime import date
 from unittest import mock
 
@@ -9,10 +12,47 @@ import pytest
 from click import UsageError
 from click.testing import CliRunner
 
+from unbeheader import stats
+from unbeheader.cli import _iter_changed_files
+from unbeheader.cli import _iter_git_files
+from unbeheader.cli import _process_files
+from unbeheader.cli import _read_file_list
 from unbeheader.cli import _run_on_directory
 from unbeheader.cli import _run_on_file
 from unbeheader.cli import _run_on_repo
 from unbeheader.cli import main
+from unbeheader.config import CONFIG_FILE_NAME
+from unbeheader.engine import ASYNC_JOBS
+from unbeheader.headers import _do_update_header
+from unbeheader.typing import HeaderResult
+from unbeheader.typing import HeaderStatus
+from unbeheader.util import EXCLUDE_FILE_NAME
+
+
+@pytest.fixture
+def git_repo(tmp_path, monkeypatch):
+    subprocess.run(['git', 'init', '-q', tmp_path], check=True)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def _git_add(*file_paths):
+    for file_path in file_paths:
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.touch()
+    subprocess.run(['git', 'add', *file_paths], check=True)
+
+
+def _git_commit():
+    subprocess.run(['git', '-c', 'user.name=Aleister', '-c', 'user.email=aleister@thelema.org',
+                    'commit', '-q', '--allow-empty', '-m', 'Liber AL'], check=True)
+
+
+def _make_result(updated):
+    def process_header(file_path, *args):
+        return HeaderResult(file_path, changed=updated, found=True)
+
+    return process_header
 
 
 @mock.patch('unbeheader.cli._run_on_directory')
@@ -38,6 +78,21 @@ def test_main_for_repo(_run_on_repo):
     _run_on_repo.assert_called_once()
 
 
+@mock.patch('unbeheader.cli._run_on_directory', return_value=False)
+@mock.patch('unbeheader.cli.os.cpu_count', return_value=8)
+@pytest.mark.parametrize(('args', 'jobs', 'engine'), (
+    ([], 8, 'process'),
+    (['--jobs', '2'], 2, 'process'),
+    (['--engine', 'async'], ASYNC_JOBS, 'async'),
+    (['--engine', 'async', '--jobs', '2'], 2, 'async'),
+))
+def test_main_for_engine(cpu_count, _run_on_directory, args, jobs, engine, tmp_path):
+    runner = CliRunner()
+    result = runner.invoke(main, ['--path', tmp_path, '--year', '1904', *args])
+    assert result.exit_code == 0
+    _run_on_directory.assert_called_once_with(tmp_path, 1904, False, jobs, None, engine, mock.ANY, False)
+
+
 @mock.patch('unbeheader.cli._run_on_file')
 def test_main_for_ci_error(_run_on_file, tmp_path):
     _run_on_file.return_value = True
@@ -48,21 +103,177 @@ def test_main_for_ci_error(_run_on_file, tmp_path):
     assert result.exit_code == 1
 
 
-@mock.patch('unbeheader.cli.update_header')
+@pytest.mark.parametrize('args', (
+    ['--staged'],
+    ['--since', 'HEAD'],
+    ['--path', 'manuscript.py'],
+))
+def test_main_for_watch_usage_error(args, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'manuscript.py').touch()
+    runner = CliRunner()
+    result = runner.invoke(main, ['--watch', *args])
+    assert result.exit_code == 2
+
+
+@mock.patch('unbeheader.watch.watch_files', side_effect=KeyboardInterrupt)
+def test_main_for_watch(watch_files, tmp_path):
+    config = "owner: Crowley\ntemplate: '{comment_start} This file is part of Thelema.'\n"
+    (tmp_path / CONFIG_FILE_NAME).write_text(config)
+    (tmp_path / 'manuscript.py').write_text('x = 1\n')
+    (tmp_path / 'nested').mkdir()
+    (tmp_path / 'nested' / CONFIG_FILE_NAME).write_text("template: '{curse}'\n")
+    (tmp_path / 'nested' / 'manuscript.py').write_text('x = 1\n')
+    runner = CliRunner()
+    result = runner.invoke(main, ['--watch', '--path', tmp_path])
+    assert result.exit_code == 0
+    # Errors do not stop watching
+    assert 'Invalid placeholder {curse}' in result.output
+    assert (tmp_path / 'manuscript.py').read_text() == '# This file is part of Thelema.\n\nx = 1\n'
+    watch_files.assert_called_once()
+
+
+def test_main_for_watch_outside_cwd(tmp_path, monkeypatch):
+    watched_path = tmp_path / 'watched'
+    excluded_path = watched_path / 'vendor'
+    excluded_path.mkdir(parents=True)
+    (excluded_path / EXCLUDE_FILE_NAME).touch()
+    (watched_path / CONFIG_FILE_NAME).write_text("owner: Crowley\ntemplate: '{comment_start} This file is part of'\n")
+    (tmp_path / 'elsewhere').mkdir()
+    monkeypatch.chdir(tmp_path / 'elsewhere')
+    statuses = []
+
+    def watch_files(session, path, *args):
+        # Files saved while watching are checked for exclusions up to the watched directory
+        (excluded_path / 'manuscript.py').write_text('x = 1\n')
+        statuses.extend(result.status for result in session.process_files([excluded_path / 'manuscript.py']))
+        raise KeyboardInterrupt
+
+    with mock.patch('unbeheader.watch.watch_files', side_effect=watch_files):
+        result = CliRunner().invoke(main, ['--watch', '--path', watched_path])
+    assert result.exit_code == 0
+    assert statuses == [HeaderStatus.SKIPPED]
+    assert (excluded_path / 'manuscript.py').read_text() == 'x = 1\n'
+
+
+@pytest.mark.parametrize(('args', 'expected'), (
+    (['nested'], ['nested/elsewhere.py']),
+    (['--files-from', '-', '--null'], ['nested/elsewhere.py', 'somewhere.py']),
+    # Test that files found several times are only processed once
+    (['nested', 'somewhere.py', '--files-from', '-', '-0'], ['nested/elsewhere.py', 'somewhere.py']),
+))
+def test_main_for_files(args, expected, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = "owner: Crowley\ntemplate: '{comment_start} This file is part of Thelema.'\n"
+    (tmp_path / CONFIG_FILE_NAME).write_text(config)
+    (tmp_path / 'nested').mkdir()
+    (tmp_path / 'somewhere.py').write_text('x = 1\n')
+    (tmp_path / 'nested' / 'elsewhere.py').write_text('x = 1\n')
+    runner = CliRunner()
+    with mock.patch('unbeheader.headers._do_update_header', wraps=_do_update_header) as do_update_header:
+        result = runner.invoke(main, args, input=b'somewhere.py\0nested/elsewhere.py\0nowhere.py\0')
+    assert result.exit_code == 0
+    assert sorted(call.args[0] for call in do_update_header.call_args_list) == [tmp_path / path for path in expected]
+    assert all((tmp_path / path).read_text() == '# This file is part of Thelema.\n\nx = 1\n' for path in expected)
+
+
+@pytest.mark.parametrize('args', (
+    ['--path', '.'],
+    ['--staged'],
+    ['--watch'],
+))
+def test_main_for_files_usage_error(args, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'manuscript.py').touch()
+    runner = CliRunner()
+    result = runner.invoke(main, ['manuscript.py', *args])
+    assert result.exit_code == 2
+    result = runner.invoke(main, ['--files-from', '-', *args], input=b'')
+    assert result.exit_code == 2
+
+
+def test_main_for_null_usage_error(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'manuscript.py').touch()
+    result = CliRunner().invoke(main, ['--null', 'manuscript.py'])
+    assert result.exit_code == 2
+    assert 'The --null option can only be used with --files-from.' in result.output
+
+
+def test_main_for_missing_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'manuscript.py').touch()
+    result = CliRunner().invoke(main, ['--check', 'manuscript.py', 'manuscirpt.py'])
+    assert result.exit_code == 2
+    assert "'manuscirpt.py' does not exist" in result.output
+
+
+@pytest.mark.parametrize(('data', 'sep', 'expected'), (
+    (b'', b'\n', []),
+    (b'a.py', b'\n', ['a.py']),
+    (b'a.py\nb c.py\n', b'\n', ['a.py', 'b c.py']),
+    (b'a.py\r\n\r\nb.py\r\n', b'\n', ['a.py', 'b.py']),
+    (b'a.py\0new\nline.py\0', b'\0', ['a.py', 'new\nline.py']),
+    (b'new\nline.py\0a.py\r\0', b'\0', ['new\nline.py', 'a.py\r']),
+    (b'a.py\0\0b.py', b'\0', ['a.py', 'b.py']),
+    ('ñandú.py\n'.encode(), b'\n', ['ñandú.py']),
+))
+@pytest.mark.parametrize('read_size', (1, 3, 1024))
+def test_read_file_list(data, sep, expected, read_size, monkeypatch):
+    monkeypatch.setattr('unbeheader.cli.FILES_FROM_READ_SIZE', read_size)
+    assert [str(path) for path in _read_file_list(io.BytesIO(data), sep)] == expected
+
+
+def test_main_for_config_error_after_update(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('CI', '1')
+    _write_format_files(tmp_path)
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'a' / 'manuscript.py').write_text('x = 1\n')
+    (tmp_path / 'b').mkdir()
+    (tmp_path / 'b' / CONFIG_FILE_NAME).write_text("template: '{comment_start} {bogus}'\n")
+    (tmp_path / 'b' / 'manuscript.py').write_text('x = 1\n')
+    result = CliRunner().invoke(main, ['--jobs', '1', '--files-from', '-'], input=b'a/manuscript.py\nb/manuscript.py\n')
+    assert result.exit_code == 1
+    assert (tmp_path / 'a' / 'manuscript.py').read_text() == '# This file is part of Thelema.\n\nx = 1\n'
+    # The file updated before the error is still reported
+    assert 'Adding header in a/manuscript.py' in result.output
+    assert 'Invalid placeholder {bogus}' in result.output
+
+
+def test_main_for_config_error(tmp_path):
+    file_path = tmp_path / 'manuscript.py'
+    file_path.touch()
+    runner = CliRunner()
+    result = runner.invoke(main, ['--path', file_path])
+    assert result.exit_code == 1
+    assert f'No valid {CONFIG_FILE_NAME} file found in {tmp_path}' in result.output
+
+
+@mock.patch('unbeheader.engine.process_header')
 @pytest.mark.parametrize('updated', (True, False))
-def test_run_on_file(update_header, updated, tmp_path):
-    update_header.return_value = updated
+def test_run_on_file(process_header, updated, tmp_path):
+    process_header.side_effect = _make_result(updated)
     file_path = tmp_path / 'manuscript.py'
     error = _run_on_file(file_path, date.today().year, False)
     assert error == updated
 
 
-@mock.patch('unbeheader.cli.is_excluded')
-@mock.patch('unbeheader.cli.update_header')
+@mock.patch('unbeheader.engine.process_header')
+def test_run_on_file_for_excluded(process_header, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sub_path = tmp_path / 'secrets'
+    sub_path.mkdir()
+    (sub_path / EXCLUDE_FILE_NAME).touch()
+    error = _run_on_file(sub_path / 'manuscript.py', date.today().year, False)
+    assert error is False
+    process_header.assert_not_called()
+
+
+@mock.patch('unbeheader.engine.process_header')
 @pytest.mark.parametrize('updated', (True, False))
-def test_run_on_directory(update_header, is_excluded, updated, tmp_path):
-    update_header.return_value = updated
-    is_excluded.return_value = False
+def test_run_on_directory(process_header, updated, tmp_path):
+    process_header.side_effect = _make_result(updated)
     sub_path = tmp_path / 'secrets'
     sub_path.mkdir()
     file_paths = (
@@ -73,58 +284,314 @@ def test_run_on_directory(update_header, is_excluded, updated, tmp_path):
     for path in file_paths:
         path.touch()
     error = _run_on_directory(tmp_path, date.today().year, False)
-    assert is_excluded.call_count == 3
-    assert update_header.call_count == 3
+    assert process_header.call_count == 3
     assert error == updated
 
 
-@mock.patch('subprocess.check_output')
-@mock.patch('unbeheader.cli.is_excluded')
-@mock.patch('unbeheader.cli.update_header')
+@mock.patch('unbeheader.engine.process_header')
+def test_run_on_directory_for_excluded(process_header, tmp_path):
+    sub_path = tmp_path / 'secrets'
+    sub_path.mkdir()
+    (sub_path / EXCLUDE_FILE_NAME).touch()
+    (sub_path / 'manuscript.py').touch()
+    error = _run_on_directory(tmp_path, date.today().year, False)
+    assert error is False
+    process_header.assert_not_called()
+
+
+@mock.patch('unbeheader.util.ExclusionIndex.is_excluded')
+@mock.patch('unbeheader.engine.process_header')
 @pytest.mark.parametrize('updated', (True, False))
-def test_run_on_repo(update_header, is_excluded, check_output, updated):
-    check_output.side_effect = [
-        '/path/to/somewhere.py\n/path/to/elsewhere.py\n',  # git ls-files
-        '',                                                # git ls-files --others --exclude-standard
-        ''                                                 # git ls-files --deleted
-    ]
-    update_header.return_value = updated
+def test_run_on_repo(process_header, is_excluded, updated, git_repo):
+    file_paths = [git_repo / 'somewhere.py', git_repo / 'elsewhere.py']
+    _git_add(*file_paths)
+    process_header.side_effect = _make_result(updated)
     is_excluded.return_value = False
     error = _run_on_repo(date.today().year, False)
     assert error == updated
     assert is_excluded.call_count == 2
-    assert update_header.call_count == 2
+    assert process_header.call_count == 2
 
 
-@mock.patch('subprocess.check_output')
-@mock.patch('unbeheader.cli.is_excluded')
-@mock.patch('unbeheader.cli.update_header')
-def test_run_on_repo_for_deleted_files(update_header, is_excluded, check_output):
-    check_output.side_effect = [
-        '/path/to/deleted.py',  # git ls-files
-        '',                     # git ls-files --others --exclude-standard
-        '/path/to/deleted.py'   # git ls-files --deleted
-    ]
-    is_excluded.return_value = False
+def test_run_on_repo_for_deleted_files(git_repo):
+    file_path = git_repo / 'deleted.py'
+    _git_add(file_path)
+    file_path.unlink()
+    with mock.patch('unbeheader.headers._do_update_header') as _do_update_header:
+        _run_on_repo(date.today().year, False)
+    _do_update_header.assert_not_called()
+
+
+@mock.patch('unbeheader.engine.process_header')
+def test_run_on_repo_for_untracked_files(process_header, git_repo):
+    process_header.side_effect = _make_result(False)
+    (git_repo / '.gitignore').write_text('ignored.py\n')
+    (git_repo / 'new.py').touch()
+    (git_repo / 'ignored.py').touch()
     _run_on_repo(date.today().year, False)
-    update_header.assert_not_called()
+    assert [call.args[0] for call in process_header.call_args_list] == [git_repo / '.gitignore', git_repo / 'new.py']
+
+
+def test_iter_git_files(git_repo):
+    file_paths = [git_repo / 'new\nline.py', git_repo / 'nested' / 'spa ce.py', git_repo / 'ñandú.py']
+    _git_add(*file_paths)
+    assert sorted(_iter_git_files(git_repo)) == sorted(file_paths)
+
+
+def test_iter_git_files_for_small_reads(git_repo, monkeypatch):
+    monkeypatch.setattr('unbeheader.cli.GIT_READ_SIZE', 3)
+    file_paths = [git_repo / f'manuscript_{i}.py' for i in range(10)]
+    _git_add(*file_paths)
+    assert sorted(_iter_git_files(git_repo)) == sorted(file_paths)
+
+
+@mock.patch('subprocess.Popen.kill', autospec=True)
+def test_iter_git_files_for_close(kill, git_repo, monkeypatch):
+    monkeypatch.setattr('unbeheader.cli.GIT_READ_SIZE', 3)
+    _git_add(*(git_repo / f'manuscript_{i}.py' for i in range(10)))
+    file_paths = _iter_git_files(git_repo)
+    next(file_paths)
+    file_paths.close()
+    kill.assert_called_once()
 
 
-@mock.patch('subprocess.check_output')
-@mock.patch('unbeheader.cli.is_excluded')
-@mock.patch('unbeheader.cli.update_header')
-def test_run_on_repo_for_untracked_files(update_header, is_excluded, check_output):
-    check_output.side_effect = [
-        '',                 # git ls-files
-        '/path/to/new.py',  # git ls-files --others --exclude-standard
-        ''                  # git ls-files --deleted
+def test_iter_changed_files(git_repo):
+    modified_path = git_repo / 'modified.py'
+    staged_path = git_repo / 'staged.py'
+    _git_add(modified_path, git_repo / 'unchanged.py')
+    _git_commit()
+    modified_path.write_text('# Do what thou wilt')
+    _git_add(staged_path)
+    assert list(_iter_changed_files(git_repo, None, False)) == [modified_path]
+    assert list(_iter_changed_files(git_repo, None, True)) == [staged_path]
+    assert sorted(_iter_changed_files(git_repo, 'HEAD', False)) == [modified_path, staged_path]
+
+
+def test_iter_changed_files_for_governing_files(git_repo):
+    nested_dir_path = git_repo / 'nested'
+    config_path = nested_dir_path / CONFIG_FILE_NAME
+    file_paths = [nested_dir_path / 'manuscript.py', nested_dir_path / 'deeper' / 'manuscript.py']
+    _git_add(git_repo / 'manuscript.py', config_path, *file_paths)
+    _git_commit()
+    config_path.write_text('owner: Ordo Templi Orientis')
+    file_paths[0].write_text('# Do what thou wilt')
+    assert sorted(_iter_changed_files(git_repo, 'HEAD', False)) == sorted(file_paths)
+
+
+def test_iter_changed_files_for_untracked_files(git_repo):
+    modified_path = git_repo / 'modified.py'
+    untracked_path = git_repo / 'nested' / 'untracked.py'
+    _git_add(modified_path)
+    _git_commit()
+    modified_path.write_text('# Do what thou wilt')
+    untracked_path.parent.mkdir()
+    untracked_path.touch()
+    (git_repo / 'ignored.py').touch()
+    (git_repo / '.gitignore').write_text('ignored.py\n')
+    assert sorted(_iter_changed_files(git_repo, 'HEAD', False)) == [
+        git_repo / '.gitignore', modified_path, untracked_path
     ]
-    is_excluded.return_value = False
-    _run_on_repo(date.today().year, False)
-    update_header.assert_called_once()
+    assert list(_iter_changed_files(git_repo, 'HEAD', True)) == []
+
+
+def test_iter_changed_files_for_governing_files_above_cwd(git_repo, monkeypatch):
+    nested_dir_path = git_repo / 'nested'
+    file_paths = [nested_dir_path / 'manuscript.py', nested_dir_path / 'deeper' / 'manuscript.py']
+    _git_add(git_repo / CONFIG_FILE_NAME, git_repo / 'manuscript.py', git_repo / 'other' / 'manuscript.py',
+             *file_paths)
+    _git_commit()
+    (git_repo / CONFIG_FILE_NAME).write_text('owner: Ordo Templi Orientis')
+    (git_repo / 'manuscript.py').write_text('# Do what thou wilt')
+    monkeypatch.chdir(nested_dir_path)
+    # Only the files in the current directory are yielded, including the ones governed by the changed config
+    assert sorted(_iter_changed_files(nested_dir_path, 'HEAD', False)) == sorted(file_paths)
+
+
+def test_iter_changed_files_for_invalid_ref(git_repo):
+    with pytest.raises(UsageError):
+        list(_iter_changed_files(git_repo, 'nowhere', False))
+
+
+@mock.patch('unbeheader.cli._run_on_changes')
+@pytest.mark.parametrize('args', (['--since', 'HEAD'], ['--staged']))
+def test_main_for_changes(_run_on_changes, args, tmp_path):
+    runner = CliRunner()
+    runner.invoke(main, args)
+    _run_on_changes.assert_called_once()
+    result = runner.invoke(main, [*args, '--path', tmp_path])
+    assert result.exit_code == 2
 
 
 def test_run_on_repo_for_non_repo(tmp_path):
     os.chdir(tmp_path)
     with pytest.raises(UsageError):
         _run_on_repo(date.today().year, False)
+
+
+@mock.patch('unbeheader.api.process_files')
+def test_process_files_for_sorted_output(process_files, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('CI', '1')
+    process_files.return_value = [
+        HeaderResult(tmp_path / 'manuscript_b.py', changed=True, found=True),
+        HeaderResult(tmp_path / 'manuscript_c.py', changed=False, found=True),
+        HeaderResult(tmp_path / 'manuscript_a.py', changed=True, found=False),
+    ]
+    assert _process_files([], date.today().year, True) is True
+    assert capsys.readouterr().out == 'Missing header in manuscript_a.py\nIncorrect header in manuscript_b.py\n'
+
+
+@pytest.mark.parametrize(('args', 'expected'), (
+    ([], 'Missing header in somewhere.py\n❌ Some headers need to be added or updated\n'),
+    (['--quiet'], '❌ Some headers need to be added or updated\n'),
+))
+def test_main_for_text_format(args, expected, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('CI', '1')
+    _write_format_files(tmp_path)
+    runner = CliRunner()
+    result = runner.invoke(main, ['--check', *args, 'somewhere.py', 'elsewhere.py'])
+    assert result.exit_code == 1
+    assert result.output == expected
+
+
+@pytest.mark.parametrize('output_format', ('json', 'jsonl'))
+def test_main_for_json_format(output_format, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write_format_files(tmp_path)
+    runner = CliRunner()
+    result = runner.invoke(main, ['--check', '--format', output_format, 'somewhere.py', 'elsewhere.py'])
+    assert result.exit_code == 1
+    expected_results = [
+        {'path': 'elsewhere.py', 'status': 'ok', 'found': True, 'old_span': [0, 31], 'new_span': [0, 31],
+         'error': None},
+        {'path': 'somewhere.py', 'status': 'added', 'found': False, 'old_span': None, 'new_span': [0, 31],
+         'error': None},
+    ]
+    if output_format == 'json':
+        assert json.loads(result.output) == {
+            'check': True,
+            'results': expected_results,
+            'summary': {'ok': 1, 'updated': 0, 'added': 1, 'skipped': 0, 'failed': 0},
+        }
+    else:
+        lines = [json.loads(line) for line in result.output.splitlines()]
+        assert sorted(lines, key=lambda line: line['path']) == expected_results
+
+
+def _write_format_files(dir_path):
+    config = "owner: Crowley\ntemplate: '{comment_start} This file is part of Thelema.'\n"
+    (dir_path / CONFIG_FILE_NAME).write_text(config)
+    (dir_path / 'somewhere.py').write_text('x = 1\n')
+    (dir_path / 'elsewhere.py').write_text('# This file is part of Thelema.\n\nx = 1\n')
+
+
+def test_main_for_stats(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write_format_files(tmp_path)
+    runner = CliRunner()
+    args = ['--check', '--quiet', '--stats', '--stats-json', 'stats.json', '--stats-trace', 'trace.json',
+            'somewhere.py', 'elsewhere.py']
+    result = runner.invoke(main, args)
+    assert result.exit_code == 1
+    assert result.stdout == '❌ Some headers need to be added or updated\n'
+    assert 'config hit rate' in result.stderr
+    data = json.loads((tmp_path / 'stats.json').read_text())
+    assert data['counts']['files'] == 2
+    assert data['phases']['read']['calls'] == 2
+    trace = json.loads((tmp_path / 'trace.json').read_text())
+    assert {event['name'] for event in trace['traceEvents']} >= {'discovery', 'exclusion', 'read', 'match'}
+    # Stats are only recorded while running with them
+    assert stats.get_stats() is None
+
+
+@pytest.mark.parametrize('jobs', ('1', '2'))
+def test_main_for_fail_fast(jobs, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('CI', '1')
+    monkeypatch.setattr('unbeheader.engine.CHUNK_SIZE', 2)
+    _write_format_files(tmp_path)
+    (tmp_path / 'somewhere.py').unlink()
+    for i in range(20):
+        (tmp_path / f'manuscript_{i}.py').write_text('x = 1\n')
+    runner = CliRunner()
+    with mock.patch('unbeheader.headers._do_update_header', wraps=_do_update_header) as do_update_header:
+        result = runner.invoke(main, ['--check', '--fail-fast', '--jobs', jobs, '--path', '.'])
+    assert result.exit_code == 1
+    missing_lines = [line for line in result.output.splitlines() if line.startswith('Missing header in')]
+    assert len(missing_lines) == 1
+    assert result.output.endswith('❌ Some headers need to be added or updated\n')
+    if jobs == '1':
+        # Nothing is processed after the first file needing changes, the up to date one being the only other one
+        assert do_update_header.call_count <= 2
+
+
+@pytest.mark.parametrize('args', (
+    [],
+    ['--check', '--watch'],
+))
+def test_main_for_fail_fast_usage_error(args, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    runner = CliRunner()
+    result = runner.invoke(main, ['--fail-fast', *args])
+    assert result.exit_code == 2
+
+
+@pytest.mark.parametrize(('args', 'jobs'), (
+    (['--path', '.'], '1'),
+    (['--path', '.'], '2'),
+    (['manuscript.go', 'types.d.ts', 'query.sql', 'somewhere.py'], '1'),
+))
+def test_main_for_file_types(args, jobs, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr('unbeheader.engine.CHUNK_SIZE', 2)
+    _write_format_files(tmp_path)
+    with (tmp_path / CONFIG_FILE_NAME).open('a') as f:
+        f.write('file_types:\n'
+                '  - {extensions: [go], comment_start: //, comment_middle: //}\n'
+                '  - {extensions: [sql], comment_start: "--", comment_middle: "--"}\n'
+                '  - {extensions: [d.ts], comment_start: ///, comment_middle: ///}\n')
+    for name in ('manuscript.go', 'types.d.ts', 'query.sql'):
+        (tmp_path / name).write_text('x = 1\n')
+    runner = CliRunner()
+    result = runner.invoke(main, ['--jobs', jobs, *args])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / 'manuscript.go').read_text() == '// This file is part of Thelema.\n\nx = 1\n'
+    assert (tmp_path / 'query.sql').read_text() == '-- This file is part of Thelema.\n\nx = 1\n'
+    # The longest extension wins over the built-in ts file type
+    assert (tmp_path / 'types.d.ts').read_text() == '/// This file is part of Thelema.\n\nx = 1\n'
+    assert (tmp_path / 'somewhere.py').read_text() == '# This file is part of Thelema.\n\nx = 1\n'
+
+
+@pytest.mark.parametrize('args', (
+    ['--check'],
+    ['--check', '--path', 'sub'],
+    ['--check', 'sub/manuscript.go'],
+))
+@pytest.mark.parametrize('jobs', ('1', '2'))
+@pytest.mark.usefixtures('git_repo')
+def test_main_for_nested_file_types(args, jobs, tmp_path):
+    _write_format_files(tmp_path)
+    (tmp_path / 'somewhere.py').write_text('# This file is part of Thelema.\n\nx = 1\n')
+    sub_dir_path = tmp_path / 'sub'
+    sub_dir_path.mkdir()
+    config = 'file_types: [{extensions: [go], comment_start: //, comment_middle: //}]\n'
+    (sub_dir_path / CONFIG_FILE_NAME).write_text(config)
+    (sub_dir_path / 'manuscript.go').write_text('x = 1\n')
+    (tmp_path / 'grimoire.go').write_text('x = 1\n')
+    runner = CliRunner()
+    result = runner.invoke(main, ['--jobs', jobs, *args])
+    assert result.exit_code == 1, result.output
+    assert 'manuscript.go' in result.output
+    assert 'grimoire.go' not in result.output
+
+
+def test_main_for_invalid_file_types(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _write_format_files(tmp_path)
+    with (tmp_path / CONFIG_FILE_NAME).open('a') as f:
+        f.write('file_types: [{extensions: [go]}]\n')
+    runner = CliRunner()
+    result = runner.invoke(main, ['--check', '--path', '.'])
+    assert result.exit_code == 1
+    assert f'Invalid file types found in {tmp_path / CONFIG_FILE_NAME}' in result.stderr
@@ -4,18 +4,41 @@
 import os
 from datetime import date
 from pathlib import Path
+from textwrap import dedent
 from unittest import mock
 
 import pytest
 import yaml
 
+from unbeheader import SUPPORTED_FILE_TYPES
 from unbeheader.config import CONFIG_FILE_NAME
 from unbeheader.config import CONFIG_FILE_NAME_YML
 from unbeheader.config import DEFAULT_SUBSTRING
-from unbeheader.config import _load_config
+from unbeheader.config import ConfigResolver
+from unbeheader.config import HeaderConfig
+from unbeheader.config import _generate_header
+from unbeheader.config import _read_config_file
 from unbeheader.config import _validate_config
-from unbeheader.config import _walk_to_root
-from unbeheader.config import get_config
+from unbeheader.exceptions import ConfigError
+from unbeheader.exceptions import ConfigNotFoundError
+from unbeheader.filetypes import DEFAULT_FILE_TYPES
+from unbeheader.filetypes import compile_file_types
+from unbeheader.typing import CommentSkeleton
+
+
+@pytest.fixture
+def config():
+    return {
+        'owner': 'Ordo Templi Orientis',
+        'start_year': 1904,
+        'end_year': 1904,
+        'substring': DEFAULT_SUBSTRING,
+        'template': dedent('''
+            {comment_start} This file is part of Thelema.
+            {comment_middle} Copyright (C) {dates} {owner}
+            {comment_end}
+        ''').lstrip()
+    }
 
 
 @pytest.fixture
@@ -28,112 +51,300 @@ def create_headers_file():
     return create_headers_file
 
 
-@mock.patch('unbeheader.config._load_config')
-@mock.patch('unbeheader.config._validate_config')
-def test_get_config(_validate_config, _load_config, tmp_path):
-    end_year = date.today().year
-    _load_config.return_value = {}
-    config = get_config(tmp_path, end_year)
-    assert _load_config.call_count == 1
-    assert _validate_config.call_count == 1
-    assert config['end_year'] == end_year
+def test_validate_config():
+    config = {
+        'owner': 'Ordo Templi Orientis',
+        'start_year': 1904,
+        'template': ''
+    }
+    _validate_config(config)
+
+
+def test_validate_config_for_invalid_keys():
+    invalid_config = {'Country': 'Germany'}
+    with pytest.raises(ConfigError, match='Invalid key found in .header.yaml files: Country'):
+        _validate_config(invalid_config)
+
+
+def test_validate_config_for_missing_keys():
+    incomplete_config = {}
+    with pytest.raises(ConfigError, match='is missing'):
+        _validate_config(incomplete_config)
+
+
+@pytest.mark.parametrize('value', (0, -1, 'ten', True))
+def test_validate_config_for_invalid_window(value):
+    invalid_config = {
+        'owner': 'Ordo Templi Orientis',
+        'template': '',
+        'max_header_lines': value
+    }
+    with pytest.raises(ConfigError, match='max_header_lines must be a positive integer'):
+        _validate_config(invalid_config)
 
 
-@mock.patch('unbeheader.config._load_config')
-@mock.patch('unbeheader.config._validate_config')
-def test_get_config_for_default_substring(_validate_config, _load_config, tmp_path):
+@pytest.mark.parametrize('value', ('utf-16', 'enochian', 8))
+def test_validate_config_for_invalid_encoding(value):
+    invalid_config = {
+        'owner': 'Ordo Templi Orientis',
+        'template': '',
+        'encoding': value
+    }
+    with pytest.raises(ConfigError, match='encoding must be an ASCII-compatible encoding'):
+        _validate_config(invalid_config)
+
+
+@pytest.mark.parametrize(('encoding', 'expected'), (
+    (None, 'Æon'.encode()),
+    ('latin-1', 'Æon'.encode('latin-1')),
+))
+def test_header_config_for_encoding(encoding, expected, config):
+    config['template'] = '{comment_start} {owner}'
+    config['owner'] = 'Æon'
+    if encoding:
+        config['encoding'] = encoding
+    # Headers are encoded the same way whatever the locale is
+    with mock.patch('locale.getpreferredencoding', return_value='ascii'):
+        header_config = HeaderConfig(config)
+    assert header_config.encode_header(CommentSkeleton('#', '#')) == b'# ' + expected + b'\n'
+
+
+def test_header_config_for_unencodable_header(config):
+    config['owner'] = 'Æon'
+    config['encoding'] = 'ascii'
+    with pytest.raises(ConfigError, match='Header cannot be encoded in ascii'):
+        HeaderConfig(config, Path('/thelema/.header.yaml'))
+
+
+@pytest.mark.parametrize(('extension', 'expected'), (
+    ('py', '''
+        # This file is part of Thelema.
+        # Copyright (C) 1904 Ordo Templi Orientis
+    '''),
+    ('wsgi', '''
+        # This file is part of Thelema.
+        # Copyright (C) 1904 Ordo Templi Orientis
+    '''),
+    ('js', '''
+        // This file is part of Thelema.
+        // Copyright (C) 1904 Ordo Templi Orientis
+    '''),
+    ('jsx', '''
+        // This file is part of Thelema.
+        // Copyright (C) 1904 Ordo Templi Orientis
+    '''),
+    ('css', '''
+        /* This file is part of Thelema.
+         * Copyright (C) 1904 Ordo Templi Orientis
+         */
+    '''),
+    ('scss', '''
+        // This file is part of Thelema.
+        // Copyright (C) 1904 Ordo Templi Orientis
+    '''),
+    ('sh', '''
+        # This file is part of Thelema.
+        # Copyright (C) 1904 Ordo Templi Orientis
+    '''),
+))
+def test_generate_header(extension, expected, config):
+    data = SUPPORTED_FILE_TYPES[extension].comments._asdict() | config
+    header = _generate_header(data)
+    assert header == dedent(expected).lstrip()
+
+
+def test_generate_header_for_different_end_year(config):
     end_year = date.today().year
-    _load_config.return_value = {}
-    config = get_config(tmp_path, end_year)
-    assert config['substring'] == DEFAULT_SUBSTRING
-    _load_config.return_value = {'substring': ''}
-    config = get_config(tmp_path, end_year)
-    assert config['substring'] != DEFAULT_SUBSTRING
+    config['end_year'] = end_year
+    data = SUPPORTED_FILE_TYPES['py'].comments._asdict() | config
+    header = _generate_header(data)
+    assert header == dedent(f'''
+        # This file is part of Thelema.
+        # Copyright (C) 1904 - {end_year} Ordo Templi Orientis
+    '''.format(end_year)).lstrip()
+
+
+@pytest.mark.parametrize('template', (
+    '{root}', '{template}', '{substring}'
+))
+def test_generate_header_for_invalid_placeholder(template, config):
+    data = SUPPORTED_FILE_TYPES['py'].comments._asdict() | config
+    data['template'] = template
+    with pytest.raises(ConfigError, match='Invalid placeholder'):
+        _generate_header(data)
+
+
+def test_header_config(config):
+    comments = SUPPORTED_FILE_TYPES['py'].comments
+    header_config = HeaderConfig(config)
+    header = header_config.get_header(comments)
+    assert header == _generate_header(comments._asdict() | config)
+    with mock.patch('unbeheader.config._generate_header') as _generate_header_mock:
+        assert header_config.get_header(comments) is header
+    _generate_header_mock.assert_not_called()
+
+
+def test_header_config_for_invalid_placeholder(config):
+    config['template'] = '{comment_start} {sigil}'
+    with pytest.raises(ConfigError, match='{sigil} found in template in /path/to/.header.yaml') as exc:
+        HeaderConfig(config, Path('/path/to/.header.yaml'))
+    assert exc.value.path == Path('/path/to/.header.yaml')
+
+
+def test_config_resolver(create_headers_file, tmp_path):
+    data = {'owner': 'Ordo Templi Orientis', 'start_year': 1904, 'template': ''}
+    create_headers_file(data, tmp_path)
+    end_year = date.today().year
+    resolver = ConfigResolver()
+    config = resolver.get_config(tmp_path / 'manuscript.py', end_year)
+    assert config.data == {**data, 'substring': DEFAULT_SUBSTRING, 'end_year': end_year}
+    assert (resolver.hits, resolver.misses) == (0, 1)
+    assert resolver.get_config(tmp_path / 'grimoire.py', end_year) is config
+    assert (resolver.hits, resolver.misses) == (1, 1)
 
 
-def test_load_config(create_headers_file, tmp_path):
-    data_top = {'owner': 'Ordo Templi Orientis', 'start_year': 1904}
+def test_config_resolver_for_multiple_directories(create_headers_file, tmp_path):
+    data_top = {'owner': 'Ordo Templi Orientis', 'start_year': 1904, 'template': ''}
+    data_bottom = {'start_year': 1486}
+    nested_dir_path = tmp_path / 'nested'
+    nested_dir_path.mkdir()
     create_headers_file(data_top, tmp_path)
-    config = _load_config(tmp_path)
-    assert config == data_top
+    create_headers_file(data_bottom, nested_dir_path)
+    end_year = date.today().year
+    resolver = ConfigResolver()
+    with mock.patch('unbeheader.config._read_config_file', wraps=_read_config_file) as read_config_file:
+        config_bottom = resolver.get_config(nested_dir_path / 'manuscript.py', end_year)
+        config_top = resolver.get_config(tmp_path / 'manuscript.py', end_year)
+    assert config_bottom.data['start_year'] == data_bottom['start_year']
+    assert config_top.data['start_year'] == data_top['start_year']
+    # Every directory up to the root is only probed once
+    assert read_config_file.call_count == len(nested_dir_path.parents) + 1
+    assert (resolver.hits, resolver.misses) == (0, 2)
+
+
+def test_config_resolver_for_shared_config(create_headers_file, config, tmp_path):
+    nested_dir_path = tmp_path / 'nested'
+    (nested_dir_path / 'deeper').mkdir(parents=True)
+    create_headers_file({'owner': config['owner'], 'template': config['template']}, tmp_path)
+    resolver = ConfigResolver()
+    comments = SUPPORTED_FILE_TYPES['py'].comments
+    with mock.patch('unbeheader.config._generate_header', wraps=_generate_header) as generate_header:
+        # Directories sharing their configuration files share the validated configuration and its headers
+        shared = resolver.get_config(tmp_path / 'manuscript.py', 1904)
+        assert resolver.get_config(nested_dir_path / 'manuscript.py', 1904) is shared
+        assert resolver.get_config(nested_dir_path / 'deeper' / 'manuscript.py', 1904).get_header(comments)
+        assert shared.get_header(comments)
+        assert generate_header.call_count == 2
+        assert resolver.get_config(nested_dir_path / 'manuscript.py', 1905) is not shared
+    assert (resolver.hits, resolver.misses) == (0, 4)
+    create_headers_file({'start_year': 1486}, nested_dir_path)
+    resolver.invalidate(nested_dir_path)
+    assert resolver.get_config(tmp_path / 'manuscript.py', 1904) is shared
+    assert resolver.get_config(nested_dir_path / 'manuscript.py', 1904) is not shared
+
+
+def test_config_resolver_for_shared_error(create_headers_file, config, tmp_path):
+    nested_dir_path = tmp_path / 'nested'
+    nested_dir_path.mkdir()
+    create_headers_file({'owner': config['owner'], 'template': '{comment_start} {sigil}'}, tmp_path)
+    resolver = ConfigResolver()
+    with mock.patch('unbeheader.config._generate_header', wraps=_generate_header) as generate_header:
+        with pytest.raises(ConfigError, match='{sigil}') as exc:
+            resolver.get_config(tmp_path / 'manuscript.py', 1904)
+        with pytest.raises(ConfigError) as nested_exc:
+            resolver.get_config(nested_dir_path / 'manuscript.py', 1904)
+    # The template is only checked once for all the directories it applies to
+    assert generate_header.call_count == 1
+    assert nested_exc.value is exc.value
+
+
+def test_config_resolver_for_default_substring(create_headers_file, tmp_path):
+    nested_dir_path = tmp_path / 'nested'
+    nested_dir_path.mkdir()
+    create_headers_file({'owner': 'Ordo Templi Orientis', 'template': ''}, tmp_path)
+    create_headers_file({'substring': ''}, nested_dir_path)
+    resolver = ConfigResolver()
+    assert resolver.get_config(tmp_path / 'manuscript.py', 1904).substring == DEFAULT_SUBSTRING
+    assert resolver.get_config(nested_dir_path / 'manuscript.py', 1904).substring == ''
 
 
-def test_load_config_for_multiple_files(create_headers_file, tmp_path):
-    data_top = {'owner': 'Ordo Templi Orientis', 'start_year': 1904}
+def test_config_resolver_for_merged_config(create_headers_file, tmp_path):
+    data_top = {'owner': 'Ordo Templi Orientis', 'template': '', 'start_year': 1904}
     data_bottom = {'start_year': 1486}
     nested_dir_path = tmp_path / 'nested'
     nested_dir_path.mkdir()
     create_headers_file(data_top, tmp_path)
     create_headers_file(data_bottom, nested_dir_path)
-    config = _load_config(nested_dir_path)
-    assert config == {**data_top, **data_bottom}
-    assert config['start_year'] == data_bottom['start_year']
+    resolver = ConfigResolver()
+    expected = {'substring': DEFAULT_SUBSTRING, 'end_year': 1947}
+    assert resolver.get_config(tmp_path / 'manuscript.py', 1947).data == {**data_top, **expected}
+    assert resolver.get_config(nested_dir_path / 'manuscript.py', 1947).data == {**data_top, **data_bottom, **expected}
 
 
-def test_load_config_for_stop_on_root(create_headers_file, tmp_path):
-    data_top = {'owner': 'Ordo Templi Orientis', 'start_year': 1904}
+def test_config_resolver_for_stop_on_root(create_headers_file, tmp_path):
+    data_top = {'owner': 'Ordo Templi Orientis', 'template': ''}
     data_bottom = {'root': True}
     nested_dir_path = tmp_path / 'nested'
     nested_dir_path.mkdir()
     create_headers_file(data_top, tmp_path)
     create_headers_file(data_bottom, nested_dir_path)
-    config = _load_config(nested_dir_path)
-    assert config == {}
-
-
-def test_load_config_for_both_yaml_files(create_headers_file, tmp_path):
-    create_headers_file({}, tmp_path, CONFIG_FILE_NAME)
-    create_headers_file({}, tmp_path, CONFIG_FILE_NAME_YML)
-    with pytest.raises(SystemExit) as exc:
-        _load_config(tmp_path)
-    assert exc.value.code == 1
-
-
-def test_load_config_for_file_not_found(tmp_path):
-    with pytest.raises(SystemExit) as exc:
-        _load_config(tmp_path)
-    assert exc.value.code == 1
-
-
-def test_validate_config():
-    config = {
-        'owner': 'Ordo Templi Orientis',
-        'start_year': 1904,
-        'template': ''
-    }
-    _validate_config(config)
-
-
-def test_validate_config_for_invalid_keys():
-    invalid_config = {'Country': 'Germany'}
-    with pytest.raises(SystemExit) as exc:
-        _validate_config(invalid_config)
-    assert exc.value.code == 1
+    resolver = ConfigResolver()
+    # Nothing is merged from the parent directory, which makes the configuration incomplete
+    with pytest.raises(ConfigError, match='is missing'):
+        resolver.get_config(nested_dir_path / 'manuscript.py', 1904)
+    assert resolver.get_config(tmp_path / 'manuscript.py', 1904).data['owner'] == data_top['owner']
 
 
-def test_validate_config_for_missing_keys():
-    incomplete_config = {}
-    with pytest.raises(SystemExit) as exc:
-        _validate_config(incomplete_config)
-    assert exc.value.code == 1
+def test_config_resolver_for_yml_file(create_headers_file, tmp_path):
+    data = {'owner': 'Ordo Templi Orientis'}
+    create_headers_file(data, tmp_path, CONFIG_FILE_NAME_YML)
+    assert _read_config_file(tmp_path) == (tmp_path / CONFIG_FILE_NAME_YML, data)
 
 
-def test_walk_to_root_for_non_existent_path():
-    with pytest.raises(OSError):
-        list(_walk_to_root(Path('/path/to/nowhere')))
+def test_config_resolver_for_both_yaml_files(create_headers_file, tmp_path):
+    create_headers_file({}, tmp_path, CONFIG_FILE_NAME)
+    create_headers_file({}, tmp_path, CONFIG_FILE_NAME_YML)
+    with pytest.raises(ConfigError, match='Both .header.yaml and .header.yml files found') as exc:
+        ConfigResolver().get_config(tmp_path / 'manuscript.py', 1904)
+    assert exc.value.path == tmp_path
 
 
-def test_walk_to_root_for_file_path(tmp_path):
-    file_path = tmp_path / 'manuscript.py'
-    file_path.touch()
-    assert list(_walk_to_root(file_path)) == list(file_path.parents)
+@pytest.mark.parametrize(('content', 'message'), (
+    ('owner: [Ordo Templi Orientis\n', 'Invalid YAML found in .* at line 2'),
+    ('', 'it must be a mapping'),
+    ('- owner\n', 'it must be a mapping'),
+))
+def test_config_resolver_for_invalid_file(content, message, tmp_path):
+    config_path = tmp_path / CONFIG_FILE_NAME
+    config_path.write_text(content)
+    with pytest.raises(ConfigError, match=message) as exc:
+        ConfigResolver().get_config(tmp_path / 'manuscript.py', 1904)
+    assert exc.value.path == config_path
 
 
-def test_walk_to_root_for_directory(tmp_path):
-    assert list(_walk_to_root(tmp_path)) == [tmp_path] + list(tmp_path.parents)
+def test_config_resolver_for_file_not_found(tmp_path):
+    with pytest.raises(ConfigNotFoundError) as exc:
+        ConfigResolver().get_config(tmp_path / 'manuscript.py', 1904)
+    assert exc.value.path == tmp_path
 
 
-def test_walk_to_root_for_root_directory():
-    root_path = Path('/')
-    expected_dirs = [root_path]
-    assert list(_walk_to_root(root_path)) == expected_dirs
+def test_config_resolver_for_file_types(create_headers_file, config, tmp_path):
+    file_types = [{'extensions': ['go'], 'comment_start': '//', 'comment_middle': '//'}]
+    nested_dir_path = tmp_path / 'nested'
+    nested_dir_path.mkdir()
+    create_headers_file({'owner': config['owner'], 'template': config['template'], 'file_types': file_types}, tmp_path)
+    create_headers_file({'start_year': 1486}, nested_dir_path)
+    resolver = ConfigResolver()
+    with mock.patch('unbeheader.config.compile_file_types', wraps=compile_file_types) as compile_file_types_:
+        registry = resolver.get_file_types(tmp_path)
+        # The file types are compiled once for all the directories they apply to
+        assert resolver.get_file_types(nested_dir_path) is registry
+    assert compile_file_types_.call_count == 1
+    assert registry['go'].comments == CommentSkeleton('//', '//')
+    assert resolver.get_file_types(tmp_path.parent) is DEFAULT_FILE_TYPES
+    # The file types are not part of the template data
+    assert resolver.get_config(nested_dir_path / 'manuscript.go', 1904).get_header(registry['go'].comments) == (
+        '// This file is part of Thelema.\n// Copyright (C) 1486 - 1904 Ordo Templi Orientis\n'
+    )
+    resolver.invalidate(tmp_path)
+    assert resolver.get_file_types(tmp_path) is not registry
@@ -0,0 +1,167 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+import os
+import sys
+import threading
+from textwrap import dedent
+from unittest import mock
+
+import pytest
+import yaml
+
+from unbeheader import stats
+from unbeheader.cache import ResultCache
+from unbeheader.config import CONFIG_FILE_NAME
+from unbeheader.config import ConfigResolver
+from unbeheader.engine import process_files
+from unbeheader.exceptions import ConfigNotFoundError
+from unbeheader.typing import HeaderResult
+from unbeheader.typing import HeaderStatus
+
+
+@pytest.fixture
+def create_files(tmp_path):
+    def create_files(count):
+        config = {
+            'owner': 'Ordo Templi Orientis',
+            'start_year': 1904,
+            'template': dedent('''
+                {comment_start} This file is part of Thelema.
+                {comment_middle} Copyright (C) {dates} {owner}
+                {comment_end}
+            ''').lstrip()
+        }
+        (tmp_path / CONFIG_FILE_NAME).write_text(yaml.dump(config))
+        file_paths = []
+        for i in range(count):
+            file_path = tmp_path / f'manuscript_{i}.py'
+            header = '# This file is part of Thelema.\n# Copyright (C) 1904 Ordo Templi Orientis\n\n' if i % 3 else ''
+            file_path.write_text(f"{header}print('Beware of the knowledge you will gain.')\n")
+            file_paths.append(file_path)
+        return file_paths
+
+    return create_files
+
+
+def test_process_files(create_files):
+    file_paths = create_files(3)
+    results = list(process_files(file_paths, 1904, check=True))
+    assert results == [
+        HeaderResult(file_paths[0], changed=True, found=False, new_span=(0, 73)),
+        HeaderResult(file_paths[1], changed=False, found=True, old_span=(0, 73), new_span=(0, 73)),
+        HeaderResult(file_paths[2], changed=False, found=True, old_span=(0, 73), new_span=(0, 73)),
+    ]
+
+
+@mock.patch('concurrent.futures.ProcessPoolExecutor')
+def test_process_files_for_single_batch(ProcessPoolExecutor, create_files):
+    file_paths = create_files(3)
+    results = list(process_files(file_paths, 1904, check=True, jobs=4))
+    assert len(results) == 3
+    ProcessPoolExecutor.assert_not_called()
+
+
+@pytest.mark.parametrize('check', (True, False))
+def test_process_files_for_multiple_jobs(check, create_files, tmp_path, monkeypatch):
+    monkeypatch.setattr('unbeheader.engine.CHUNK_SIZE', 4)
+    file_paths = create_files(30)
+    expected = sorted(process_files(file_paths, 1947, check=True))
+    results = sorted(process_files(file_paths, 1947, check=check, jobs=3))
+    assert results == expected
+    assert all(result.changed for result in results)
+    # Files were only updated when not in check mode
+    assert all(('1904 - 1947' in file_path.read_text()) is not check for file_path in file_paths)
+
+
+def test_process_files_for_cache(create_files, monkeypatch):
+    monkeypatch.setattr('unbeheader.engine.CHUNK_SIZE', 4)
+    file_paths = create_files(30)
+    for file_path in file_paths:
+        os.utime(file_path, (0, 0))
+    cache = ResultCache()
+    expected = sorted(process_files(file_paths, 1904, check=True, jobs=3, cache=cache))
+    assert (cache.hits, cache.misses) == (0, 30)
+    results = sorted(process_files(file_paths, 1904, check=True, jobs=3, cache=cache))
+    # The spans of the headers are not known for the files served from the cache
+    assert [result[:3] for result in results] == [result[:3] for result in expected]
+    assert (cache.hits, cache.misses) == (20, 40)
+
+
+@pytest.mark.parametrize('trace', (False, True))
+def test_process_files_for_stats(trace, create_files, monkeypatch):
+    monkeypatch.setattr('unbeheader.engine.CHUNK_SIZE', 4)
+    file_paths = create_files(30)
+    run_stats = stats.enable(trace)
+    try:
+        list(process_files(file_paths, 1947, check=False, jobs=3))
+    finally:
+        stats.disable()
+    # The stats recorded by the worker processes are merged
+    assert run_stats.counts['files'] == 30
+    assert run_stats.calls['read'] == run_stats.calls['match'] == run_stats.calls['write'] == 30
+    assert run_stats.counts['config_hits'] + run_stats.counts['config_misses'] == 30
+    if trace:
+        assert len({event['pid'] for event in run_stats.events}) > 1
+    else:
+        assert run_stats.events is None
+
+
+@pytest.mark.parametrize('check', (True, False))
+@pytest.mark.parametrize('jobs', (1, 4, 100))
+def test_process_files_for_async(check, jobs, create_files):
+    file_paths = create_files(30)
+    expected = list(process_files(file_paths, 1947, check=True))
+    results = list(process_files(file_paths, 1947, check=check, jobs=jobs, engine='async'))
+    assert results == expected
+    assert all(('1904 - 1947' in file_path.read_text()) is not check for file_path in file_paths)
+
+
+def test_process_files_for_async_discovery(create_files):
+    file_paths = create_files(30)
+    discovery_threads = set()
+
+    def _iter_files():
+        for file_path in file_paths:
+            discovery_threads.add(threading.get_ident())
+            yield file_path
+
+    results = list(process_files(_iter_files(), 1904, check=True, jobs=4, engine='async'))
+    assert [result.file_path for result in results] == file_paths
+    # The files are discovered in a single thread, which is not the one running the event loop
+    assert len(discovery_threads) == 1
+    assert threading.get_ident() not in discovery_threads
+
+
+def test_process_files_for_async_counters(create_files):
+    file_paths = create_files(30) * 20
+    resolver = ConfigResolver()
+    cache = ResultCache()
+    switch_interval = sys.getswitchinterval()
+    # Switch threads as often as possible, so that counters updated without a lock would lose updates
+    sys.setswitchinterval(1e-6)
+    run_stats = stats.enable()
+    try:
+        list(process_files(file_paths, 1904, check=True, jobs=16, engine='async', cache=cache, resolver=resolver))
+    finally:
+        stats.disable()
+        sys.setswitchinterval(switch_interval)
+    assert resolver.hits + resolver.misses == len(file_paths)
+    assert cache.hits + cache.misses == len(file_paths)
+    assert run_stats.counts['files'] == len(file_paths)
+
+
+def test_process_files_for_async_close(create_files):
+    file_paths = create_files(30)
+    results = process_files(iter(file_paths), 1904, check=True, jobs=4, engine='async')
+    assert next(results) == HeaderResult(file_paths[0], changed=True, found=False, new_span=(0, 73))
+    results.close()
+
+
+def test_process_files_for_async_error(tmp_path):
+    file_path = tmp_path / 'manuscript.py'
+    file_path.write_text('')
+    results = list(process_files([file_path], 1904, check=True, jobs=4, engine='async'))
+    assert results == [HeaderResult(file_path, changed=False, found=False, error=mock.ANY)]
+    assert isinstance(results[0].error, ConfigNotFoundError)
+    assert results[0].status == HeaderStatus.FAILED
@@ -0,0 +1,92 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+import pickle
+from pathlib import Path
+
+import pytest
+
+from unbeheader import BLOCK_SCANNER
+from unbeheader import SLASH_LINE_SCANNER
+from unbeheader import SUPPORTED_FILE_TYPES
+from unbeheader.exceptions import ConfigError
+from unbeheader.filetypes import DEFAULT_FILE_TYPES
+from unbeheader.filetypes import FileTypeRegistry
+from unbeheader.filetypes import compile_file_types
+from unbeheader.typing import CommentSkeleton
+
+
+@pytest.mark.parametrize(('name', 'expected'), (
+    ('manuscript.py', 'py'),
+    ('manuscript.d.ts', 'd.ts'),
+    ('manuscript.ts', 'ts'),
+    ('manuscript.tar.d.ts', 'd.ts'),
+    ('manuscript.d.ts.txt', None),
+    ('manuscript', None),
+    ('.py', None),
+    ('.d.ts', 'ts'),
+    ('py', None),
+))
+def test_registry_match(name, expected):
+    registry = FileTypeRegistry(SUPPORTED_FILE_TYPES | {'d.ts': SUPPORTED_FILE_TYPES['css']})
+    assert registry.match(name) == expected
+    assert registry.get_file_type(name) == (registry[expected] if expected else None)
+
+
+def test_default_registry():
+    assert dict(DEFAULT_FILE_TYPES) == SUPPORTED_FILE_TYPES
+    assert DEFAULT_FILE_TYPES.match('manuscript.d.ts') == 'ts'
+
+
+def test_compile_file_types():
+    registry = compile_file_types([
+        {'extensions': ['go', '.rs'], 'comment_start': '//', 'comment_middle': '//'},
+        {'extensions': 'sql', 'comment_start': '--', 'comment_middle': '--'},
+        {'extensions': ['d.ts', 'scss'], 'comment_start': '/*', 'comment_middle': ' *', 'comment_end': ' */'},
+    ])
+    assert registry.keys() == SUPPORTED_FILE_TYPES.keys() | {'go', 'rs', 'sql', 'd.ts'}
+    assert registry['go'] is registry['rs']
+    assert registry['go'].comments == CommentSkeleton('//', '//')
+    assert registry['sql'].scanner.line_comment == '--'
+    assert registry['sql'].scanner.block_comment is None
+    # Declared file types replace the built-in ones, and the scanners of the built-in ones are reused
+    assert registry['scss'].comments == CommentSkeleton('/*', ' *', ' */')
+    assert registry['d.ts'].scanner is registry['scss'].scanner is BLOCK_SCANNER
+    assert registry['go'].scanner is SLASH_LINE_SCANNER
+    assert registry.match('manuscript.d.ts') == 'd.ts'
+
+
+def test_compile_file_types_for_shared_scanners():
+    declared = [{'extensions': ['sql'], 'comment_start': '--', 'comment_middle': '--'}]
+    assert compile_file_types(declared)['sql'].scanner is compile_file_types(declared)['sql'].scanner
+
+
+def test_compile_file_types_for_pickle():
+    registry = compile_file_types([{'extensions': ['d.ts'], 'comment_start': '//', 'comment_middle': '//'}])
+    unpickled = pickle.loads(pickle.dumps(registry))
+    assert {ext: file_type.comments for ext, file_type in unpickled.items()} == {
+        ext: file_type.comments for ext, file_type in registry.items()
+    }
+    # Scanners shared by several file types are still shared
+    assert unpickled['js'].scanner is unpickled['ts'].scanner
+    assert unpickled.match('manuscript.d.ts') == 'd.ts'
+
+
+@pytest.mark.parametrize(('declared', 'message'), (
+    ({'go': '//'}, 'file_types must be a list'),
+    (['go'], 'every file type must be a mapping'),
+    ([{'extensions': ['go'], 'comment_start': '//', 'comment_middle': '//', 'owner': 'OTO'}],
+     'invalid file type key owner'),
+    ([{'comment_start': '//', 'comment_middle': '//'}], 'every file type must have extensions'),
+    ([{'extensions': ['go', 'a..b'], 'comment_start': '//', 'comment_middle': '//'}], 'invalid extension a..b'),
+    ([{'extensions': ['go/x'], 'comment_start': '//', 'comment_middle': '//'}], 'invalid extension go/x'),
+    ([{'extensions': [1], 'comment_start': '//', 'comment_middle': '//'}], 'invalid extension 1'),
+    ([{'extensions': ['go'], 'comment_middle': '//'}], 'every file type must have a comment_start'),
+    ([{'extensions': ['go'], 'comment_start': 1, 'comment_middle': '//'}], 'comment_start must be a string'),
+    ([{'extensions': ['go'], 'comment_start': '//'}], 'comment_middle must start with comment_start'),
+))
+def test_compile_file_types_for_invalid_declarations(declared, message):
+    config_path = Path('/path/to/.header.yaml')
+    with pytest.raises(ConfigError, match=f'Invalid file types found in {config_path}: {message}') as exc:
+        compile_file_types(declared, config_path)
+    assert exc.value.path == config_path
@@ -1,22 +1,26 @@
 # This file is part of Unbeheader.
 # Copyright (C) CERN & UNCONVENTIONAL
 
-from dataclasses import asdict
+import os
+import shutil
 from datetime import date
 from textwrap import dedent
 from unittest import mock
 
 import pytest
-from colorclass import Color
 
 from unbeheader import SUPPORTED_FILE_TYPES
+from unbeheader.cache import ResultCache
 from unbeheader.config import DEFAULT_SUBSTRING
+from unbeheader.config import HeaderConfig
+from unbeheader.filetypes import DEFAULT_FILE_TYPES
 from unbeheader.headers import _do_update_header
-from unbeheader.headers import _generate_header
-from unbeheader.headers import _print_results
-from unbeheader.headers import update_header
-
-COLOR_RESET = Color('{/all}')
+from unbeheader.headers import _find_changed_range
+from unbeheader.headers import _match_header
+from unbeheader.headers import _replace_file
+from unbeheader.headers import _update_content
+from unbeheader.headers import process_header
+from unbeheader.typing import HeaderResult
 
 
 @pytest.fixture
@@ -47,56 +51,78 @@ def create_py_file(tmp_path):
 @pytest.fixture
 def py_files_settings():
     return {
-        'regex': SUPPORTED_FILE_TYPES['py'].regex,
+        'scanner': SUPPORTED_FILE_TYPES['py'].scanner,
         'comments': SUPPORTED_FILE_TYPES['py'].comments
     }
 
 
-@mock.patch('unbeheader.headers.get_config')
+@mock.patch('unbeheader.config.ConfigResolver.get_config')
 @mock.patch('unbeheader.headers._do_update_header')
-def test_update_header(_do_update_header, get_config, create_py_file):
+def test_process_header(_do_update_header, get_config, create_py_file):
     config = {'owner': 'Ordo Templi Orientis'}
     get_config.return_value = config
     year = date.today().year
     check = True
     file_path = create_py_file('')
     file_ext = file_path.suffix[1:]
-    update_header(file_path, year, check)
+    _do_update_header.return_value = HeaderResult(file_path, changed=False, found=False)
+    assert process_header(file_path, year, check) == _do_update_header.return_value
     _do_update_header.assert_called_once_with(
-        file_path, config, SUPPORTED_FILE_TYPES[file_ext].regex, SUPPORTED_FILE_TYPES[file_ext].comments, check
+        file_path, config, SUPPORTED_FILE_TYPES[file_ext].scanner, SUPPORTED_FILE_TYPES[file_ext].comments, check
     )
 
 
-@mock.patch('unbeheader.headers.get_config')
+@mock.patch('unbeheader.cache.RACY_INTERVAL_NS', -60_000_000_000)
+@mock.patch('unbeheader.headers._do_update_header', wraps=_do_update_header)
+@pytest.mark.parametrize(('check', 'expected_calls'), (
+    (True, 3),
+    (False, 1),
+))
+def test_process_header_for_cache(_do_update_header, check, expected_calls, config, create_py_file):
+    file_path = create_py_file("print('Beware of the knowledge you will gain.')\n")
+    resolver = mock.Mock(get_config=mock.Mock(return_value=HeaderConfig(config)),
+                         get_file_types=mock.Mock(return_value=DEFAULT_FILE_TYPES))
+    cache = ResultCache()
+    assert process_header(file_path, 1904, check, resolver, cache).changed is True
+    for _ in range(2):
+        assert process_header(file_path, 1904, check, resolver, cache).changed is check
+    # Files are only skipped once they are up to date
+    assert _do_update_header.call_count == expected_calls
+    assert cache.hits == 3 - expected_calls
+    config['end_year'] = 1947
+    resolver.get_config.return_value = HeaderConfig(config)
+    assert process_header(file_path, 1947, check, resolver, cache).changed is True
+
+
+@mock.patch('unbeheader.config.ConfigResolver.get_config')
 @mock.patch('unbeheader.headers._do_update_header')
-def test_update_header_for_non_existent_file(_do_update_header, get_config, tmp_path):
+def test_process_header_for_non_existent_file(_do_update_header, get_config, tmp_path):
     year = date.today().year
     file_path = tmp_path / 'manuscript.py'
-    assert update_header(file_path, year) is False
+    assert process_header(file_path, year) == HeaderResult(file_path, changed=False, found=False, skipped=True)
     assert _do_update_header.call_count == 0
 
 
-@mock.patch('unbeheader.headers.get_config')
+@mock.patch('unbeheader.config.ConfigResolver.get_config')
 @mock.patch('unbeheader.headers._do_update_header')
-def test_update_header_for_unsupported_file(_do_update_header, get_config, tmp_path):
+def test_process_header_for_unsupported_file(_do_update_header, get_config, tmp_path):
     year = date.today().year
     file_path = tmp_path / 'manuscript.txt'
     file_path.touch()
     assert 'txt' not in SUPPORTED_FILE_TYPES
-    assert update_header(file_path, year) is False
+    assert process_header(file_path, year) == HeaderResult(file_path, changed=False, found=False, skipped=True)
     assert _do_update_header.call_count == 0
 
 
-@mock.patch('unbeheader.headers.get_config')
+@mock.patch('unbeheader.config.ConfigResolver.get_config')
 @mock.patch('unbeheader.headers._do_update_header')
-def test_update_header_for_current_dir(_do_update_header, get_config, tmp_path):
+def test_process_header_for_current_dir(_do_update_header, get_config, tmp_path):
     year = date.today().year
     file_path = tmp_path / '.'
-    assert update_header(file_path, year) is False
+    assert process_header(file_path, year) == HeaderResult(file_path, changed=False, found=False, skipped=True)
     assert _do_update_header.call_count == 0
 
 
-@mock.patch('unbeheader.headers._print_results')
 @pytest.mark.parametrize(('before_content', 'after_content'), (
     # Test that files with only header are kept empty
     ('''
@@ -177,16 +203,14 @@ def test_update_header_for_current_dir(_do_update_header, get_config, tmp_path):
         print('Beware of the knowledge you will gain.')
     '''),
 ))
-def test_do_update_header(_print_results, before_content, after_content, config, create_py_file, py_files_settings):
+def test_do_update_header(before_content, after_content, config, create_py_file, py_files_settings):
     content = dedent(before_content)[1:] # Remove indentation and leading newline
     file_path = create_py_file(content)
-    result = _do_update_header(file_path, config, check=False, **py_files_settings)
-    assert result is True
+    result = _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+    assert result == HeaderResult(file_path, changed=True, found=True, old_span=mock.ANY, new_span=mock.ANY)
     assert file_path.read_text() == dedent(after_content).lstrip()
-    _print_results.assert_called_once_with(file_path, found=True, check=False)
 
 
-@mock.patch('unbeheader.headers._print_results')
 @pytest.mark.parametrize(('before_content', 'after_content'), (
     # Test that header is added in file missing it
     ('''
@@ -212,14 +236,12 @@ def test_do_update_header(_print_results, before_content, after_content, config,
         print('Beware of the knowledge you will gain.')
     '''),
 ))
-def test_do_update_header_for_not_found(_print_results, before_content, after_content, config,
-                                        create_py_file, py_files_settings):
+def test_do_update_header_for_not_found(before_content, after_content, config, create_py_file, py_files_settings):
     content = dedent(before_content)[1:] # Remove indentation and leading newline
     file_path = create_py_file(content)
-    result = _do_update_header(file_path, config, check=False, **py_files_settings)
-    assert result is True
+    result = _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+    assert result == HeaderResult(file_path, changed=True, found=False, old_span=mock.ANY, new_span=mock.ANY)
     assert file_path.read_text() == dedent(after_content).lstrip()
-    _print_results.assert_called_once_with(file_path, found=False, check=False)
 
 
 def test_do_update_header_for_no_changes(config, create_py_file, py_files_settings):
@@ -230,11 +252,10 @@ def test_do_update_header_for_no_changes(config, create_py_file, py_files_settin
         print('Beware of the knowledge you will gain.')
     ''').lstrip()
     file_path = create_py_file(file_content)
-    result = _do_update_header(file_path, config, check=False, **py_files_settings)
-    assert result is False
+    result = _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+    assert result == HeaderResult(file_path, changed=False, found=True, old_span=mock.ANY, new_span=mock.ANY)
 
 
-@mock.patch('unbeheader.headers._print_results')
 @pytest.mark.parametrize(('file_content', 'header_found'), (
     ('''
         # This file is part of Thelema.
@@ -244,99 +265,320 @@ def test_do_update_header_for_no_changes(config, create_py_file, py_files_settin
         print('Beware of the knowledge you will gain.')
     ''', False),
 ))
-def test_do_update_header_for_check(_print_results, file_content, header_found, config,
-                                    create_py_file, py_files_settings):
+def test_do_update_header_for_check(file_content, header_found, config, create_py_file, py_files_settings):
     file_content = dedent(file_content).lstrip()
     file_path = create_py_file(file_content)
-    result = _do_update_header(file_path, config, check=True, **py_files_settings)
-    assert result is True
+    result = _do_update_header(file_path, HeaderConfig(config), check=True, **py_files_settings)
+    assert result == HeaderResult(file_path, changed=True, found=header_found, old_span=mock.ANY, new_span=mock.ANY)
     assert open(file_path).read() == file_content
-    _print_results.assert_called_once_with(file_path, found=header_found, check=True)
 
 
-def test_do_update_header_for_empty_file(create_py_file, py_files_settings):
+def test_do_update_header_for_empty_file(config, create_py_file, py_files_settings):
     file_path = create_py_file('')
-    result = _do_update_header(file_path, {}, check=False, **py_files_settings)
-    assert result is False
+    result = _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+    assert result == HeaderResult(file_path, changed=False, found=False)
 
 
-@pytest.mark.parametrize(('extension', 'expected'), (
-    ('py', '''
+@pytest.mark.parametrize('check', (True, False))
+@pytest.mark.parametrize(('file_content', 'old_header'), (
+    ('#!/usr/bin/env python\n# This file is part of Thelema.\n\nx = 1\n', '# This file is part of Thelema.'),
+    ('#!/usr/bin/env python\n\nx = 1\n', None),
+))
+def test_do_update_header_for_spans(file_content, old_header, check, config, create_py_file, py_files_settings):
+    file_path = create_py_file(file_content)
+    result = _do_update_header(file_path, HeaderConfig(config), check=check, **py_files_settings)
+    if old_header:
+        assert file_content[slice(*result.old_span)] == old_header
+    else:
+        assert result.old_span is None
+    shebang_end = len('#!/usr/bin/env python\n')
+    assert result.new_span == (shebang_end, shebang_end + len(HEADER.rstrip()))
+    if not check:
+        assert file_path.read_text()[slice(*result.new_span)] == HEADER.rstrip()
+
+
+@pytest.mark.parametrize('window', (
+    {'max_header_lines': 4},
+    {'max_header_bytes': 200},
+    {'max_header_lines': 4, 'max_header_bytes': 1000},
+))
+def test_do_update_header_for_window(window, config, create_py_file, py_files_settings):
+    body = "print('Beware of the knowledge you will gain.')\n" * 1000
+    file_path = create_py_file(dedent('''
         # This file is part of Thelema.
-        # Copyright (C) 1904 Ordo Templi Orientis
-    '''),
-    ('wsgi', '''
+        # Copyright (C) 1486 Ordo Templi Orientis
+
+    ''').lstrip() + body)
+    config |= window
+    with mock.patch('unbeheader.headers._update_content', wraps=_update_content) as update_content:
+        result = _do_update_header(file_path, HeaderConfig(config), check=True, **py_files_settings)
+        assert result == HeaderResult(file_path, changed=True, found=True, old_span=mock.ANY, new_span=mock.ANY)
+        result = _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+        assert result == HeaderResult(file_path, changed=True, found=True, old_span=mock.ANY, new_span=mock.ANY)
+        result = _do_update_header(file_path, HeaderConfig(config), check=True, **py_files_settings)
+        assert result == HeaderResult(file_path, changed=False, found=True, old_span=mock.ANY, new_span=mock.ANY)
+    assert all(len(call.args[0]) <= 1000 for call in update_content.call_args_list)
+    assert file_path.read_text() == dedent('''
         # This file is part of Thelema.
         # Copyright (C) 1904 Ordo Templi Orientis
-    '''),
-    ('js', '''
-        // This file is part of Thelema.
-        // Copyright (C) 1904 Ordo Templi Orientis
-    '''),
-    ('jsx', '''
-        // This file is part of Thelema.
-        // Copyright (C) 1904 Ordo Templi Orientis
-    '''),
-    ('css', '''
-        /* This file is part of Thelema.
-         * Copyright (C) 1904 Ordo Templi Orientis
-         */
-    '''),
-    ('scss', '''
-        // This file is part of Thelema.
-        // Copyright (C) 1904 Ordo Templi Orientis
-    '''),
-    ('sh', '''
+
+    ''').lstrip() + body
+
+
+@pytest.mark.parametrize('file_content', (
+    # Test that the header is found after the window
+    '''
+        print('Beware of the knowledge you will gain.')
         # This file is part of Thelema.
-        # Copyright (C) 1904 Ordo Templi Orientis
-    '''),
-))
-def test_generate_header(extension, expected, config):
-    data = asdict(SUPPORTED_FILE_TYPES[extension].comments) | config
-    header = _generate_header(data)
-    assert header == dedent(expected).lstrip()
-
-
-def test_generate_header_for_different_end_year(config):
-    end_year = date.today().year
-    config['end_year'] = end_year
-    data = asdict(SUPPORTED_FILE_TYPES['py'].comments) | config
-    header = _generate_header(data)
-    assert header == dedent(f'''
+        # Copyright (C) 1486 Ordo Templi Orientis
+    ''',
+    # Test that the header is not truncated by the window
+    '''
         # This file is part of Thelema.
-        # Copyright (C) 1904 - {end_year} Ordo Templi Orientis
-    '''.format(end_year)).lstrip()
-
+        # Copyright (C) 1486 Ordo Templi Orientis
+        # Do what thou wilt shall be the whole of the Law.
 
-@pytest.mark.parametrize('template', (
-    '{root}', '{template}', '{substring}'
+        print('Beware of the knowledge you will gain.')
+    ''',
+))
+def test_do_update_header_for_window_fallback(file_content, config, create_py_file, py_files_settings):
+    file_path = create_py_file(dedent(file_content).lstrip())
+    expected = _do_update_header(file_path, HeaderConfig(config), check=True, **py_files_settings)
+    config['max_header_lines'] = 2
+    result = _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+    assert result == expected == HeaderResult(file_path, changed=True, found=True, old_span=mock.ANY, new_span=mock.ANY)
+    assert '1486' not in file_path.read_text()
+    assert 'Do what thou wilt' not in file_path.read_text()
+
+
+@pytest.mark.parametrize('leading_content', ('', '\n\n\n'))
+def test_do_update_header_for_window_without_header(leading_content, config, create_py_file, py_files_settings):
+    body = "print('Beware of the knowledge you will gain.')\n" * 1000
+    file_path = create_py_file(leading_content + body)
+    config['max_header_lines'] = 4
+    with mock.patch('unbeheader.headers._update_content', wraps=_update_content) as update_content:
+        result = _do_update_header(file_path, HeaderConfig(config), check=True, **py_files_settings)
+    # The header is reported missing from the window alone, without reading the whole file
+    assert result == HeaderResult(file_path, changed=True, found=False, old_span=None, new_span=mock.ANY)
+    assert update_content.call_count == 1
+    assert update_content.call_args.args[0].count(b'\n') == 4
+    result = _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+    assert result == HeaderResult(file_path, changed=True, found=False, old_span=None, new_span=mock.ANY)
+    assert file_path.read_text() == HEADER + '\n' + body
+
+
+HEADER = '# This file is part of Thelema.\n# Copyright (C) 1904 Ordo Templi Orientis\n'
+BODY = "print('Beware of the knowledge you will gain.')\n"
+
+
+@pytest.mark.parametrize(('file_content', 'expected'), (
+    (f'{HEADER}\n{BODY}', True),
+    (f'#!/usr/bin/env python\n{HEADER}\n{BODY}', True),
+    (f'{HEADER}\n# Do what thou wilt\n{BODY}', True),
+    (f'{HEADER}\n', False),
+    (f'{HEADER}{BODY}', False),
+    (f'{HEADER}\n\n{BODY}', False),
+    (f'#!/usr/bin/env python\n\n{HEADER}\n{BODY}', False),
+    (f'{HEADER}\n{BODY}{HEADER}', False),
+    (f'{BODY}{HEADER}\n{BODY}', False),
 ))
-def test_generate_header_for_invalid_placeholder(template, config):
-    data = asdict(SUPPORTED_FILE_TYPES['py'].comments) | config
-    data['template'] = template
-    with pytest.raises(SystemExit) as exc:
-        _generate_header(data)
-    assert exc.value.code == 1
-
-
-@pytest.mark.parametrize(('found', 'check', 'expected'), (
-    (True, True, 'Incorrect header'),
-    (True, False, 'Updating header'),
-    (False, True, 'Missing header'),
-    (False, False, 'Adding header'),
+def test_match_header(file_content, expected, config, py_files_settings):
+    config = HeaderConfig(config)
+    file_content = file_content.encode()
+    span = _match_header(file_content, config, newline=b'\n', **py_files_settings)
+    assert (span is not None) == expected
+    result = _update_content(file_content, config, **py_files_settings)
+    with mock.patch('unbeheader.headers._match_header', return_value=None):
+        assert result == _update_content(file_content, config, **py_files_settings)
+    if expected:
+        assert (result.head, result.body_start) == (b'', 0)
+        assert result.found
+        assert result.old_span == result.new_span == span
+        assert file_content[span[0]:span[1]] == HEADER.rstrip().encode()
+
+
+@pytest.mark.parametrize(('ext', 'template', 'file_content', 'expected'), (
+    ('py', '{comment_start} This file is part of Thelema.', '# This file is part of Thelema.\n# Do what\n', False),
+    ('py', '{comment_start} This file is part of Thelema.', '# This file is part of Thelema.\n\n# Do what\n', True),
+    ('js', '{comment_start} This file is part of Thelema.', '// This file is part of Thelema.\n// Do what\n', False),
+    ('js', '{comment_start} This file is part of Thelema.', '// This file is part of Thelema.\n\n/* Do */\n', True),
+    ('css', '{comment_start}\n{comment_middle} This file is part of Thelema.\n{comment_end}',
+     '/*\n * This file is part of Thelema.\n */\n\n/* Do */\n', True),
+    # Test that headers made of several comments are never skipped
+    ('py', '{comment_start} This file is part of Thelema.\n\n# Do what\n',
+     '# This file is part of Thelema.\n\n# Do what\n\nx = 1\n', False),
 ))
-def test_print_results(found, check, expected, monkeypatch, tmp_path, capsys):
-    monkeypatch.delenv('CI', raising=False)
-    _print_results(tmp_path, found, check)
-    captured = capsys.readouterr()
-    assert expected in captured.out
-    assert COLOR_RESET in captured.out
-
-@pytest.mark.parametrize(('envvar'), (
-    ('1'), ('true'),
+def test_match_header_for_templates(ext, template, file_content, expected, config):
+    config = HeaderConfig(config | {'template': template})
+    settings = {'scanner': SUPPORTED_FILE_TYPES[ext].scanner, 'comments': SUPPORTED_FILE_TYPES[ext].comments}
+    file_content = file_content.encode()
+    assert (_match_header(file_content, config, newline=b'\n', **settings) is not None) == expected
+    result = _update_content(file_content, config, **settings)
+    with mock.patch('unbeheader.headers._match_header', return_value=None):
+        assert result == _update_content(file_content, config, **settings)
+
+
+OLD_HEADER = '# This file is part of Thelema.\n# Copyright (C) 1486 Ordo Templi Orientis\n'
+
+
+@pytest.mark.parametrize(('file_content', 'expected', 'old_start', 'new_start'), (
+    # Test that every header is updated
+    (f'{OLD_HEADER}\n{BODY}\n{OLD_HEADER}\n{BODY}', f'{HEADER}\n{BODY}\n{HEADER}\n{BODY}', 0, len(HEADER + BODY) + 2),
+    # Test that the line break before a header after the code is kept
+    (f'{BODY}{OLD_HEADER}\n{BODY}', f'{BODY}{HEADER}\n{BODY}', len(BODY), len(BODY)),
+    # Test that a shebang line without a line break gets one
+    ('#!/usr/bin/env python', f'#!/usr/bin/env python\n{HEADER}\n', None, len('#!/usr/bin/env python\n')),
 ))
-def test_print_results_for_ci(envvar, monkeypatch, tmp_path, capsys):
-    monkeypatch.setenv('CI', envvar)
-    _print_results(tmp_path, True, True)
-    captured = capsys.readouterr()
-    assert COLOR_RESET not in captured.out
+def test_update_content(file_content, expected, old_start, new_start, config, py_files_settings):
+    file_content = file_content.encode()
+    result = _update_content(file_content, HeaderConfig(config), **py_files_settings)
+    assert result.head + file_content[result.body_start:] == expected.encode()
+    assert result.found == (old_start is not None)
+    assert result.old_span == ((old_start, old_start + len(OLD_HEADER.rstrip())) if old_start is not None else None)
+    assert result.new_span == (new_start, new_start + len(HEADER.rstrip()))
+
+
+def test_update_content_for_no_changes(config, py_files_settings):
+    file_content = f'{HEADER}\n{BODY}{HEADER}\n{BODY}'.encode()
+    with mock.patch('unbeheader.headers._match_header', return_value=None):
+        result = _update_content(file_content, HeaderConfig(config), **py_files_settings)
+    # Nothing is copied from the original content
+    assert (result.head, result.body_start) == (b'', 0)
+
+
+def test_update_content_for_head(config, py_files_settings):
+    file_content = f'{OLD_HEADER}\n\n{BODY * 100}'.encode()
+    result = _update_content(file_content, HeaderConfig(config), **py_files_settings)
+    # Only the content up to the end of the header is assembled, the rest is kept as it is
+    assert result.head == f'{HEADER}\n'.encode()
+    assert result.body_start == len(f'{OLD_HEADER}\n\n')
+
+
+@pytest.mark.parametrize(('before_content', 'after_content', 'found'), (
+    # Test that line endings are preserved
+    (b'# This file is part of Thelema.\r\n# Copyright (C) 1486 Ordo Templi Orientis\r\n\r\nx = 1\r\n',
+     b'# This file is part of Thelema.\r\n# Copyright (C) 1904 Ordo Templi Orientis\r\n\r\nx = 1\r\n', True),
+    (b'#!/usr/bin/env python\r\nx = 1\r\n',
+     b'#!/usr/bin/env python\r\n# This file is part of Thelema.\r\n# Copyright (C) 1904 Ordo Templi Orientis\r\n'
+     b'\r\nx = 1\r\n', False),
+    # Test that content in other encodings is kept as it is
+    (b'# This file is part of Thelema.\n\nprint("\xc6on")\n',
+     b'# This file is part of Thelema.\n# Copyright (C) 1904 Ordo Templi Orientis\n\nprint("\xc6on")\n', True),
+))
+def test_do_update_header_for_bytes(before_content, after_content, found, config, tmp_path, py_files_settings):
+    file_path = tmp_path / 'manuscript.py'
+    file_path.write_bytes(before_content)
+    result = _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+    assert result == HeaderResult(file_path, changed=True, found=found, old_span=mock.ANY, new_span=mock.ANY)
+    assert file_path.read_bytes() == after_content
+    result = _do_update_header(file_path, HeaderConfig(config), check=True, **py_files_settings)
+    assert result == HeaderResult(file_path, changed=False, found=True, old_span=mock.ANY, new_span=mock.ANY)
+
+
+@mock.patch('unbeheader.headers.MMAP_MIN_SIZE', 0)
+@pytest.mark.parametrize(('file_content', 'changed'), (
+    (f'{HEADER}\n{BODY}', False),
+    (f'{HEADER}{BODY}', True),
+))
+def test_do_update_header_for_mmap(file_content, changed, config, create_py_file, py_files_settings):
+    file_path = create_py_file(file_content)
+    with mock.patch('unbeheader.headers._update_content', wraps=_update_content) as update_content:
+        result = _do_update_header(file_path, HeaderConfig(config), check=True, **py_files_settings)
+    assert result == HeaderResult(file_path, changed=changed, found=True, old_span=mock.ANY, new_span=mock.ANY)
+    assert update_content.called == changed
+
+
+def test_do_update_header_keeps_permissions(config, create_py_file, py_files_settings):
+    file_path = create_py_file(BODY)
+    file_path.chmod(0o750)
+    _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+    assert file_path.stat().st_mode & 0o777 == 0o750
+    assert file_path.read_text() == f'{HEADER}\n{BODY}'
+    assert os.listdir(file_path.parent) == [file_path.name]
+
+
+def test_do_update_header_for_read_only_file(config, create_py_file, py_files_settings):
+    file_path = create_py_file(BODY)
+    file_path.chmod(0o440)
+    # The permissions are not enforced when running as root
+    with mock.patch('unbeheader.headers.os.access', return_value=False), pytest.raises(PermissionError):
+        _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+    assert file_path.read_text() == BODY
+    assert os.listdir(file_path.parent) == [file_path.name]
+
+
+def test_do_update_header_for_durability(config, create_py_file, py_files_settings):
+    file_path = create_py_file(BODY)
+    calls = mock.Mock(fsync=mock.Mock(wraps=os.fsync), replace=mock.Mock(wraps=os.replace))
+    with (mock.patch('unbeheader.headers.os.fsync', calls.fsync),
+          mock.patch('unbeheader.headers.os.replace', calls.replace)):
+        _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+    # The new file is on disk before it replaces the original one
+    assert [name for name, *__ in calls.mock_calls] == ['fsync', 'replace']
+    assert file_path.read_text() == f'{HEADER}\n{BODY}'
+
+
+def test_do_update_header_for_symlink(config, create_py_file, py_files_settings):
+    target_path = create_py_file(BODY)
+    file_path = target_path.with_name('link.py')
+    file_path.symlink_to(target_path)
+    _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+    assert file_path.is_symlink()
+    assert target_path.read_text() == f'{HEADER}\n{BODY}'
+
+
+@mock.patch('unbeheader.headers.os.replace', side_effect=KeyboardInterrupt)
+def test_do_update_header_for_interruption(replace, config, create_py_file, py_files_settings):
+    file_path = create_py_file(BODY)
+    with pytest.raises(KeyboardInterrupt):
+        _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+    assert file_path.read_text() == BODY
+    assert os.listdir(file_path.parent) == [file_path.name]
+
+
+@mock.patch('unbeheader.headers.COPY_CHUNK_SIZE', 100)
+@pytest.mark.parametrize('window', ({}, {'max_header_lines': 4}))
+def test_do_update_header_for_copy(window, config, create_py_file, py_files_settings):
+    file_path = create_py_file(f'{HEADER.replace("1904", "1486 - 1492")}\n' + BODY * 100)
+    with (mock.patch('shutil.copyfileobj', wraps=shutil.copyfileobj) as copyfileobj,
+          mock.patch('unbeheader.headers._replace_file', wraps=_replace_file) as replace_file):
+        _do_update_header(file_path, HeaderConfig(config | window), check=False, **py_files_settings)
+    # Only the header is written at once, the rest of the file is copied in chunks
+    replace_file.assert_called_once_with(file_path, f'{HEADER}\n'.encode(), mock.ANY, mock.ANY)
+    copyfileobj.assert_called_once_with(mock.ANY, mock.ANY, 100)
+    assert file_path.read_text() == f'{HEADER}\n' + BODY * 100
+
+
+@pytest.mark.parametrize('window', ({}, {'max_header_lines': 4}))
+def test_do_update_header_for_same_length(window, config, create_py_file, py_files_settings):
+    file_path = create_py_file(f'{HEADER.replace("1904", "1486")}\n' + BODY * 100)
+    inode = file_path.stat().st_ino
+    with (mock.patch('unbeheader.headers._replace_file') as replace_file,
+          mock.patch('unbeheader.headers.os.pwrite', wraps=os.pwrite) as pwrite):
+        result = _do_update_header(file_path, HeaderConfig(config | window), check=False, **py_files_settings)
+    assert result == HeaderResult(file_path, changed=True, found=True, old_span=mock.ANY, new_span=mock.ANY)
+    replace_file.assert_not_called()
+    pwrite.assert_called_once_with(mock.ANY, b'904', HEADER.index('904'))
+    assert file_path.stat().st_ino == inode
+    assert file_path.read_text() == f'{HEADER}\n' + BODY * 100
+
+
+@mock.patch('unbeheader.headers.PATCH_MAX_SIZE', 2)
+def test_do_update_header_for_same_length_over_limit(config, create_py_file, py_files_settings):
+    file_path = create_py_file(f'{HEADER.replace("1904", "1486")}\n{BODY}')
+    with mock.patch('unbeheader.headers._patch_file') as patch_file:
+        _do_update_header(file_path, HeaderConfig(config), check=False, **py_files_settings)
+    patch_file.assert_not_called()
+    assert file_path.read_text() == f'{HEADER}\n{BODY}'
+
+
+@pytest.mark.parametrize(('orig_content', 'content', 'expected'), (
+    (b'abc', b'abd', (2, 3)),
+    (b'abc', b'xbc', (0, 1)),
+    (b'abcdef', b'axcdxf', (1, 5)),
+    (b'a' * 1000 + b'b' + b'a' * 1000, b'a' * 2001, (1000, 1001)),
+    (b'a' * 1000, b'b' * 1000, (0, 1000)),
+))
+def test_find_changed_range(orig_content, content, expected):
+    assert _find_changed_range(orig_content, content) == expected
+
@@ -0,0 +1,105 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+import io
+import json
+from pathlib import Path
+from unittest import mock
+
+import pytest
+from colorclass import Color
+
+from unbeheader.report import JsonLinesReporter
+from unbeheader.report import JsonReporter
+from unbeheader.report import Reporter
+from unbeheader.typing import HeaderResult
+
+
+@pytest.fixture(autouse=True)
+def no_colors(monkeypatch):
+    monkeypatch.setenv('CI', '1')
+
+
+def test_reporter_for_single_write():
+    stream = mock.Mock(wraps=io.StringIO())
+    reporter = Reporter(check=False, stream=stream)
+    assert reporter.report([
+        HeaderResult(Path('manuscript_b.py'), changed=True, found=True),
+        HeaderResult(Path('manuscript_c.py'), changed=False, found=True),
+        HeaderResult(Path('manuscript_a.py'), changed=True, found=False),
+    ])
+    stream.write.assert_called_once_with('Adding header in manuscript_a.py\nUpdating header in manuscript_b.py\n')
+
+
+@pytest.mark.parametrize(('check', 'results', 'expected'), (
+    (False, [], '✅ All headers are up to date\n'),
+    (False, [HeaderResult(Path('manuscript.py'), changed=False, found=True)], '✅ All headers are up to date\n'),
+    (False, [HeaderResult(Path('manuscript.py'), changed=True, found=True)], '🔄 Some headers have been updated\n'),
+    (True, [HeaderResult(Path('manuscript.py'), changed=True, found=False)],
+     '❌ Some headers need to be added or updated\n'),
+))
+def test_reporter_for_summary(check, results, expected):
+    stream = io.StringIO()
+    reporter = Reporter(check, quiet=True, stream=stream)
+    reporter.report(results)
+    reporter.finish()
+    assert stream.getvalue() == expected
+
+
+def test_reporter_for_errors(capsys):
+    reporter = Reporter(check=True, stream=io.StringIO())
+    results = [HeaderResult(Path('manuscript.py'), changed=False, found=False, error=ValueError('The Abyss'))]
+    with pytest.raises(ValueError, match='The Abyss'):
+        reporter.report(results)
+    assert not reporter.report(results, keep_going=True)
+    assert capsys.readouterr().err == 'manuscript.py: The Abyss\n'
+
+
+@pytest.mark.parametrize('reporter_class', (Reporter, JsonLinesReporter))
+def test_reporter_for_results_before_error(reporter_class):
+    stream = io.StringIO()
+    reporter = reporter_class(check=False, stream=stream)
+    with pytest.raises(ValueError, match='The Abyss'):
+        reporter.report([
+            HeaderResult(Path('manuscript.py'), changed=True, found=True),
+            HeaderResult(Path('grimoire.py'), changed=False, found=False, error=ValueError('The Abyss')),
+            HeaderResult(Path('liber.py'), changed=True, found=True),
+        ])
+    # The file updated before the error is reported, the ones after it were not processed
+    assert 'manuscript.py' in stream.getvalue()
+    assert 'liber.py' not in stream.getvalue()
+
+
+@pytest.mark.parametrize('reporter_class', (JsonReporter, JsonLinesReporter))
+def test_json_reporter_for_skipped_results(reporter_class):
+    stream = io.StringIO()
+    reporter = reporter_class(check=False, stream=stream)
+    reporter.start('Updating headers...')
+    assert reporter.report([
+        HeaderResult(Path('manuscript.py'), changed=True, found=True, old_span=(0, 10), new_span=(0, 12)),
+        HeaderResult(Path('excluded.py'), changed=False, found=False, skipped=True),
+    ])
+    reporter.finish()
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1
+    result = {'path': 'manuscript.py', 'status': 'updated', 'found': True, 'old_span': [0, 10], 'new_span': [0, 12],
+              'error': None}
+    if reporter_class is JsonReporter:
+        summary = {'ok': 0, 'updated': 1, 'added': 0, 'skipped': 1, 'failed': 0}
+        assert json.loads(lines[0]) == {'check': False, 'results': [result], 'summary': summary}
+    else:
+        assert json.loads(lines[0]) == result
+
+
+@pytest.mark.parametrize(('found', 'check', 'expected'), (
+    (True, True, 'Incorrect header'),
+    (True, False, 'Updating header'),
+    (False, True, 'Missing header'),
+    (False, False, 'Adding header'),
+))
+def test_reporter_for_colors(found, check, expected, monkeypatch):
+    monkeypatch.delenv('CI')
+    stream = io.StringIO()
+    Reporter(check, stream=stream).report([HeaderResult(Path('manuscript.py'), changed=True, found=found)])
+    assert expected in stream.getvalue()
+    assert Color('{/all}') in stream.getvalue()
@@ -0,0 +1,114 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+import mmap
+import random
+import re
+import time
+
+import pytest
+
+from unbeheader.scanner import HeaderScanner
+
+# The regular expressions which were used to find headers before the scanners
+HASH_LINE_REGEX = re.compile(r'((^#|[\r\n]#).*)*')
+SLASH_LINE_REGEX = re.compile(r'/\*(.|[\r\n])*?\*/|((^//|[\r\n]//).*)*')
+BLOCK_REGEX = re.compile(r'/\*(.|[\r\n])*?\*/')
+
+SCANNERS = (
+    (HeaderScanner(line_comment='#'), HASH_LINE_REGEX),
+    (HeaderScanner(line_comment='//', block_comment=('/*', '*/')), SLASH_LINE_REGEX),
+    (HeaderScanner(block_comment=('/*', '*/')), BLOCK_REGEX),
+)
+
+
+def _find_with_regex(regex, content):
+    return [match.span() for match in regex.finditer(content) if match.group()]
+
+
+@pytest.mark.parametrize(('content', 'expected'), (
+    ('', []),
+    ('foo\n', []),
+    ('# foo', [(0, 5)]),
+    ('# foo\n# bar\nbaz\n', [(0, 11)]),
+    ('\n# foo\n', [(0, 6)]),
+    ('foo\n# bar\n\n# baz', [(3, 9), (10, 16)]),
+    ('foo # bar\n', []),
+    ('foo\r# bar\r\n# baz\n', [(3, 16)]),
+))
+def test_scanner_line_comments(content, expected):
+    scanner = HeaderScanner(line_comment='#')
+    assert list(scanner.finditer(content)) == expected
+
+
+@pytest.mark.parametrize(('content', 'expected'), (
+    ('/* foo */', [(0, 9)]),
+    ('/* foo\n * bar\n */\nbaz', [(0, 17)]),
+    ('foo /* bar */ /* baz */', [(4, 13), (14, 23)]),
+    ('/* foo */ /* bar', [(0, 9)]),
+    ('/* foo', []),
+    ('// foo\n/* bar */', [(0, 6), (7, 16)]),
+    ('// foo /* bar\n*/', [(0, 13)]),
+    ('/* foo\n// bar */\n// baz', [(0, 16), (16, 23)]),
+))
+def test_scanner_block_comments(content, expected):
+    scanner = HeaderScanner(line_comment='//', block_comment=('/*', '*/'))
+    assert list(scanner.finditer(content)) == expected
+
+
+@pytest.mark.parametrize(('content', 'pos', 'expected'), (
+    ('#!/bin/sh\n# foo\n', 10, [(10, 15)]),
+    ('#!/bin/sh\n\n# foo\n', 10, [(10, 16)]),
+    ('# foo\n# bar\n', 3, [(5, 11)]),
+    ('# foo\n', 6, []),
+))
+def test_scanner_for_pos(content, pos, expected):
+    scanner = HeaderScanner(line_comment='#')
+    assert list(scanner.finditer(content, pos)) == expected
+    assert list(scanner.finditer(content.encode(), pos)) == expected
+
+
+@pytest.mark.parametrize(('scanner', 'regex'), SCANNERS)
+def test_scanner_matches_regex(scanner, regex):
+    rng = random.Random(42)
+    alphabet = ('#', '/', '*', '\n', '\r', ' ', 'a')
+    for __ in range(5000):
+        content = ''.join(rng.choices(alphabet, k=rng.randrange(30)))
+        expected = _find_with_regex(regex, content)
+        assert list(scanner.finditer(content)) == expected, repr(content)
+        assert list(scanner.finditer(content.encode())) == expected, repr(content)
+
+
+@pytest.mark.parametrize(('scanner', 'regex'), SCANNERS)
+def test_scanner_for_mmap(scanner, regex, tmp_path):
+    content = '#!/bin/sh\n# foo\r\n# bar\n/* baz\n */\n// qux\n'
+    file_path = tmp_path / 'manuscript'
+    file_path.write_text(content)
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        assert list(scanner.finditer(mapped)) == _find_with_regex(regex, content)
+
+
+@pytest.mark.parametrize(('scanner', 'regex'), SCANNERS)
+def test_scanner_matches_regex_on_sources(scanner, regex):
+    content = '\n'.join((
+        '#!/usr/bin/env python',
+        '# This file is part of Thelema.',
+        '# Copyright (C) 1904 Aleister Crowley',
+        '',
+        '/*',
+        ' * Do what thou wilt',
+        ' */',
+        'const path = "/*"; // not a comment start',
+        '// shall be the whole of the Law',
+        'print("# not a comment")',
+    ))
+    assert list(scanner.finditer(content)) == _find_with_regex(regex, content)
+
+
+def test_scanner_unterminated_block_comments():
+    scanner = HeaderScanner(line_comment='//', block_comment=('/*', '*/'))
+    content = 'var s = "/*";\n' * 50_000 + '// foo'
+    start_time = time.perf_counter()
+    assert list(scanner.finditer(content)) == [(len(content) - 7, len(content))]
+    # the regex takes minutes on this, anything linear is well below a second
+    assert time.perf_counter() - start_time < 1
@@ -0,0 +1,53 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import unbeheader
+from unbeheader.config import CONFIG_FILE_NAME
+
+# The modules which take a while to import, and must only be imported once they are needed
+LAZY_MODULES = ('asyncio', 'colorclass', 'concurrent.futures', 'ctypes', 'dataclasses', 'hashlib',
+                'importlib.metadata', 'shutil', 'subprocess', 'tempfile', 'yaml')
+
+# The maximum time in milliseconds spent importing the command line interface, besides click
+STARTUP_BUDGET = 150
+
+
+def _run_python(*args, cwd=None):
+    env = os.environ | {'PYTHONPATH': str(Path(unbeheader.__file__).parent.parent)}
+    return subprocess.run([sys.executable, *args], cwd=cwd, env=env, capture_output=True, text=True, check=True)
+
+
+def _get_imported_modules(code, cwd=None):
+    code += '\nimport sys\nprint(*sys.modules)'
+    return set(_run_python('-c', code, cwd=cwd).stdout.split())
+
+
+def test_import_for_lazy_modules():
+    modules = _get_imported_modules('import unbeheader.cli')
+    assert not modules.intersection(LAZY_MODULES)
+
+
+def test_check_file_for_lazy_modules(tmp_path):
+    config = "owner: Crowley\ntemplate: '{comment_start} This file is part of Thelema.'\n"
+    (tmp_path / CONFIG_FILE_NAME).write_text(config)
+    (tmp_path / 'manuscript.py').write_text('# This file is part of Thelema.\n\nx = 1\n')
+    code = 'from unbeheader.cli import main\nmain(["--check", "manuscript.py"], standalone_mode=False)'
+    modules = _get_imported_modules(code, cwd=tmp_path)
+    # Reading the configuration is needed, processing files in parallel is not
+    assert 'yaml' in modules
+    assert not modules.intersection({'asyncio', 'concurrent.futures', 'shutil', 'subprocess', 'tempfile'})
+
+
+def test_import_for_startup_budget():
+    timings = []
+    for __ in range(3):
+        # Every line reports the time spent importing a module in microseconds, including its own imports
+        lines = _run_python('-X', 'importtime', '-c', 'import unbeheader.cli').stderr.splitlines()
+        cumulative = {line.split('|')[2].strip(): int(line.split('|')[1]) for line in lines[1:]}
+        timings.append((cumulative['unbeheader.cli'] - cumulative['click']) / 1000)
+    assert min(timings) < STARTUP_BUDGET
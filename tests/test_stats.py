@@ -0,0 +1,72 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+import pytest
+
+from unbeheader import stats
+from unbeheader.config import CONFIG_FILE_NAME
+from unbeheader.engine import process_files
+from unbeheader.stats import Stats
+
+
+@pytest.fixture
+def run_stats():
+    yield stats.enable()
+    stats.disable()
+
+
+def test_phase(run_stats):
+    with stats.phase('read'):
+        pass
+    with stats.phase('read'):
+        pass
+    assert run_stats.calls == {'read': 2}
+    assert run_stats.times['read'] > 0
+    assert run_stats.events is None
+
+
+def test_phase_for_disabled():
+    assert stats.get_stats() is None
+    assert stats.phase('read') is stats.phase('write')
+    with stats.phase('read'):
+        stats.count('files')
+    items = [1, 2]
+    assert list(stats.timed_iter('discovery', items)) == items
+
+
+def test_timed_iter(run_stats):
+    assert list(stats.timed_iter('discovery', iter([1, 2, 3]))) == [1, 2, 3]
+    # Finding out that there are no more items is timed as well
+    assert run_stats.calls['discovery'] == 4
+
+
+def test_drain_and_merge():
+    worker_stats = Stats(trace=True)
+    with stats._Phase(worker_stats, 'match'):
+        worker_stats.counts['files'] += 1
+    drained = worker_stats.drain()
+    assert (worker_stats.calls, worker_stats.counts, worker_stats.events) == ({}, {}, [])
+    main_stats = Stats(trace=True)
+    main_stats.counts['files'] += 1
+    main_stats.merge(drained)
+    main_stats.merge(drained)
+    assert main_stats.calls == {'match': 2}
+    assert main_stats.counts == {'files': 3}
+    assert [event['name'] for event in main_stats.to_trace()['traceEvents']] == ['match', 'match']
+
+
+def test_to_dict(run_stats, tmp_path):
+    config = "owner: Crowley\ntemplate: '{comment_start} This file is part of Thelema.'\n"
+    (tmp_path / CONFIG_FILE_NAME).write_text(config)
+    file_paths = [tmp_path / f'manuscript_{i}.py' for i in range(3)]
+    for file_path in file_paths:
+        file_path.write_text('x = 1\n')
+    list(process_files(file_paths, 1947, check=False))
+    data = run_stats.to_dict()
+    assert list(data['phases']) == ['config', 'read', 'match', 'render', 'write']
+    assert data['phases']['write']['calls'] == 3
+    assert data['counts']['files'] == 3
+    assert data['counts']['bytes_read'] == 3 * len('x = 1\n')
+    assert data['counts']['bytes_written'] == 3 * len('# This file is part of Thelema.\n\nx = 1\n')
+    assert data['hit_rates'] == {'config': 2 / 3}
+    assert 'config hit rate' in run_stats.format()
@@ -1,12 +1,21 @@
 # This file is part of Unbeheader.
 # Copyright (C) CERN & UNCONVENTIONAL
 
+import os
+from pathlib import Path
+from unittest import mock
+
 import pytest
 from colorclass import Color
 
+from unbeheader.exceptions import ConfigError
+from unbeheader.filetypes import DEFAULT_FILE_TYPES
+from unbeheader.filetypes import compile_file_types
 from unbeheader.util import EXCLUDE_FILE_NAME
+from unbeheader.util import ExclusionIndex
 from unbeheader.util import cformat
-from unbeheader.util import is_excluded
+from unbeheader.util import is_supported
+from unbeheader.util import walk_files
 
 
 @pytest.mark.parametrize(('string', 'expected'), (
@@ -22,16 +31,116 @@ def test_cformat(string, expected):
     assert cformat(string) == expected
 
 
-def test_is_excluded(tmp_path):
-    assert is_excluded(tmp_path, tmp_path) is False
-    file_path = tmp_path / EXCLUDE_FILE_NAME
-    file_path.touch()
-    assert is_excluded(tmp_path, tmp_path) is True
+def test_exclusion_index(tmp_path):
+    excluded_dir_path = tmp_path / 'secrets'
+    nested_dir_path = excluded_dir_path / 'nested'
+    nested_dir_path.mkdir(parents=True)
+    (excluded_dir_path / EXCLUDE_FILE_NAME).touch()
+    exclusions = ExclusionIndex(tmp_path)
+    assert exclusions.is_excluded(tmp_path) is False
+    assert exclusions.is_excluded(excluded_dir_path) is True
+    assert exclusions.is_excluded(nested_dir_path) is True
+
+
+def _get_default_file_types(dir_path):
+    return DEFAULT_FILE_TYPES
 
 
-def test_is_excluded_for_nested(tmp_path):
+def test_exclusion_index_for_root(tmp_path):
+    exclusions = ExclusionIndex(tmp_path)
+    assert exclusions.is_excluded(tmp_path) is False
+    (tmp_path / EXCLUDE_FILE_NAME).touch()
+    assert exclusions.is_excluded(tmp_path) is False
+    exclusions.invalidate(tmp_path)
+    assert exclusions.is_excluded(tmp_path) is True
+
+
+def test_exclusion_index_for_outside_root(tmp_path):
     nested_dir_path = tmp_path / 'nested'
     nested_dir_path.mkdir()
-    file_path = tmp_path / EXCLUDE_FILE_NAME
+    (tmp_path / EXCLUDE_FILE_NAME).touch()
+    exclusions = ExclusionIndex(nested_dir_path)
+    assert exclusions.is_excluded(nested_dir_path) is False
+    assert exclusions.is_excluded(tmp_path) is False
+
+
+def test_exclusion_index_for_cached_lookups(tmp_path):
+    nested_dir_path = tmp_path / 'a' / 'b' / 'c'
+    nested_dir_path.mkdir(parents=True)
+    exclusions = ExclusionIndex(tmp_path)
+    with mock.patch.object(Path, 'exists', autospec=True, side_effect=Path.exists) as exists:
+        assert exclusions.is_excluded(nested_dir_path) is False
+        assert exists.call_count == 4
+        assert exclusions.is_excluded(nested_dir_path) is False
+        assert exclusions.is_excluded(nested_dir_path.parent) is False
+        assert exists.call_count == 4
+
+
+def test_walk_files(tmp_path):
+    nested_dir_path = tmp_path / 'nested'
+    nested_dir_path.mkdir()
+    file_paths = {tmp_path / 'manuscript.py', nested_dir_path / 'grimoire.js'}
+    for file_path in file_paths:
+        file_path.touch()
+    (tmp_path / 'notes.txt').touch()
+    (tmp_path / '.hidden.py').touch()
+    (tmp_path / 'py').touch()
+    assert set(walk_files(tmp_path, _get_default_file_types)) == file_paths
+
+
+def test_walk_files_for_pruned_directories(tmp_path):
+    excluded_dir_path = tmp_path / 'secrets'
+    vcs_dir_path = tmp_path / '.git'
+    for dir_path in (excluded_dir_path / 'nested', vcs_dir_path):
+        dir_path.mkdir(parents=True)
+    (excluded_dir_path / EXCLUDE_FILE_NAME).touch()
+    (excluded_dir_path / 'manuscript.py').touch()
+    (excluded_dir_path / 'nested' / 'manuscript.py').touch()
+    (vcs_dir_path / 'hook.py').touch()
+    file_path = tmp_path / 'manuscript.py'
     file_path.touch()
-    assert is_excluded(nested_dir_path, tmp_path) is True
+    with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+        assert list(walk_files(tmp_path, _get_default_file_types)) == [file_path]
+    assert scandir.call_count == 2
+
+
+def test_walk_files_for_excluded_root(tmp_path):
+    (tmp_path / EXCLUDE_FILE_NAME).touch()
+    (tmp_path / 'manuscript.py').touch()
+    assert list(walk_files(tmp_path, _get_default_file_types)) == []
+
+
+def test_walk_files_for_nested_file_types(tmp_path):
+    nested_dir_path = tmp_path / 'nested'
+    nested_dir_path.mkdir()
+    (tmp_path / 'manuscript.go').touch()
+    (nested_dir_path / 'grimoire.go').touch()
+    go_file_types = compile_file_types([{'extensions': ['go'], 'comment_start': '//', 'comment_middle': '//'}])
+
+    def _get_file_types(dir_path):
+        return go_file_types if dir_path == nested_dir_path else DEFAULT_FILE_TYPES
+
+    assert list(walk_files(tmp_path, _get_file_types)) == [nested_dir_path / 'grimoire.go']
+
+
+def test_walk_files_for_invalid_file_types(tmp_path):
+    (tmp_path / 'manuscript.go').touch()
+    (tmp_path / 'notes.txt').touch()
+    (tmp_path / '.hidden.py').touch()
+
+    def _get_file_types(dir_path):
+        raise ConfigError('Invalid file types')
+
+    # The files are still yielded so that the error gets reported for each of them
+    assert set(walk_files(tmp_path, _get_file_types)) == {tmp_path / 'manuscript.go', tmp_path / 'notes.txt'}
+
+
+@pytest.mark.parametrize(('name', 'file_types', 'expected'), (
+    ('manuscript.py', DEFAULT_FILE_TYPES, True),
+    ('manuscript.go', DEFAULT_FILE_TYPES, False),
+    ('.manuscript.py', DEFAULT_FILE_TYPES, False),
+    ('manuscript.go', None, True),
+    ('.manuscript.go', None, False),
+))
+def test_is_supported(name, file_types, expected):
+    assert is_supported(name, file_types) is expected
@@ -0,0 +1,97 @@
+# This file is part of Unbeheader.
+# Copyright (C) CERN & UNCONVENTIONAL
+
+import sys
+from textwrap import dedent
+
+import pytest
+import yaml
+
+from unbeheader.api import HeaderSession
+from unbeheader.config import CONFIG_FILE_NAME
+from unbeheader.typing import HeaderStatus
+from unbeheader.util import EXCLUDE_FILE_NAME
+from unbeheader.watch import InotifyWatcher
+from unbeheader.watch import PollingWatcher
+from unbeheader.watch import watch_files
+
+HEADER = '# This file is part of Thelema.\n# Copyright (C) 1904 {owner}\n'
+BODY = "print('Beware of the knowledge you will gain.')\n"
+
+
+def _write_config(dir_path, owner='Ordo Templi Orientis'):
+    config = {
+        'owner': owner,
+        'start_year': 1904,
+        'template': dedent('''
+            {comment_start} This file is part of Thelema.
+            {comment_middle} Copyright (C) {dates} {owner}
+            {comment_end}
+        ''').lstrip()
+    }
+    (dir_path / CONFIG_FILE_NAME).write_text(yaml.dump(config))
+
+
+@pytest.fixture(params=(
+    pytest.param(InotifyWatcher, marks=pytest.mark.skipif(sys.platform != 'linux', reason='inotify is Linux-only')),
+    PollingWatcher,
+))
+def watcher_class(request, monkeypatch):
+    monkeypatch.setattr('unbeheader.watch.POLL_INTERVAL', 0.05)
+    monkeypatch.setattr('unbeheader.watch.DEBOUNCE_DELAY', 0.1)
+    return request.param
+
+
+@pytest.fixture
+def start_watch(watcher_class, tmp_path):
+    """Start watching the directory, returning a function to get the statuses of the next burst."""
+    watches = []
+
+    def start_watch():
+        watcher = watcher_class(tmp_path)
+        results = watch_files(HeaderSession(tmp_path), tmp_path, 1904, check=False, watcher=watcher)
+        watches.append(results)
+        return lambda: {result.file_path.relative_to(tmp_path).as_posix(): result.status
+                        for result in next(results)}
+
+    _write_config(tmp_path)
+    yield start_watch
+    for results in watches:
+        results.close()
+
+
+def test_watch_files(start_watch, tmp_path):
+    watch = start_watch()
+    (tmp_path / 'manuscript.py').write_text(BODY)
+    (tmp_path / 'notes.txt').write_text(BODY)
+    assert watch() == {'manuscript.py': HeaderStatus.ADDED}
+    assert (tmp_path / 'manuscript.py').read_text() == HEADER.format(owner='Ordo Templi Orientis') + f'\n{BODY}'
+    # The files written by the watcher are not processed again
+    (tmp_path / 'other.py').write_text(BODY)
+    assert watch() == {'other.py': HeaderStatus.ADDED}
+
+
+def test_watch_files_for_new_directory(start_watch, tmp_path):
+    watch = start_watch()
+    (tmp_path / 'nested' / 'deeper').mkdir(parents=True)
+    (tmp_path / 'nested' / 'deeper' / 'manuscript.py').write_text(BODY)
+    assert watch() == {'nested/deeper/manuscript.py': HeaderStatus.ADDED}
+
+
+def test_watch_files_for_config_changes(start_watch, tmp_path):
+    watch = start_watch()
+    (tmp_path / 'manuscript.py').write_text(BODY)
+    assert watch() == {'manuscript.py': HeaderStatus.ADDED}
+    _write_config(tmp_path, owner='A∴A∴')
+    assert watch() == {'manuscript.py': HeaderStatus.UPDATED}
+    assert (tmp_path / 'manuscript.py').read_text() == HEADER.format(owner='A∴A∴') + f'\n{BODY}'
+
+
+def test_watch_files_for_exclusions(start_watch, tmp_path):
+    (tmp_path / 'nested').mkdir()
+    (tmp_path / 'nested' / EXCLUDE_FILE_NAME).touch()
+    watch = start_watch()
+    (tmp_path / 'nested' / 'manuscript.py').write_text(BODY)
+    assert watch() == {'nested/manuscript.py': HeaderStatus.SKIPPED}
+    (tmp_path / 'nested' / EXCLUDE_FILE_NAME).unlink()
+    assert watch() == {'nested/manuscript.py': HeaderStatus.ADDED}